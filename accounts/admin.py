@@ -1,6 +1,7 @@
 from django.contrib import admin
 from django.contrib.auth.admin import UserAdmin as BaseUserAdmin
-from .models import User, EmailVerification
+from django.utils import timezone
+from .models import User, EmailVerification, OutboxEmail
 
 
 @admin.register(User)
@@ -26,3 +27,27 @@ class EmailVerificationAdmin(admin.ModelAdmin):
     search_fields = ('user__email', 'user__username', 'token')
     readonly_fields = ('token', 'created_at')
     ordering = ('-created_at',)
+
+
+@admin.register(OutboxEmail)
+class OutboxEmailAdmin(admin.ModelAdmin):
+    """发件箱管理"""
+    list_display = ('to_email', 'subject', 'status', 'attempts', 'next_attempt_at', 'sent_at', 'created_at')
+    list_filter = ('status', 'created_at')
+    search_fields = ('to_email', 'subject')
+    readonly_fields = ('to_email', 'subject', 'body', 'attempts', 'error_message', 'created_at', 'updated_at', 'sent_at')
+    ordering = ('-created_at',)
+    actions = ['resend_emails']
+
+    def resend_emails(self, request, queryset):
+        """重新发送失败的邮件"""
+        from .tasks import deliver_outbox_email
+
+        failed_ids = list(queryset.filter(status=OutboxEmail.STATUS_FAILED).values_list('id', flat=True))
+        OutboxEmail.objects.filter(id__in=failed_ids).update(
+            status=OutboxEmail.STATUS_PENDING, attempts=0, next_attempt_at=timezone.now()
+        )
+        for outbox_id in failed_ids:
+            deliver_outbox_email.delay(outbox_id)
+        self.message_user(request, f'已重新安排发送 {len(failed_ids)} 封邮件。', level='SUCCESS')
+    resend_emails.short_description = "重新发送选中的失败邮件"
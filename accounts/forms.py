@@ -1,7 +1,7 @@
 from django import forms
 from django.contrib.auth.forms import UserCreationForm, AuthenticationForm
-from django.contrib.auth import authenticate
 from .models import User
+from . import throttle
 
 
 class UserRegistrationForm(UserCreationForm):
@@ -46,7 +46,34 @@ class UserRegistrationForm(UserCreationForm):
         return email
 
 
-class UserLoginForm(AuthenticationForm):
+class ThrottledAuthenticationMixin:
+    """
+    登录限流
+    超限时在查询用户、校验密码之前直接拒绝，失败的登录计入按IP和按账号+IP的计数。
+    """
+    throttled = False
+
+    def clean(self):
+        email = self.cleaned_data.get('username')
+        password = self.cleaned_data.get('password')
+        if not (email and password):
+            return super().clean()
+
+        if throttle.check_login(self.request, email):
+            self.throttled = True
+            raise forms.ValidationError('登录尝试次数过多，请稍后再试。', code='throttled')
+
+        try:
+            cleaned_data = super().clean()
+        except forms.ValidationError:
+            if self.user_cache is None:
+                throttle.login_failed(self.request, email)
+            raise
+        throttle.login_succeeded(self.request, email)
+        return cleaned_data
+
+
+class UserLoginForm(ThrottledAuthenticationMixin, AuthenticationForm):
     """用户登录表单"""
     username = forms.EmailField(
         widget=forms.EmailInput(attrs={
@@ -63,19 +90,7 @@ class UserLoginForm(AuthenticationForm):
         label='密码'
     )
 
-    def clean(self):
-        email = self.cleaned_data.get('username')
-        password = self.cleaned_data.get('password')
-
-        if email and password:
-            self.user_cache = authenticate(
-                self.request,
-                username=email,
-                password=password
-            )
-            if self.user_cache is None:
-                raise forms.ValidationError('邮箱或密码错误')
-            else:
-                self.confirm_login_allowed(self.user_cache)
-
-        return self.cleaned_data
+    error_messages = {
+        'invalid_login': '邮箱或密码错误',
+        'inactive': '此账户已被禁用。',
+    }
@@ -0,0 +1,19 @@
+# Generated by Django 4.2.7 on 2026-10-19 17:07
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("accounts", "0002_outboxemail"),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name="emailverification",
+            index=models.Index(
+                fields=["is_used", "created_at"], name="verification_used_created_idx"
+            ),
+        ),
+    ]
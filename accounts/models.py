@@ -1,5 +1,9 @@
-from django.db import models
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import models, transaction
 from django.contrib.auth.models import AbstractUser
+from django.utils import timezone
 
 
 class User(AbstractUser):
@@ -30,6 +34,77 @@ class EmailVerification(models.Model):
     class Meta:
         verbose_name = "邮箱验证"
         verbose_name_plural = "邮箱验证"
+        indexes = [
+            models.Index(fields=['is_used', 'created_at'], name='verification_used_created_idx'),
+        ]
 
     def __str__(self):
         return f"{self.user.email} - {self.token}"
+
+    @staticmethod
+    def expiry_cutoff():
+        """早于该时间创建的验证令牌已过期"""
+        return timezone.now() - timedelta(hours=settings.EMAIL_VERIFICATION_EXPIRE_HOURS)
+
+    @property
+    def is_expired(self):
+        return self.created_at < self.expiry_cutoff()
+
+
+class OutboxEmailManager(models.Manager):
+    """发件箱管理器"""
+
+    def enqueue(self, to_email, subject, body):
+        """
+        写入一封待发送的邮件，所在事务提交后交给Celery发送
+        与业务数据在同一个事务中写入，事务回滚时邮件也不会发出。
+        broker不可用时只记录日志，不影响已提交的业务，邮件由flush_outbox补发。
+        :param to_email: 收件人
+        :param subject: 主题
+        :param body: 正文
+        :return: OutboxEmail对象
+        """
+        from .tasks import deliver_outbox_email
+
+        email = self.create(to_email=to_email, subject=subject, body=body)
+        transaction.on_commit(lambda: deliver_outbox_email.delay(email.id), robust=True)
+        return email
+
+
+class OutboxEmail(models.Model):
+    """发件箱（验证邮件等事务性邮件，由Celery异步发送）"""
+    STATUS_PENDING = 'pending'
+    STATUS_SENDING = 'sending'
+    STATUS_SENT = 'sent'
+    STATUS_FAILED = 'failed'
+    STATUS_CHOICES = [
+        (STATUS_PENDING, '待发送'),
+        (STATUS_SENDING, '发送中'),
+        (STATUS_SENT, '已发送'),
+        (STATUS_FAILED, '发送失败'),
+    ]
+
+    to_email = models.EmailField(verbose_name="收件人")
+    subject = models.CharField(max_length=200, verbose_name="邮件主题")
+    body = models.TextField(verbose_name="邮件内容")
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default=STATUS_PENDING, verbose_name="状态")
+    attempts = models.PositiveIntegerField(default=0, verbose_name="尝试次数")
+    error_message = models.TextField(blank=True, default='', verbose_name="错误信息")
+    next_attempt_at = models.DateTimeField(default=timezone.now, verbose_name="下次发送时间")
+    created_at = models.DateTimeField(auto_now_add=True, verbose_name="创建时间")
+    updated_at = models.DateTimeField(auto_now=True, verbose_name="更新时间")
+    sent_at = models.DateTimeField(null=True, blank=True, verbose_name="发送时间")
+
+    objects = OutboxEmailManager()
+
+    class Meta:
+        verbose_name = "发件箱"
+        verbose_name_plural = "发件箱"
+        ordering = ['-created_at']
+        indexes = [
+            # 定时任务查找到期的待发送邮件
+            models.Index(fields=['status', 'next_attempt_at'], name='outbox_status_next_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.to_email} - {self.subject}"
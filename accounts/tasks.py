@@ -0,0 +1,156 @@
+import time
+from datetime import timedelta
+
+from celery import shared_task
+from django.conf import settings
+from django.core.mail import send_mail
+from django.db.models import F, Q
+from django.utils import timezone
+from monitoring.metrics import SMTP_SEND_FAILURES, SMTP_SEND_SECONDS
+from subscriptions.retry import ERROR_PERMANENT, backoff_delay, classify_error
+from weatherblog.celery import apply_deferred
+from .models import User, EmailVerification, OutboxEmail
+import logging
+
+logger = logging.getLogger(__name__)
+
+# 发送中的邮件超过该时间（秒）没有结果，视为worker异常退出，重新发送
+SENDING_TIMEOUT = 600
+
+
+@shared_task(acks_late=True, reject_on_worker_lost=True)
+def deliver_outbox_email(outbox_id):
+    """
+    发送发件箱中的一封邮件
+    先把状态从待发送改为发送中，只有抢到的worker才会发送，避免重复投递。
+    """
+    claimed = OutboxEmail.objects.filter(
+        pk=outbox_id,
+        status=OutboxEmail.STATUS_PENDING,
+    ).update(status=OutboxEmail.STATUS_SENDING, attempts=F('attempts') + 1, updated_at=timezone.now())
+    if not claimed:
+        return False
+
+    email = OutboxEmail.objects.get(pk=outbox_id)
+    started = time.perf_counter()
+    try:
+        send_mail(
+            subject=email.subject,
+            message=email.body,
+            from_email=settings.DEFAULT_FROM_EMAIL,
+            recipient_list=[email.to_email],
+            fail_silently=False,
+        )
+    except Exception as e:
+        error_class = classify_error(e)
+        SMTP_SEND_FAILURES.labels('outbox', error_class).inc()
+        if error_class == ERROR_PERMANENT or email.attempts >= settings.EMAIL_RETRY_MAX_ATTEMPTS:
+            email.status = OutboxEmail.STATUS_FAILED
+            email.error_message = str(e)
+            email.save(update_fields=['status', 'error_message', 'updated_at'])
+            logger.error(f"发件箱邮件发送失败: {email.to_email} - 尝试 {email.attempts} 次 - {e}")
+            return False
+
+        countdown = backoff_delay(email.attempts)
+        email.status = OutboxEmail.STATUS_PENDING
+        email.error_message = str(e)
+        email.next_attempt_at = timezone.now() + timedelta(seconds=countdown)
+        email.save(update_fields=['status', 'error_message', 'next_attempt_at', 'updated_at'])
+        apply_deferred(deliver_outbox_email, args=[email.id], countdown=countdown)
+        logger.warning(f"发件箱邮件将在 {countdown} 秒后重试: {email.to_email} - {e}")
+        return False
+
+    SMTP_SEND_SECONDS.labels('outbox').observe(time.perf_counter() - started)
+    email.status = OutboxEmail.STATUS_SENT
+    email.sent_at = timezone.now()
+    email.error_message = ''
+    email.save(update_fields=['status', 'sent_at', 'error_message', 'updated_at'])
+    logger.info(f"发件箱邮件发送成功: {email.to_email} - {email.subject}")
+    return True
+
+
+@shared_task
+def flush_outbox():
+    """
+    补发到期的发件箱邮件
+    处理事务提交后任务没有投递成功（如broker不可用）、worker异常退出等情况。
+    """
+    now = timezone.now()
+
+    # 发送中超时的邮件重新置为待发送
+    OutboxEmail.objects.filter(
+        status=OutboxEmail.STATUS_SENDING,
+        updated_at__lt=now - timedelta(seconds=SENDING_TIMEOUT),
+    ).update(status=OutboxEmail.STATUS_PENDING, updated_at=now)
+
+    # 留出一段时间给已经安排的任务，避免与其重复入队（重复入队也只会发送一次）
+    due_ids = list(OutboxEmail.objects.filter(
+        status=OutboxEmail.STATUS_PENDING,
+        next_attempt_at__lt=now - timedelta(seconds=60),
+    ).values_list('id', flat=True)[:500])
+    for outbox_id in due_ids:
+        deliver_outbox_email.delay(outbox_id)
+
+    if due_ids:
+        logger.info(f"补发发件箱邮件 {len(due_ids)} 封")
+    return len(due_ids)
+
+
+def _delete_in_batches(queryset, batch_size, max_batches):
+    """
+    按主键分批删除，每批是一个独立的小事务，避免长时间锁表
+    :return: 删除的行数（不含级联删除的关联数据）
+    """
+    model = queryset.model
+    deleted = 0
+    for _ in range(max_batches):
+        ids = list(queryset.values_list('pk', flat=True)[:batch_size])
+        if not ids:
+            break
+        model.objects.filter(pk__in=ids).delete()
+        deleted += len(ids)
+        if len(ids) < batch_size:
+            break
+    return deleted
+
+
+@shared_task
+def cleanup_expired_verifications():
+    """
+    清理已使用的邮箱验证令牌，以及长期未验证的注册账户
+    未验证账户的过期令牌要保留，用户点击过期链接时据此重新发送验证邮件；
+    这些令牌随账户在UNVERIFIED_USER_RETENTION_DAYS后一起删除（外键级联）。
+    每次运行最多删除 批大小 × 批数 行，剩余的留给下一次运行。
+    """
+    from subscriptions.dashboard import invalidate_stats
+
+    batch_size = settings.ACCOUNT_CLEANUP_BATCH_SIZE
+    max_batches = settings.ACCOUNT_CLEANUP_MAX_BATCHES
+
+    token_count = _delete_in_batches(
+        EmailVerification.objects.filter(
+            Q(is_used=True) | Q(user__is_email_verified=True)
+        ),
+        batch_size, max_batches,
+    )
+
+    # 注册后一直没有验证邮箱、从未登录、也没有订阅的账户
+    abandoned_cutoff = timezone.now() - timedelta(days=settings.UNVERIFIED_USER_RETENTION_DAYS)
+    user_count = _delete_in_batches(
+        User.objects.filter(
+            is_active=False,
+            is_email_verified=False,
+            is_staff=False,
+            last_login__isnull=True,
+            date_joined__lt=abandoned_cutoff,
+            subscription__isnull=True,
+        ),
+        batch_size, max_batches,
+    )
+
+    if user_count:
+        invalidate_stats()
+
+    message = f"清理了 {token_count} 个验证令牌, {user_count} 个未验证账户"
+    logger.info(message)
+    return message
@@ -1,3 +1,273 @@
-from django.test import TestCase
+import smtplib
+from datetime import timedelta
+from unittest import mock
 
-# Create your tests here.
+from django.core import mail
+from django.core.cache import cache
+from django.test import TestCase, override_settings
+from django.urls import reverse
+from django.utils import timezone
+
+from .models import User, EmailVerification, OutboxEmail
+from .throttle import SlidingWindowThrottle, first_limited
+from .tasks import SENDING_TIMEOUT, cleanup_expired_verifications, deliver_outbox_email, flush_outbox
+
+
+class OutboxEmailTests(TestCase):
+    """发件箱：抢占发送、失败重试、补发"""
+
+    def setUp(self):
+        cache.clear()
+        with self.captureOnCommitCallbacks():
+            self.email = OutboxEmail.objects.enqueue('new@example.com', '邮箱验证', '请点击链接')
+
+    def test_claim_sends_once(self):
+        self.assertTrue(deliver_outbox_email(self.email.id))
+        # 已发送的邮件不会被再次抢到
+        self.assertFalse(deliver_outbox_email(self.email.id))
+
+        self.email.refresh_from_db()
+        self.assertEqual(self.email.status, OutboxEmail.STATUS_SENT)
+        self.assertEqual(self.email.attempts, 1)
+        self.assertEqual(len(mail.outbox), 1)
+
+    def test_sending_email_is_not_claimed(self):
+        OutboxEmail.objects.filter(pk=self.email.id).update(status=OutboxEmail.STATUS_SENDING)
+
+        self.assertFalse(deliver_outbox_email(self.email.id))
+        self.assertEqual(len(mail.outbox), 0)
+
+    def test_transient_error_is_retried(self):
+        error = smtplib.SMTPResponseException(451, b'try again later')
+        with mock.patch('accounts.tasks.send_mail', side_effect=error), \
+                mock.patch('accounts.tasks.apply_deferred') as apply_deferred:
+            self.assertFalse(deliver_outbox_email(self.email.id))
+
+        self.email.refresh_from_db()
+        self.assertEqual(self.email.status, OutboxEmail.STATUS_PENDING)
+        self.assertEqual(self.email.attempts, 1)
+        self.assertGreater(self.email.next_attempt_at, timezone.now())
+        apply_deferred.assert_called_once()
+        self.assertEqual(apply_deferred.call_args.kwargs['args'], [self.email.id])
+
+    def test_permanent_error_fails(self):
+        error = smtplib.SMTPResponseException(550, b'no such user')
+        with mock.patch('accounts.tasks.send_mail', side_effect=error), \
+                mock.patch('accounts.tasks.apply_deferred') as apply_deferred:
+            self.assertFalse(deliver_outbox_email(self.email.id))
+
+        self.email.refresh_from_db()
+        self.assertEqual(self.email.status, OutboxEmail.STATUS_FAILED)
+        apply_deferred.assert_not_called()
+
+    def test_flush_resends_stale_and_due(self):
+        stale = timezone.now() - timedelta(seconds=SENDING_TIMEOUT + 60)
+        OutboxEmail.objects.filter(pk=self.email.id).update(
+            status=OutboxEmail.STATUS_SENDING, updated_at=stale, next_attempt_at=stale,
+        )
+
+        self.assertEqual(flush_outbox(), 1)
+
+        self.email.refresh_from_db()
+        self.assertEqual(self.email.status, OutboxEmail.STATUS_SENT)
+
+    def test_flush_skips_recent(self):
+        self.assertEqual(flush_outbox(), 0)
+
+    def test_broker_outage_does_not_fail_registration(self):
+        data = {
+            'username': 'newuser',
+            'email': 'newuser@example.com',
+            'password1': 'S3cure-passw0rd',
+            'password2': 'S3cure-passw0rd',
+        }
+        with mock.patch('accounts.tasks.deliver_outbox_email.delay', side_effect=ConnectionError), \
+                self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post(reverse('accounts:register'), data)
+
+        self.assertRedirects(response, reverse('accounts:login'), fetch_redirect_response=False)
+        self.assertTrue(User.objects.filter(email='newuser@example.com').exists())
+        # 邮件留在发件箱中，由flush_outbox补发
+        self.assertTrue(OutboxEmail.objects.filter(
+            to_email='newuser@example.com', status=OutboxEmail.STATUS_PENDING,
+        ).exists())
+
+
+class EmailVerificationTests(TestCase):
+    """邮箱验证令牌过期与清理"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.pending_user = User.objects.create(
+            username='pending', email='pending@example.com', is_active=False,
+        )
+        cls.verified_user = User.objects.create(
+            username='verified', email='verified@example.com', is_email_verified=True,
+        )
+
+    def setUp(self):
+        cache.clear()
+
+    def create_token(self, user, token, hours_ago=0, is_used=False):
+        verification = EmailVerification.objects.create(user=user, token=token, is_used=is_used)
+        EmailVerification.objects.filter(pk=verification.pk).update(
+            created_at=timezone.now() - timedelta(hours=hours_ago)
+        )
+        verification.refresh_from_db()
+        return verification
+
+    def test_is_expired(self):
+        fresh = self.create_token(self.pending_user, 'fresh', hours_ago=1)
+        expired = self.create_token(self.pending_user, 'expired', hours_ago=49)
+
+        self.assertFalse(fresh.is_expired)
+        self.assertTrue(expired.is_expired)
+
+    def test_expired_link_resends(self):
+        expired = self.create_token(self.pending_user, 'expired', hours_ago=49)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.get(reverse('accounts:verify_email', kwargs={'token': 'expired'}))
+
+        self.assertRedirects(response, reverse('accounts:login'), fetch_redirect_response=False)
+        expired.refresh_from_db()
+        self.assertTrue(expired.is_used)
+        self.assertEqual(EmailVerification.objects.filter(user=self.pending_user, is_used=False).count(), 1)
+        self.assertEqual(len(mail.outbox), 1)
+
+    def test_cleanup_keeps_unverified_tokens(self):
+        self.create_token(self.pending_user, 'used', hours_ago=1, is_used=True)
+        self.create_token(self.pending_user, 'expired', hours_ago=49)
+        self.create_token(self.verified_user, 'leftover', hours_ago=1)
+
+        cleanup_expired_verifications()
+
+        # 未验证账户的过期令牌保留，点击时可以重新发送验证邮件
+        self.assertEqual(
+            list(EmailVerification.objects.values_list('token', flat=True)), ['expired']
+        )
+
+    def test_cleanup_removes_abandoned_users(self):
+        self.create_token(self.pending_user, 'expired', hours_ago=24 * 8)
+        User.objects.filter(pk=self.pending_user.pk).update(date_joined=timezone.now() - timedelta(days=8))
+        recent = User.objects.create(username='recent', email='recent@example.com', is_active=False)
+        self.create_token(recent, 'recent', hours_ago=49)
+
+        cleanup_expired_verifications()
+
+        self.assertFalse(User.objects.filter(pk=self.pending_user.pk).exists())
+        self.assertTrue(User.objects.filter(pk=recent.pk).exists())
+        self.assertEqual(
+            list(EmailVerification.objects.values_list('token', flat=True)), ['recent']
+        )
+
+
+@override_settings(AUTH_THROTTLE_RATES={
+    'login_ip': (4, 300),
+    'login_account': (2, 900),
+    'register_ip': (2, 3600),
+    'test': (3, 60),
+})
+class SlidingWindowThrottleTests(TestCase):
+    """滑动窗口计数"""
+
+    def setUp(self):
+        cache.clear()
+        self.throttle = SlidingWindowThrottle('test')
+
+    def test_limit(self):
+        for _ in range(2):
+            self.throttle.hit('1.2.3.4', now=600)
+        self.assertFalse(self.throttle.is_limited('1.2.3.4', now=610))
+        self.throttle.hit('1.2.3.4', now=610)
+        self.assertTrue(self.throttle.is_limited('1.2.3.4', now=620))
+        self.assertFalse(self.throttle.is_limited('5.6.7.8', now=620))
+
+    def test_previous_window_weight(self):
+        for _ in range(3):
+            self.throttle.hit('1.2.3.4', now=600)
+        # 上一个窗口还剩一半在滑动窗口内
+        self.assertEqual(self.throttle.count('1.2.3.4', now=690), 1.5)
+        self.assertFalse(self.throttle.is_limited('1.2.3.4', now=690))
+        self.assertEqual(self.throttle.count('1.2.3.4', now=720), 0)
+
+    def test_reset(self):
+        for _ in range(3):
+            self.throttle.hit('user@example.com', now=600)
+        self.throttle.reset('USER@example.com ', now=610)
+        self.assertEqual(self.throttle.count('user@example.com', now=610), 0)
+
+    def test_none_ident(self):
+        self.throttle.hit(None)
+        self.assertFalse(self.throttle.is_limited(None))
+
+    def test_first_limited(self):
+        other = SlidingWindowThrottle('login_ip')
+        for _ in range(3):
+            self.throttle.hit('a', now=600)
+        self.assertIs(first_limited([(other, 'a'), (self.throttle, 'a')], now=610), self.throttle)
+        self.assertIsNone(first_limited([(other, 'a'), (self.throttle, None)], now=610))
+
+
+@override_settings(AUTH_THROTTLE_RATES={
+    'login_ip': (4, 300),
+    'login_account': (2, 900),
+    'register_ip': (2, 3600),
+})
+class AuthThrottleViewTests(TestCase):
+    """登录、注册限流返回429"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(
+            username='reader', email='reader@example.com', password='S3cure-passw0rd', is_email_verified=True,
+        )
+
+    def setUp(self):
+        cache.clear()
+
+    def login(self, password, ip='10.0.0.1'):
+        return self.client.post(
+            reverse('accounts:login'),
+            {'username': 'reader@example.com', 'password': password},
+            REMOTE_ADDR=ip,
+        )
+
+    def test_account_limit_is_per_ip(self):
+        for _ in range(2):
+            self.assertEqual(self.login('wrong').status_code, 200)
+        self.assertEqual(self.login('S3cure-passw0rd').status_code, 429)
+
+        # 其他IP上的失败不会锁住该账号
+        response = self.login('S3cure-passw0rd', ip='10.0.0.2')
+        self.assertRedirects(response, reverse('weather:dashboard'), fetch_redirect_response=False)
+
+    def test_ip_limit(self):
+        for index in range(4):
+            self.client.post(
+                reverse('accounts:login'),
+                {'username': f'user{index}@example.com', 'password': 'wrong'},
+                REMOTE_ADDR='10.0.0.1',
+            )
+        self.assertEqual(self.login('S3cure-passw0rd').status_code, 429)
+        self.assertEqual(self.login('S3cure-passw0rd', ip='10.0.0.2').status_code, 302)
+
+    def test_success_resets_account_counter(self):
+        self.login('wrong')
+        self.assertEqual(self.login('S3cure-passw0rd').status_code, 302)
+        self.client.logout()
+        self.login('wrong')
+        self.assertEqual(self.login('S3cure-passw0rd').status_code, 302)
+
+    @override_settings(AUTH_THROTTLE_ENABLED=False)
+    def test_disabled(self):
+        for _ in range(3):
+            self.login('wrong')
+        self.assertEqual(self.login('S3cure-passw0rd').status_code, 302)
+
+    def test_register_limit(self):
+        def register(ip):
+            return self.client.post(reverse('accounts:register'), {}, REMOTE_ADDR=ip).status_code
+
+        self.assertEqual([register('10.0.0.1') for _ in range(3)], [200, 200, 429])
+        self.assertEqual(register('10.0.0.2'), 200)
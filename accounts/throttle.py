@@ -0,0 +1,216 @@
+import hashlib
+import logging
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from django.utils import timezone
+
+logger = logging.getLogger(__name__)
+
+# 限流指标按天保存的时间（秒）
+METRICS_TIMEOUT = 2 * 24 * 3600
+
+METRIC_OUTCOMES = ('allowed', 'failed', 'blocked')
+
+
+def get_client_ip(request):
+    """
+    获取客户端IP
+    部署在nginx后面时REMOTE_ADDR是代理地址，需要通过AUTH_THROTTLE_CLIENT_IP_HEADER
+    指定由代理设置的请求头（如HTTP_X_REAL_IP）。
+    """
+    if request is None:
+        return None
+    header = settings.AUTH_THROTTLE_CLIENT_IP_HEADER
+    if header and request.META.get(header):
+        return request.META[header].split(',')[-1].strip()
+    return request.META.get('REMOTE_ADDR')
+
+
+def _identity(value):
+    """账号等标识统一小写后取摘要，避免缓存键中出现邮箱原文"""
+    return hashlib.md5(str(value).strip().lower().encode('utf-8')).hexdigest()
+
+
+class SlidingWindowThrottle:
+    """
+    滑动窗口计数器
+    按窗口长度分桶计数，当前计数 = 本桶计数 + 上一桶计数 × 上一窗口仍在滑动窗口内的比例。
+    计数保存在缓存（Redis）中，多个进程共享；判断是否超限只需一次缓存读取。
+    """
+
+    def __init__(self, scope, limit=None, window=None):
+        self.scope = scope
+        rate_limit, rate_window = settings.AUTH_THROTTLE_RATES[scope]
+        self.limit = limit or rate_limit
+        self.window = window or rate_window
+
+    def _keys(self, ident, now=None):
+        now = time.time() if now is None else now
+        bucket, offset = divmod(now, self.window)
+        prefix = f'auth_throttle:{self.scope}:{_identity(ident)}'
+        weight = 1 - offset / self.window
+        return f'{prefix}:{int(bucket)}', f'{prefix}:{int(bucket) - 1}', weight
+
+    def count(self, ident, now=None, values=None):
+        """
+        滑动窗口内的估算次数
+        :param values: 已批量读取的缓存值，为空时自行读取
+        """
+        current_key, previous_key, weight = self._keys(ident, now)
+        if values is None:
+            values = cache.get_many([current_key, previous_key])
+        return values.get(current_key, 0) + values.get(previous_key, 0) * weight
+
+    def is_limited(self, ident, now=None):
+        """是否已超过限制"""
+        if ident is None:
+            return False
+        return self.count(ident, now) >= self.limit
+
+    def hit(self, ident, now=None):
+        """记录一次"""
+        if ident is None:
+            return
+        current_key, _, _ = self._keys(ident, now)
+        # 保留两个窗口，计算时还需要上一个桶
+        cache.add(current_key, 0, self.window * 2)
+        try:
+            cache.incr(current_key)
+        except ValueError:
+            # 键在add和incr之间过期
+            cache.set(current_key, 1, self.window * 2)
+
+    def reset(self, ident, now=None):
+        """清除计数（如登录成功后清除该账号的失败次数）"""
+        if ident is None:
+            return
+        current_key, previous_key, _ = self._keys(ident, now)
+        cache.delete_many([current_key, previous_key])
+
+
+def first_limited(checks, now=None):
+    """
+    一次缓存读取检查多个限流器
+    :param checks: [(限流器, 标识), ...]
+    :return: 第一个超限的限流器，没有超限返回None
+    """
+    checks = [(throttle, ident) for throttle, ident in checks if ident is not None]
+    keys = []
+    for throttle, ident in checks:
+        current_key, previous_key, _ = throttle._keys(ident, now)
+        keys.extend([current_key, previous_key])
+    values = cache.get_many(keys) if keys else {}
+
+    for throttle, ident in checks:
+        if throttle.count(ident, now, values) >= throttle.limit:
+            return throttle
+    return None
+
+
+def _metric_key(action, outcome, day=None):
+    day = day or timezone.localdate()
+    return f'auth_throttle:metrics:{day:%Y%m%d}:{action}:{outcome}'
+
+
+def record_metric(action, outcome):
+    """
+    记录限流指标
+    :param action: login / register
+    :param outcome: allowed / failed / blocked
+    """
+    key = _metric_key(action, outcome)
+    cache.add(key, 0, METRICS_TIMEOUT)
+    try:
+        cache.incr(key)
+    except ValueError:
+        cache.set(key, 1, METRICS_TIMEOUT)
+
+
+def throttle_metrics(day=None):
+    """
+    读取某天的限流指标
+    :return: {action: {outcome: 次数}}
+    """
+    actions = ('login', 'register')
+    keys = {
+        _metric_key(action, outcome, day): (action, outcome)
+        for action in actions
+        for outcome in METRIC_OUTCOMES
+    }
+    values = cache.get_many(list(keys))
+    metrics = {action: dict.fromkeys(METRIC_OUTCOMES, 0) for action in actions}
+    for key, (action, outcome) in keys.items():
+        metrics[action][outcome] = values.get(key, 0)
+    return metrics
+
+
+def _account_ident(request, email):
+    """
+    账号限流的标识：账号 + IP
+    只按账号计数时，任何知道邮箱的人都能通过连续输错密码锁住该账号；
+    同一账号来自多个IP的猜测由按IP的限流器限制。
+    """
+    ip = get_client_ip(request)
+    if ip is None:
+        return None
+    return f'{email}|{ip}'
+
+
+def login_checks(request, email):
+    """登录需要检查的限流器：按IP、按账号+IP统计失败次数"""
+    return [
+        (SlidingWindowThrottle('login_ip'), get_client_ip(request)),
+        (SlidingWindowThrottle('login_account'), _account_ident(request, email)),
+    ]
+
+
+def check_login(request, email):
+    """
+    登录前检查是否超限，超限时不再查询用户和校验密码
+    :return: 超限返回True
+    """
+    if not settings.AUTH_THROTTLE_ENABLED:
+        return False
+    throttle = first_limited(login_checks(request, email))
+    if throttle is None:
+        return False
+    record_metric('login', 'blocked')
+    logger.warning(f"登录限流: scope={throttle.scope}, ip={get_client_ip(request)}")
+    return True
+
+
+def login_failed(request, email):
+    """记录一次登录失败"""
+    if not settings.AUTH_THROTTLE_ENABLED:
+        return
+    for throttle, ident in login_checks(request, email):
+        throttle.hit(ident)
+    record_metric('login', 'failed')
+
+
+def login_succeeded(request, email):
+    """登录成功后清除该账号在该IP的失败次数"""
+    if not settings.AUTH_THROTTLE_ENABLED:
+        return
+    SlidingWindowThrottle('login_account').reset(_account_ident(request, email))
+    record_metric('login', 'allowed')
+
+
+def check_register(request):
+    """
+    注册前检查并记录一次注册请求
+    :return: 超限返回True
+    """
+    if not settings.AUTH_THROTTLE_ENABLED:
+        return False
+    ip = get_client_ip(request)
+    throttle = SlidingWindowThrottle('register_ip')
+    if throttle.is_limited(ip):
+        record_metric('register', 'blocked')
+        logger.warning(f"注册限流: ip={ip}")
+        return True
+    throttle.hit(ip)
+    record_metric('register', 'allowed')
+    return False
@@ -2,45 +2,49 @@ from django.shortcuts import render, redirect
 from django.contrib.auth import login, logout
 from django.contrib.auth.decorators import login_required
 from django.contrib import messages
-from django.core.mail import send_mail
 from django.conf import settings
+from django.db import transaction
 from django.urls import reverse
 from django.utils.crypto import get_random_string
 from .forms import UserRegistrationForm, UserLoginForm
-from .models import User, EmailVerification
+from .models import User, EmailVerification, OutboxEmail
+from . import throttle
+
+
+def _send_verification_email(request, user):
+    """创建邮箱验证记录，验证邮件写入发件箱，事务提交后由Celery发送"""
+    token = get_random_string(32)
+    EmailVerification.objects.create(user=user, token=token)
+
+    verification_url = request.build_absolute_uri(
+        reverse('accounts:verify_email', kwargs={'token': token})
+    )
+    OutboxEmail.objects.enqueue(
+        to_email=user.email,
+        subject='天气订阅系统 - 邮箱验证',
+        body=f'请点击以下链接验证您的邮箱：\n{verification_url}\n'
+             f'链接 {settings.EMAIL_VERIFICATION_EXPIRE_HOURS} 小时内有效。',
+    )
 
 
 def register_view(request):
     """用户注册视图"""
     if request.method == 'POST':
+        if throttle.check_register(request):
+            messages.error(request, '注册请求过于频繁，请稍后再试。')
+            return render(request, 'accounts/register.html', {'form': UserRegistrationForm()}, status=429)
+
         form = UserRegistrationForm(request.POST)
         if form.is_valid():
-            user = form.save(commit=False)
-            user.is_active = False  # 需要邮箱验证后才能激活
-            user.save()
-
-            # 创建邮箱验证记录
-            token = get_random_string(32)
-            EmailVerification.objects.create(user=user, token=token)
-
-            # 发送验证邮件
-            verification_url = request.build_absolute_uri(
-                reverse('accounts:verify_email', kwargs={'token': token})
-            )
-
-            try:
-                send_mail(
-                    subject='天气订阅系统 - 邮箱验证',
-                    message=f'请点击以下链接验证您的邮箱：\n{verification_url}',
-                    from_email=settings.DEFAULT_FROM_EMAIL,
-                    recipient_list=[user.email],
-                    fail_silently=False,
-                )
-                messages.success(request, '注册成功！请检查您的邮箱并点击验证链接。')
-                return redirect('accounts:login')
-            except Exception as e:
-                messages.error(request, f'邮件发送失败：{str(e)}')
-                user.delete()  # 删除用户记录
+            with transaction.atomic():
+                user = form.save(commit=False)
+                user.is_active = False  # 需要邮箱验证后才能激活
+                user.save()
+
+                _send_verification_email(request, user)
+
+            messages.success(request, '注册成功！请检查您的邮箱并点击验证链接。')
+            return redirect('accounts:login')
     else:
         form = UserRegistrationForm()
 
@@ -62,7 +66,8 @@ def login_view(request):
     else:
         form = UserLoginForm()
 
-    return render(request, 'accounts/login.html', {'form': form})
+    status = 429 if form.throttled else 200
+    return render(request, 'accounts/login.html', {'form': form}, status=status)
 
 
 def logout_view(request):
@@ -75,21 +80,32 @@ def logout_view(request):
 def verify_email(request, token):
     """邮箱验证视图"""
     try:
-        verification = EmailVerification.objects.get(token=token, is_used=False)
-        user = verification.user
-        user.is_active = True
-        user.is_email_verified = True
-        user.save()
-
-        verification.is_used = True
-        verification.save()
-
-        messages.success(request, '邮箱验证成功！您现在可以登录了。')
-        return redirect('accounts:login')
+        verification = EmailVerification.objects.select_related('user').get(token=token, is_used=False)
     except EmailVerification.DoesNotExist:
         messages.error(request, '验证链接无效或已过期。')
         return redirect('accounts:register')
 
+    user = verification.user
+    if verification.is_expired:
+        # 过期的链接作废，未激活的账户重新发送一封验证邮件
+        with transaction.atomic():
+            verification.is_used = True
+            verification.save(update_fields=['is_used'])
+            if not user.is_email_verified:
+                _send_verification_email(request, user)
+        messages.error(request, '验证链接已过期，我们已重新发送验证邮件，请查收。')
+        return redirect('accounts:login')
+
+    user.is_active = True
+    user.is_email_verified = True
+    user.save()
+
+    verification.is_used = True
+    verification.save()
+
+    messages.success(request, '邮箱验证成功！您现在可以登录了。')
+    return redirect('accounts:login')
+
 
 @login_required
 def profile_view(request):
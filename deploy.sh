@@ -190,6 +190,9 @@ migrate_database() {
     # 收集静态文件
     python manage.py collectstatic --noinput
     
+    # 预编译邮件模板
+    python manage.py build_email_templates
+    
     # 执行迁移
     python manage.py makemigrations
     python manage.py migrate
@@ -313,6 +316,18 @@ autorestart=true
 redirect_stderr=true
 stdout_logfile=$PROJECT_PATH/logs/celery.log
 environment=PATH="$PROJECT_PATH/venv/bin"
+EOF
+    
+    sudo tee /etc/supervisor/conf.d/celery_retry.conf > /dev/null << EOF
+[program:celery_retry]
+command=$PROJECT_PATH/venv/bin/celery -A weatherblog worker -l info -Q email_retry -c 1 -n retry@%%h
+directory=$PROJECT_PATH
+user=$CURRENT_USER
+autostart=true
+autorestart=true
+redirect_stderr=true
+stdout_logfile=$PROJECT_PATH/logs/celery_retry.log
+environment=PATH="$PROJECT_PATH/venv/bin"
 EOF
     
     sudo tee /etc/supervisor/conf.d/celerybeat.conf > /dev/null << EOF
@@ -334,6 +349,7 @@ EOF
     # 启动服务
     sudo supervisorctl start weatherblog
     sudo supervisorctl start celery
+    sudo supervisorctl start celery_retry
     sudo supervisorctl start celerybeat
     
     log_success "Supervisor配置完成"
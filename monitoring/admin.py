@@ -0,0 +1,48 @@
+from django.contrib import admin
+from django.utils.html import format_html, format_html_join
+
+from .models import SlowRequest
+
+
+@admin.register(SlowRequest)
+class SlowRequestAdmin(admin.ModelAdmin):
+    """慢请求管理"""
+    list_display = (
+        'created_at', 'method', 'path', 'view_name', 'status_code', 'duration_ms',
+        'query_count', 'query_time_ms', 'upstream_time_ms', 'has_profile',
+    )
+    list_filter = ('method', 'status_code', 'view_name', 'created_at')
+    search_fields = ('path', 'view_name')
+    ordering = ('-created_at',)
+    list_per_page = 50
+    date_hierarchy = 'created_at'
+    exclude = ('top_queries',)
+    readonly_fields = (
+        'method', 'path', 'view_name', 'status_code', 'user_id', 'duration_ms',
+        'query_count', 'query_time_ms', 'upstream_count', 'upstream_time_ms',
+        'query_report', 'profile_file', 'created_at',
+    )
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_profile(self, obj):
+        return bool(obj.profile_file)
+    has_profile.boolean = True
+    has_profile.short_description = '性能分析'
+
+    def query_report(self, obj):
+        """执行次数最多的查询"""
+        if not obj.top_queries:
+            return '-'
+        rows = format_html_join(
+            '',
+            '<tr><td>{}</td><td>{}</td><td><code>{}</code></td></tr>',
+            ((query['count'], query['time_ms'], query['sql']) for query in obj.top_queries),
+        )
+        return format_html(
+            '<table><thead><tr><th>次数</th><th>耗时(ms)</th><th>SQL</th></tr></thead>'
+            '<tbody>{}</tbody></table>',
+            rows,
+        )
+    query_report.short_description = '主要查询'
@@ -0,0 +1,19 @@
+from django.apps import AppConfig
+from django.conf import settings
+from django.db.backends.signals import connection_created
+
+
+class MonitoringConfig(AppConfig):
+    default_auto_field = "django.db.models.BigAutoField"
+    name = "monitoring"
+    verbose_name = "系统监控"
+
+    def ready(self):
+        # 注册Celery任务耗时信号
+        from . import signals  # noqa: F401
+
+        # 开启请求性能分析时，为数据库连接加上查询统计
+        if settings.REQUEST_PROFILING_ENABLED:
+            from .profiling import install_query_wrapper
+
+            connection_created.connect(install_query_wrapper, dispatch_uid='monitoring_query_wrapper')
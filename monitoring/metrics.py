@@ -0,0 +1,74 @@
+import os
+
+from django.conf import settings
+
+# 多进程模式下，各进程（gunicorn/uvicorn worker、Celery worker子进程）把指标写入共享目录，
+# 由/metrics汇总。必须在导入prometheus_client之前设置环境变量。
+if settings.PROMETHEUS_MULTIPROC_DIR:
+    os.environ.setdefault('PROMETHEUS_MULTIPROC_DIR', str(settings.PROMETHEUS_MULTIPROC_DIR))
+    os.makedirs(os.environ['PROMETHEUS_MULTIPROC_DIR'], exist_ok=True)
+
+from prometheus_client import Counter, Histogram  # noqa: E402
+
+MULTIPROCESS = bool(os.environ.get('PROMETHEUS_MULTIPROC_DIR'))
+
+# 天气API（高德）
+AMAP_REQUEST_SECONDS = Histogram(
+    'weather_amap_request_seconds',
+    '高德天气API请求耗时（秒）',
+    ['extensions'],
+    buckets=(0.05, 0.1, 0.25, 0.5, 1, 2, 5, 10),
+)
+AMAP_REQUESTS = Counter(
+    'weather_amap_requests_total',
+    '高德天气API请求次数',
+    ['outcome'],  # ok / api_error / http_error / decode_error
+)
+
+# 天气缓存
+WEATHER_CACHE_REQUESTS = Counter(
+    'weather_cache_requests_total',
+    '天气缓存读取次数',
+    ['cache', 'result'],  # cache: read_model / city_section, result: hit / miss
+)
+
+# 邮件模板渲染
+TEMPLATE_RENDER_SECONDS = Histogram(
+    'email_template_render_seconds',
+    '邮件模板渲染耗时（秒）',
+    ['template'],
+    buckets=(0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25),
+)
+
+# SMTP发送
+SMTP_SEND_SECONDS = Histogram(
+    'email_smtp_send_seconds',
+    'SMTP发送耗时（秒）',
+    ['source'],  # weather / outbox
+    buckets=(0.1, 0.25, 0.5, 1, 2, 5, 10, 30),
+)
+SMTP_SEND_FAILURES = Counter(
+    'email_smtp_send_failures_total',
+    'SMTP发送失败次数',
+    ['source', 'error_class'],  # error_class: transient / permanent
+)
+
+# Celery任务
+CELERY_TASK_SECONDS = Histogram(
+    'celery_task_seconds',
+    'Celery任务执行耗时（秒）',
+    ['task', 'state'],
+    buckets=(0.05, 0.1, 0.5, 1, 5, 10, 30, 60, 300, 1800, 3600),
+)
+
+# 每日投递
+DELIVERY_RUN_SECONDS = Histogram(
+    'delivery_run_seconds',
+    '每日天气邮件任务执行耗时（秒）',
+    buckets=(10, 30, 60, 300, 600, 1800, 3600, 7200, 14400),
+)
+DELIVERY_EMAILS = Counter(
+    'delivery_emails_total',
+    '每日天气邮件任务处理的邮件数',
+    ['outcome'],  # sent / failed / deferred
+)
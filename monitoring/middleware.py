@@ -0,0 +1,143 @@
+import cProfile
+import logging
+import random
+import re
+import threading
+import time
+from pathlib import Path
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, sync_to_async
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.utils import timezone
+
+from . import profiling
+from .models import SlowRequest
+
+logger = logging.getLogger(__name__)
+
+# 同一时间只运行一个cProfile，避免并发的同步请求互相干扰
+_profiler_lock = threading.Lock()
+
+_UNSAFE_FILENAME_RE = re.compile(r'[^A-Za-z0-9_-]+')
+
+
+class RequestProfilingMiddleware:
+    """
+    请求性能分析中间件
+    记录每个请求的耗时、数据库查询次数和耗时、上游HTTP请求耗时，超过阈值的请求写入慢请求表；
+    按采样率对部分同步请求运行cProfile，采样到的请求如果变慢，把分析结果保存到磁盘。
+    异步请求只记录耗时、查询和上游请求统计，不运行cProfile：cProfile按线程采样，
+    同一事件循环中交替执行的其他请求也会被计入，结果不能代表单个请求。
+    REQUEST_PROFILING_ENABLED为False时中间件不会加载，没有任何额外开销。
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        if not settings.REQUEST_PROFILING_ENABLED:
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        self.slow_ms = settings.REQUEST_PROFILING_SLOW_MS
+        self.sample_rate = settings.REQUEST_PROFILING_SAMPLE_RATE
+        self.profile_dir = Path(settings.REQUEST_PROFILING_DIR)
+        self.exclude = tuple(settings.REQUEST_PROFILING_EXCLUDE)
+        self.is_async = iscoroutinefunction(get_response)
+        if self.is_async:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.is_async:
+            return self.__acall__(request)
+        if request.path.startswith(self.exclude):
+            return self.get_response(request)
+
+        profiler = self._start_profiler()
+        profile, token = profiling.start()
+        started = time.perf_counter()
+        try:
+            response = self.get_response(request)
+        finally:
+            elapsed = time.perf_counter() - started
+            profiling.stop(token)
+            self._stop_profiler(profiler)
+
+        if elapsed * 1000 >= self.slow_ms:
+            self._record(request, response, profile, elapsed, profiler)
+        return response
+
+    async def __acall__(self, request):
+        if request.path.startswith(self.exclude):
+            return await self.get_response(request)
+
+        # 不运行cProfile，见类说明
+        profile, token = profiling.start()
+        started = time.perf_counter()
+        try:
+            response = await self.get_response(request)
+        finally:
+            elapsed = time.perf_counter() - started
+            profiling.stop(token)
+
+        if elapsed * 1000 >= self.slow_ms:
+            await sync_to_async(self._record)(request, response, profile, elapsed, None)
+        return response
+
+    def _start_profiler(self):
+        """按采样率决定是否分析本次请求"""
+        if random.random() >= self.sample_rate or not _profiler_lock.acquire(blocking=False):
+            return None
+        profiler = cProfile.Profile()
+        try:
+            profiler.enable()
+        except ValueError:
+            # 已有其他分析工具在运行
+            _profiler_lock.release()
+            return None
+        return profiler
+
+    @staticmethod
+    def _stop_profiler(profiler):
+        if profiler is not None:
+            profiler.disable()
+            _profiler_lock.release()
+
+    def _dump_profile(self, request, profiler, elapsed):
+        """保存cProfile结果，可用snakeviz或pstats查看"""
+        self.profile_dir.mkdir(parents=True, exist_ok=True)
+        slug = _UNSAFE_FILENAME_RE.sub('_', request.path.strip('/'))[:80] or 'root'
+        path = self.profile_dir / (
+            f"{timezone.localtime():%Y%m%d-%H%M%S}-{request.method}-{slug}-{elapsed * 1000:.0f}ms.prof"
+        )
+        profiler.dump_stats(path)
+        return str(path)
+
+    def _record(self, request, response, profile, elapsed, profiler):
+        """写入慢请求记录"""
+        try:
+            profile_file = self._dump_profile(request, profiler, elapsed) if profiler else ''
+            match = getattr(request, 'resolver_match', None)
+            user = getattr(request, 'user', None)
+            SlowRequest.objects.create(
+                method=request.method,
+                path=request.path[:500],
+                view_name=(match.view_name if match else '')[:200],
+                status_code=response.status_code,
+                user_id=user.pk if user is not None and user.is_authenticated else None,
+                duration_ms=round(elapsed * 1000),
+                query_count=profile.query_count,
+                query_time_ms=round(profile.query_time * 1000),
+                upstream_count=profile.upstream_count,
+                upstream_time_ms=round(profile.upstream_time * 1000),
+                top_queries=profile.top_queries(),
+                profile_file=profile_file,
+            )
+        except Exception as e:
+            # 记录失败不能影响请求本身
+            logger.warning(f"慢请求记录失败: {request.path} - {e}")
+        else:
+            logger.warning(
+                f"慢请求: {request.method} {request.path} {elapsed * 1000:.0f}ms, "
+                f"查询 {profile.query_count} 次/{profile.query_time * 1000:.0f}ms, "
+                f"上游 {profile.upstream_count} 次/{profile.upstream_time * 1000:.0f}ms"
+            )
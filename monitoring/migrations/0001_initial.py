@@ -0,0 +1,88 @@
+# Generated by Django 4.2.7 on 2026-10-19 17:14
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    initial = True
+
+    dependencies = []
+
+    operations = [
+        migrations.CreateModel(
+            name="SlowRequest",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("method", models.CharField(max_length=10, verbose_name="请求方法")),
+                ("path", models.CharField(max_length=500, verbose_name="请求路径")),
+                (
+                    "view_name",
+                    models.CharField(
+                        blank=True, default="", max_length=200, verbose_name="视图"
+                    ),
+                ),
+                (
+                    "status_code",
+                    models.PositiveSmallIntegerField(verbose_name="状态码"),
+                ),
+                (
+                    "user_id",
+                    models.BigIntegerField(
+                        blank=True, null=True, verbose_name="用户ID"
+                    ),
+                ),
+                ("duration_ms", models.PositiveIntegerField(verbose_name="耗时(ms)")),
+                (
+                    "query_count",
+                    models.PositiveIntegerField(default=0, verbose_name="查询次数"),
+                ),
+                (
+                    "query_time_ms",
+                    models.PositiveIntegerField(default=0, verbose_name="查询耗时(ms)"),
+                ),
+                (
+                    "upstream_count",
+                    models.PositiveIntegerField(default=0, verbose_name="上游请求次数"),
+                ),
+                (
+                    "upstream_time_ms",
+                    models.PositiveIntegerField(
+                        default=0, verbose_name="上游请求耗时(ms)"
+                    ),
+                ),
+                (
+                    "top_queries",
+                    models.JSONField(blank=True, default=list, verbose_name="主要查询"),
+                ),
+                (
+                    "profile_file",
+                    models.CharField(
+                        blank=True,
+                        default="",
+                        max_length=500,
+                        verbose_name="性能分析文件",
+                    ),
+                ),
+                (
+                    "created_at",
+                    models.DateTimeField(
+                        auto_now_add=True, db_index=True, verbose_name="记录时间"
+                    ),
+                ),
+            ],
+            options={
+                "verbose_name": "慢请求",
+                "verbose_name_plural": "慢请求",
+                "ordering": ["-created_at"],
+            },
+        ),
+    ]
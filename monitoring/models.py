@@ -0,0 +1,26 @@
+from django.db import models
+
+
+class SlowRequest(models.Model):
+    """慢请求记录（由请求性能分析中间件写入）"""
+    method = models.CharField(max_length=10, verbose_name="请求方法")
+    path = models.CharField(max_length=500, verbose_name="请求路径")
+    view_name = models.CharField(max_length=200, blank=True, default='', verbose_name="视图")
+    status_code = models.PositiveSmallIntegerField(verbose_name="状态码")
+    user_id = models.BigIntegerField(null=True, blank=True, verbose_name="用户ID")
+    duration_ms = models.PositiveIntegerField(verbose_name="耗时(ms)")
+    query_count = models.PositiveIntegerField(default=0, verbose_name="查询次数")
+    query_time_ms = models.PositiveIntegerField(default=0, verbose_name="查询耗时(ms)")
+    upstream_count = models.PositiveIntegerField(default=0, verbose_name="上游请求次数")
+    upstream_time_ms = models.PositiveIntegerField(default=0, verbose_name="上游请求耗时(ms)")
+    top_queries = models.JSONField(default=list, blank=True, verbose_name="主要查询")
+    profile_file = models.CharField(max_length=500, blank=True, default='', verbose_name="性能分析文件")
+    created_at = models.DateTimeField(auto_now_add=True, db_index=True, verbose_name="记录时间")
+
+    class Meta:
+        verbose_name = "慢请求"
+        verbose_name_plural = "慢请求"
+        ordering = ['-created_at']
+
+    def __str__(self):
+        return f"{self.method} {self.path} - {self.duration_ms}ms"
@@ -0,0 +1,81 @@
+import re
+import time
+from contextvars import ContextVar
+
+# 当前请求的性能记录，未开启请求性能分析或不在请求中时为None。
+# 使用ContextVar，异步视图中通过sync_to_async执行的查询也能计入同一个请求。
+_current = ContextVar('request_profile', default=None)
+
+# 合并SQL中的参数，N+1查询归为同一条
+_NUMBER_RE = re.compile(r'\b\d+\b')
+_IN_LIST_RE = re.compile(r'IN \([^)]*\)')
+_STRING_RE = re.compile(r"'[^']*'")
+
+
+def normalize_sql(sql):
+    """去掉SQL中的具体参数值"""
+    sql = _STRING_RE.sub('?', sql)
+    sql = _IN_LIST_RE.sub('IN (...)', sql)
+    return _NUMBER_RE.sub('?', sql)
+
+
+class RequestProfile:
+    """一次请求的数据库查询和上游HTTP请求统计"""
+
+    def __init__(self):
+        self.query_count = 0
+        self.query_time = 0.0
+        self.upstream_count = 0
+        self.upstream_time = 0.0
+        self.queries = {}  # {规整后的SQL: [次数, 耗时]}
+
+    def add_query(self, sql, seconds):
+        self.query_count += 1
+        self.query_time += seconds
+        entry = self.queries.setdefault(normalize_sql(sql), [0, 0.0])
+        entry[0] += 1
+        entry[1] += seconds
+
+    def top_queries(self, limit=5):
+        """执行次数最多的查询，N+1查询会排在最前面"""
+        top = sorted(self.queries.items(), key=lambda item: (item[1][0], item[1][1]), reverse=True)[:limit]
+        return [
+            {'sql': sql[:500], 'count': count, 'time_ms': round(seconds * 1000, 2)}
+            for sql, (count, seconds) in top
+        ]
+
+
+def start():
+    """开始记录当前请求"""
+    profile = RequestProfile()
+    return profile, _current.set(profile)
+
+
+def stop(token):
+    _current.reset(token)
+
+
+def record_query(execute, sql, params, many, context):
+    """数据库连接的execute_wrapper，统计当前请求的查询次数和耗时"""
+    profile = _current.get()
+    if profile is None:
+        return execute(sql, params, many, context)
+    started = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        profile.add_query(sql, time.perf_counter() - started)
+
+
+def install_query_wrapper(sender=None, connection=None, **kwargs):
+    """新建的数据库连接都加上查询统计"""
+    if record_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(record_query)
+
+
+def add_upstream_time(seconds):
+    """记录一次上游HTTP请求（如天气API）的耗时"""
+    profile = _current.get()
+    if profile is not None:
+        profile.upstream_count += 1
+        profile.upstream_time += seconds
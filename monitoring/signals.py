@@ -0,0 +1,32 @@
+import os
+import time
+
+from celery.signals import task_postrun, task_prerun, worker_process_shutdown
+
+from .metrics import CELERY_TASK_SECONDS, MULTIPROCESS
+
+# 正在执行的任务开始时间 {task_id: 开始时间}
+_task_started = {}
+
+
+@task_prerun.connect
+def record_task_start(task_id=None, **kwargs):
+    _task_started[task_id] = time.perf_counter()
+
+
+@task_postrun.connect
+def record_task_duration(task_id=None, task=None, state=None, **kwargs):
+    started = _task_started.pop(task_id, None)
+    if started is None or task is None:
+        return
+    CELERY_TASK_SECONDS.labels(task.name, state or 'UNKNOWN').observe(time.perf_counter() - started)
+
+
+@worker_process_shutdown.connect
+def mark_process_dead(pid=None, **kwargs):
+    """Celery子进程退出时清理其多进程指标文件中的实时数据"""
+    if not MULTIPROCESS:
+        return
+    from prometheus_client import multiprocess
+
+    multiprocess.mark_process_dead(pid or os.getpid())
@@ -0,0 +1,39 @@
+import logging
+from datetime import timedelta
+from pathlib import Path
+
+from celery import shared_task
+from django.conf import settings
+from django.utils import timezone
+
+from .models import SlowRequest
+
+logger = logging.getLogger(__name__)
+
+
+@shared_task
+def cleanup_old_slow_requests():
+    """
+    清理旧的慢请求记录和cProfile分析文件（保留REQUEST_PROFILING_RETENTION_DAYS天）
+    关闭请求性能分析后仍会清理之前留下的记录和文件。
+    """
+    cutoff = timezone.now() - timedelta(days=settings.REQUEST_PROFILING_RETENTION_DAYS)
+
+    deleted_count, _ = SlowRequest.objects.filter(created_at__lt=cutoff).delete()
+
+    file_count = 0
+    profile_dir = Path(settings.REQUEST_PROFILING_DIR)
+    if profile_dir.is_dir():
+        cutoff_timestamp = cutoff.timestamp()
+        for path in profile_dir.glob('*.prof'):
+            try:
+                if path.stat().st_mtime < cutoff_timestamp:
+                    path.unlink()
+                    file_count += 1
+            except FileNotFoundError:
+                # 文件已被其他进程删除
+                pass
+
+    message = f"清理了 {deleted_count} 条慢请求记录, {file_count} 个性能分析文件"
+    logger.info(message)
+    return message
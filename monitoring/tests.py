@@ -0,0 +1,110 @@
+import os
+import tempfile
+import time
+from datetime import timedelta
+from pathlib import Path
+from unittest import mock
+
+from asgiref.sync import async_to_sync
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connection
+from django.http import HttpResponse
+from django.test import RequestFactory, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+
+from accounts.models import User
+from .middleware import RequestProfilingMiddleware
+from .models import SlowRequest
+from .profiling import record_query
+from .tasks import cleanup_old_slow_requests
+
+
+class RequestProfilingMiddlewareTests(TestCase):
+    """请求性能分析中间件"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.staff = User.objects.create(
+            username='staff', email='staff@example.com', is_staff=True, is_superuser=True
+        )
+
+    @override_settings(REQUEST_PROFILING_ENABLED=False)
+    def test_not_loaded_when_disabled(self):
+        with self.assertRaises(MiddlewareNotUsed):
+            RequestProfilingMiddleware(lambda request: None)
+
+    @override_settings(
+        REQUEST_PROFILING_ENABLED=True, REQUEST_PROFILING_SLOW_MS=0, REQUEST_PROFILING_SAMPLE_RATE=0,
+    )
+    def test_slow_request_recorded(self):
+        self.client.force_login(self.staff)
+        # 开启请求性能分析时由MonitoringConfig.ready()给新连接加上查询统计，测试中手动加上
+        with connection.execute_wrapper(record_query), CaptureQueriesContext(connection) as captured:
+            response = self.client.get(reverse('admin:index'))
+        self.assertEqual(response.status_code, 200)
+
+        slow = SlowRequest.objects.get()
+        self.assertEqual(slow.method, 'GET')
+        self.assertEqual(slow.path, reverse('admin:index'))
+        self.assertEqual(slow.view_name, 'admin:index')
+        self.assertEqual(slow.user_id, self.staff.pk)
+        self.assertEqual(slow.profile_file, '')
+        # 最后一条是写入慢请求记录本身，不计入请求
+        self.assertIn('monitoring_slowrequest', captured.captured_queries[-1]['sql'])
+        self.assertEqual(slow.query_count, len(captured) - 1)
+        self.assertEqual(sum(query['count'] for query in slow.top_queries), slow.query_count)
+
+    @override_settings(
+        REQUEST_PROFILING_ENABLED=True, REQUEST_PROFILING_SLOW_MS=0, REQUEST_PROFILING_SAMPLE_RATE=1,
+    )
+    def test_async_request_not_sampled(self):
+        async def get_response(request):
+            return HttpResponse()
+
+        middleware = RequestProfilingMiddleware(get_response)
+        with mock.patch('monitoring.middleware.cProfile.Profile') as profile_class:
+            async_to_sync(middleware)(RequestFactory().get('/api/weather/110000/'))
+
+        profile_class.assert_not_called()
+        self.assertEqual(SlowRequest.objects.get().profile_file, '')
+
+
+class CleanupSlowRequestsTests(TestCase):
+    """慢请求记录和性能分析文件的清理任务"""
+
+    def setUp(self):
+        profile_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(profile_dir.cleanup)
+        self.profile_dir = Path(profile_dir.name)
+        overrides = self.settings(REQUEST_PROFILING_DIR=self.profile_dir, REQUEST_PROFILING_RETENTION_DAYS=14)
+        overrides.enable()
+        self.addCleanup(overrides.disable)
+
+    def create_slow_request(self, days_ago):
+        slow = SlowRequest.objects.create(method='GET', path='/dashboard/', status_code=200, duration_ms=800)
+        SlowRequest.objects.filter(pk=slow.pk).update(created_at=timezone.now() - timedelta(days=days_ago))
+        return slow
+
+    def create_profile(self, name, days_ago):
+        path = self.profile_dir / name
+        path.write_bytes(b'')
+        modified = time.time() - days_ago * 86400
+        os.utime(path, (modified, modified))
+        return path
+
+    def test_cleanup(self):
+        self.create_slow_request(days_ago=30)
+        recent = self.create_slow_request(days_ago=1)
+        old_profile = self.create_profile('20250101-060000-GET-dashboard-800ms.prof', days_ago=30)
+        recent_profile = self.create_profile('20250201-060000-GET-dashboard-800ms.prof', days_ago=1)
+        other_file = self.create_profile('README', days_ago=30)
+
+        message = cleanup_old_slow_requests()
+
+        self.assertEqual(message, "清理了 1 条慢请求记录, 1 个性能分析文件")
+        self.assertEqual(list(SlowRequest.objects.all()), [recent])
+        self.assertFalse(old_profile.exists())
+        self.assertTrue(recent_profile.exists())
+        self.assertTrue(other_file.exists())
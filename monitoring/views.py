@@ -0,0 +1,59 @@
+import logging
+
+from django.conf import settings
+from django.http import HttpResponse, HttpResponseForbidden
+from prometheus_client import CONTENT_TYPE_LATEST, REGISTRY, CollectorRegistry, generate_latest, multiprocess
+from prometheus_client.core import GaugeMetricFamily
+
+from accounts.throttle import get_client_ip
+from . import metrics
+
+logger = logging.getLogger(__name__)
+
+
+class QueueDepthCollector:
+    """抓取时读取Celery各队列（Redis列表）中等待执行的任务数"""
+
+    def _family(self):
+        return GaugeMetricFamily('celery_queue_length', 'Celery队列中等待执行的任务数', labels=['queue'])
+
+    def describe(self):
+        # 注册时不读取Redis
+        yield self._family()
+
+    def collect(self):
+        gauge = self._family()
+        broker_url = settings.CELERY_BROKER_URL
+        if broker_url.startswith('redis://'):
+            try:
+                import redis
+
+                client = redis.Redis.from_url(broker_url, socket_timeout=1)
+                pipe = client.pipeline()
+                for queue in settings.METRICS_CELERY_QUEUES:
+                    pipe.llen(queue)
+                for queue, length in zip(settings.METRICS_CELERY_QUEUES, pipe.execute()):
+                    gauge.add_metric([queue], length)
+            except Exception as e:
+                logger.warning(f"读取Celery队列长度失败: {e}")
+        yield gauge
+
+
+def _build_registry():
+    """多进程模式下每次抓取时汇总各进程写入的指标文件"""
+    registry = CollectorRegistry()
+    multiprocess.MultiProcessCollector(registry)
+    registry.register(QueueDepthCollector())
+    return registry
+
+
+if not metrics.MULTIPROCESS:
+    REGISTRY.register(QueueDepthCollector())
+
+
+def metrics_view(request):
+    """Prometheus指标（文本格式），只允许白名单IP和管理员访问"""
+    if get_client_ip(request) not in settings.METRICS_ALLOWED_IPS and not request.user.is_staff:
+        return HttpResponseForbidden()
+    registry = _build_registry() if metrics.MULTIPROCESS else REGISTRY
+    return HttpResponse(generate_latest(registry), content_type=CONTENT_TYPE_LATEST)
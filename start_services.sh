@@ -130,7 +130,8 @@ start_celery_worker() {
     
     source venv/bin/activate
     
-    nohup celery -A weatherblog worker -l info > logs/celery_worker.log 2>&1 &
+    # 开发环境中同一个worker同时处理默认队列和失败重试队列
+    nohup celery -A weatherblog worker -l info -Q celery,email_retry > logs/celery_worker.log 2>&1 &
     WORKER_PID=$!
     
     sleep 3
@@ -1,5 +1,7 @@
+from collections import defaultdict
+
 from django.contrib import admin
-from django.utils.html import format_html
+from django.utils.html import format_html, format_html_join
 from django.urls import reverse
 from django.utils.safestring import mark_safe
 from django.http import JsonResponse
@@ -7,7 +9,11 @@ from django.shortcuts import get_object_or_404
 from django.contrib.admin.views.decorators import staff_member_required
 from django.views.decorators.http import require_POST
 from django.views.decorators.csrf import csrf_exempt
-from .models import Subscription, EmailLog
+from weatherblog.exports import ExportActionsMixin
+from weatherblog.paginator import EstimatedCountPaginator
+from weatherblog.timing import PASS_LABELS, STAGES
+from .fragments import bump_subscription_versions
+from .models import Subscription, EmailLog, DeliveryRun, Delivery, DeadLetter, DailyStats
 
 
 @admin.register(Subscription)
@@ -18,6 +24,10 @@ class SubscriptionAdmin(admin.ModelAdmin):
     search_fields = ('user__email', 'user__username', 'city__name', 'email')
     ordering = ('-created_at',)
     list_per_page = 50
+    # 城市名称需要逐级显示上级城市
+    list_select_related = ('user', 'city__parent__parent__parent')
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
     actions = ['activate_subscriptions', 'deactivate_subscriptions', 'send_test_emails']
     actions = ['activate_subscriptions', 'deactivate_subscriptions']
 
@@ -72,7 +82,9 @@ class SubscriptionAdmin(admin.ModelAdmin):
 
     def activate_subscriptions(self, request, queryset):
         """批量激活订阅"""
+        user_ids = set(queryset.values_list('user_id', flat=True))
         updated = queryset.update(is_active=True)
+        bump_subscription_versions(user_ids)
         self.message_user(
             request,
             f'成功激活了 {updated} 个订阅。',
@@ -82,7 +94,9 @@ class SubscriptionAdmin(admin.ModelAdmin):
 
     def deactivate_subscriptions(self, request, queryset):
         """批量停用订阅"""
+        user_ids = set(queryset.values_list('user_id', flat=True))
         updated = queryset.update(is_active=False)
+        bump_subscription_versions(user_ids)
         self.message_user(
             request,
             f'成功停用了 {updated} 个订阅。',
@@ -140,20 +154,42 @@ class SubscriptionAdmin(admin.ModelAdmin):
 
 
 @admin.register(EmailLog)
-class EmailLogAdmin(admin.ModelAdmin):
+class EmailLogAdmin(ExportActionsMixin, admin.ModelAdmin):
     """邮件日志管理"""
     list_display = ('subscription_info', 'email', 'subject', 'is_sent', 'sent_at', 'status')
     list_filter = ('is_sent', 'sent_at')
     search_fields = ('email', 'subject', 'subscription__user__username')
     ordering = ('-sent_at',)
     list_per_page = 50
+    # 按发送时间范围筛选，使用 (sent_at, is_sent) 索引
+    date_hierarchy = 'sent_at'
+    list_select_related = ('subscription__user', 'subscription__city__parent__parent__parent')
+    # 订阅数量很多，详情页不渲染订阅下拉框
+    raw_id_fields = ('subscription',)
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+    actions = ['export_csv', 'export_csv_gzip', 'export_jsonl', 'export_jsonl_gzip']
+    # 导出字段：(字段查找路径, 列名)
+    export_fields = (
+        ('id', 'id'),
+        ('sent_at', 'sent_at'),
+        ('email', 'email'),
+        ('subject', 'subject'),
+        ('is_sent', 'is_sent'),
+        ('error_message', 'error_message'),
+        ('subscription_id', 'subscription_id'),
+        ('city_ids', 'city_ids'),
+        ('subscription__user__username', 'username'),
+        ('subscription__city__adcode', 'city_adcode'),
+        ('subscription__city__name', 'city_name'),
+    )
 
     fieldsets = (
         ('邮件信息', {
-            'fields': ('subscription', 'email', 'subject', 'is_sent')
+            'fields': ('subscription', 'city_ids', 'email', 'subject', 'is_sent')
         }),
         ('内容', {
-            'fields': ('content',),
+            'fields': ('body_content',),
             'classes': ('collapse',)
         }),
         ('错误信息', {
@@ -166,7 +202,24 @@ class EmailLogAdmin(admin.ModelAdmin):
         }),
     )
 
-    readonly_fields = ('sent_at',)
+    readonly_fields = ('sent_at', 'body_content', 'city_ids')
+
+    def get_queryset(self, request):
+        queryset = super().get_queryset(request)
+        if request.resolver_match and request.resolver_match.url_name.endswith('_changelist'):
+            # 列表页不显示错误详情，避免加载大文本字段
+            queryset = queryset.defer('error_message')
+        return queryset
+
+    def body_content(self, obj):
+        """邮件正文（仅在详情页加载）"""
+        if not obj.body_id:
+            return '-'
+        return format_html(
+            '<pre style="white-space: pre-wrap; max-height: 500px; overflow: auto;">{}</pre>',
+            obj.body.content
+        )
+    body_content.short_description = '邮件内容'
 
     def subscription_info(self, obj):
         """订阅信息"""
@@ -190,6 +243,173 @@ class EmailLogAdmin(admin.ModelAdmin):
     status.short_description = '状态'
 
 
+@admin.register(DeliveryRun)
+class DeliveryRunAdmin(admin.ModelAdmin):
+    """投递任务管理"""
+    list_display = ('run_key', 'status', 'total_count', 'progress_info', 'wall_time', 'stage_p95', 'created_at', 'finished_at')
+    list_filter = ('status', 'created_at')
+    search_fields = ('run_key',)
+    ordering = ('-created_at',)
+    list_per_page = 50
+    readonly_fields = ('run_key', 'status', 'total_count', 'progress_info', 'created_at', 'finished_at', 'timing_report')
+    exclude = ('timing',)
+
+    # 列表中显示p95的阶段，部署前后对比这几列即可看出哪个阶段变慢
+    LIST_STAGES = ('amap', 'render', 'smtp', 'log')
+
+    def progress_info(self, obj):
+        """投递进度"""
+        progress = obj.progress()
+        return format_html(
+            '<span style="color: green;">已发送 {}</span> / '
+            '<span style="color: red;">失败 {}</span> / '
+            '等待重试 {} / 延后 {} / 待发送 {}',
+            progress[Delivery.STATUS_SENT],
+            progress[Delivery.STATUS_FAILED],
+            progress[Delivery.STATUS_RETRYING],
+            progress[Delivery.STATUS_DEFERRED],
+            progress[Delivery.STATUS_PENDING] + progress[Delivery.STATUS_SENDING],
+        )
+    progress_info.short_description = '进度'
+
+    def wall_time(self, obj):
+        """发送耗时"""
+        if not obj.timing:
+            return '-'
+        return f"{obj.timing['wall']:.1f} 秒"
+    wall_time.short_description = '发送耗时'
+
+    def stage_p95(self, obj):
+        """主要阶段的p95耗时"""
+        stages = obj.timing.get('stages', {}) if obj.timing else {}
+        labels = dict(STAGES)
+        items = [
+            (labels[name], f"{stages[name]['p95'] * 1000:.0f}ms")
+            for name in self.LIST_STAGES if name in stages
+        ]
+        return format_html_join(' / ', '{} {}', items) or '-'
+    stage_p95.short_description = '阶段p95'
+
+    def timing_report(self, obj):
+        """分阶段耗时、最慢城市和最慢收件人"""
+        if not obj.timing:
+            return '暂无耗时统计'
+        stages = obj.timing.get('stages', {})
+        stage_rows = format_html_join(
+            '',
+            '<tr><td>{}</td><td>{}</td><td>{}</td><td>{}</td><td>{}</td><td>{}</td></tr>',
+            (
+                (label, stages[name]['count'], f"{stages[name]['total']:.2f}",
+                 f"{stages[name]['p50'] * 1000:.0f}", f"{stages[name]['p95'] * 1000:.0f}",
+                 f"{stages[name]['max'] * 1000:.0f}")
+                for name, label in STAGES if name in stages
+            ),
+        )
+        cities = format_html_join(
+            '', '<li>{} - {} 秒</li>',
+            ((city, f"{seconds:.2f}") for city, seconds in obj.timing.get('slowest_cities', []))
+        )
+        recipients = format_html_join(
+            '', '<li>{} - {} 秒</li>',
+            ((email, f"{seconds:.2f}") for email, seconds in obj.timing.get('slowest_recipients', []))
+        )
+        passes = format_html_join(
+            '', '<li>{} - {} 秒, 发送 {} 封</li>',
+            (
+                (PASS_LABELS.get(item['label'], item['label'] or '-'), f"{item['wall']:.2f}",
+                 item['stages'].get('smtp', {}).get('count', 0))
+                for item in obj.timing.get('passes', [])
+            )
+        )
+        return format_html(
+            '<table><thead><tr><th>阶段</th><th>次数</th><th>合计(秒)</th>'
+            '<th>p50(ms)</th><th>p95(ms)</th><th>最大(ms)</th></tr></thead>'
+            '<tbody>{}</tbody></table>'
+            '<p><strong>最慢城市（天气获取和渲染累计）</strong></p><ol>{}</ol>'
+            '<p><strong>最慢收件人</strong></p><ol>{}</ol>'
+            '<p><strong>各次执行</strong></p><ol>{}</ol>',
+            stage_rows, cities, recipients, passes,
+        )
+    timing_report.short_description = '耗时统计'
+
+
+@admin.register(Delivery)
+class DeliveryAdmin(admin.ModelAdmin):
+    """投递记录管理"""
+    list_display = ('run', 'subscription', 'status', 'attempts', 'updated_at')
+    list_filter = ('status', 'run')
+    search_fields = ('subscription__email', 'run__run_key')
+    list_select_related = ('run', 'subscription__user', 'subscription__city')
+    raw_id_fields = ('run', 'subscription')
+    list_per_page = 50
+
+
+@admin.register(DeadLetter)
+class DeadLetterAdmin(admin.ModelAdmin):
+    """死信邮件管理"""
+    list_display = ('subscription', 'error_class', 'attempts', 'short_error', 'created_at')
+    list_filter = ('error_class', 'created_at')
+    search_fields = ('subscription__email', 'error_message')
+    list_select_related = ('subscription__user', 'subscription__city')
+    raw_id_fields = ('subscription', 'run')
+    readonly_fields = ('created_at',)
+    ordering = ('-created_at',)
+    list_per_page = 50
+    actions = ['redrive_dead_letters']
+
+    def short_error(self, obj):
+        """错误信息摘要"""
+        return obj.error_message[:80]
+    short_error.short_description = '错误信息'
+
+    def redrive_dead_letters(self, request, queryset):
+        """重新投递选中的死信邮件"""
+        from django.conf import settings
+        from .tasks import retry_weather_email
+
+        # 同一收件邮箱、同一投递任务的死信合并为一封邮件重新投递
+        groups = defaultdict(list)
+        for dead_letter in queryset.select_related('subscription'):
+            groups[(dead_letter.subscription.email, dead_letter.run_id)].append(dead_letter.subscription_id)
+
+        for (_, run_id), subscription_ids in groups.items():
+            retry_weather_email.apply_async(
+                args=[subscription_ids],
+                kwargs={'attempt': 1, 'run_id': run_id},
+                queue=settings.EMAIL_RETRY_QUEUE,
+            )
+        count, _ = queryset.delete()
+
+        self.message_user(
+            request,
+            f'已重新投递 {count} 封死信邮件（合并为 {len(groups)} 封邮件）。',
+            level='SUCCESS'
+        )
+    redrive_dead_letters.short_description = "重新投递选中的死信邮件"
+
+
+@admin.register(DailyStats)
+class DailyStatsAdmin(admin.ModelAdmin):
+    """每日统计管理（只读，由信号和backfill_daily_stats命令维护）"""
+    list_display = ('date', 'scope', 'users_joined', 'subscriptions_created', 'emails_sent', 'emails_failed', 'updated_at')
+    list_filter = ('date',)
+    search_fields = ('city__name',)
+    list_select_related = ('city',)
+    ordering = ('-date',)
+    list_per_page = 50
+
+    def scope(self, obj):
+        """统计范围"""
+        return obj.city.name if obj.city_id else '全站'
+    scope.short_description = '范围'
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+
 # 自定义Admin站点标题
 admin.site.site_header = '天气订阅系统管理后台'
 admin.site.site_title = '天气订阅系统'
@@ -4,3 +4,7 @@ from django.apps import AppConfig
 class SubscriptionsConfig(AppConfig):
     default_auto_field = "django.db.models.BigAutoField"
     name = "subscriptions"
+
+    def ready(self):
+        # 注册每日统计信号
+        from . import signals  # noqa: F401
@@ -0,0 +1,185 @@
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Count, OuterRef, Q, Subquery, Sum
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+
+from accounts.models import User
+from weather.models import City
+from .models import Subscription, EmailLog, DailyStats
+
+CACHE_PREFIX = 'admin_stats'
+
+# 重新计算统计时的锁超时时间（秒）
+LOCK_TIMEOUT = 30
+
+# 过期统计的保留时间，重新计算期间其他请求读取这份数据
+STALE_TIMEOUT = 24 * 3600
+
+
+def build_dashboard_stats():
+    """计算管理员仪表板的统计数据"""
+
+    # 用户统计
+    user_counts = User.objects.aggregate(
+        total=Count('id'),
+        active=Count('id', filter=Q(is_active=True)),
+        verified=Count('id', filter=Q(is_email_verified=True)),
+    )
+
+    # 订阅统计
+    subscription_counts = Subscription.objects.aggregate(
+        total=Count('id'),
+        active=Count('id', filter=Q(is_active=True)),
+    )
+
+    # 城市统计
+    city_counts = City.objects.aggregate(
+        total=Count('id', distinct=True),
+        subscribed=Count('subscription__city', distinct=True),
+    )
+
+    # 邮件统计（最近30天，读取每日统计）
+    thirty_days_ago = timezone.localdate() - timedelta(days=29)
+    email_counts = DailyStats.objects.filter(
+        date__gte=thirty_days_ago, city_key=0
+    ).aggregate(
+        successful=Coalesce(Sum('emails_sent'), 0),
+        failed=Coalesce(Sum('emails_failed'), 0),
+    )
+    successful_emails = email_counts['successful']
+    total_emails = successful_emails + email_counts['failed']
+
+    # 最近注册的用户
+    recent_users = User.objects.order_by('-date_joined')[:10]
+
+    # 最新的订阅（城市名称需要逐级显示上级城市）
+    recent_subscriptions = Subscription.objects.select_related(
+        'user', 'city__parent__parent__parent'
+    ).order_by('-created_at')[:10]
+
+    # 热门城市（订阅数最多的城市）
+    popular_cities = City.objects.select_related('parent__parent__parent').annotate(
+        subscription_count=Count('subscription')
+    ).filter(subscription_count__gt=0).order_by('-subscription_count')[:10]
+
+    # 最近的邮件日志
+    recent_email_logs = EmailLog.objects.select_related(
+        'subscription__user', 'subscription__city'
+    ).order_by('-sent_at')[:10]
+
+    # 每日新增用户、邮件发送统计（最近7天）
+    daily_stats = DailyStats.objects.series(7)
+    daily_user_stats = [
+        {'date': stat['date'].strftime('%m-%d'), 'count': stat['users_joined']}
+        for stat in daily_stats
+    ]
+    daily_email_stats = [
+        {'date': stat['date'].strftime('%m-%d'), 'sent': stat['emails_sent'], 'failed': stat['emails_failed']}
+        for stat in daily_stats
+    ]
+
+    return {
+        # 基础统计
+        'total_users': user_counts['total'],
+        'active_users': user_counts['active'],
+        'verified_users': user_counts['verified'],
+        'total_subscriptions': subscription_counts['total'],
+        'active_subscriptions': subscription_counts['active'],
+        'total_cities': city_counts['total'],
+        'subscribed_cities': city_counts['subscribed'],
+
+        # 邮件统计
+        'total_emails': total_emails,
+        'successful_emails': successful_emails,
+        'failed_emails': email_counts['failed'],
+        'email_success_rate': round(successful_emails / total_emails * 100, 1) if total_emails > 0 else 0,
+
+        # 列表数据（转换为列表以便缓存）
+        'recent_users': list(recent_users),
+        'recent_subscriptions': list(recent_subscriptions),
+        'popular_cities': list(popular_cities),
+        'recent_email_logs': list(recent_email_logs),
+
+        # 图表数据
+        'daily_user_stats': daily_user_stats,
+        'daily_email_stats': daily_email_stats,
+    }
+
+
+def build_user_statistics():
+    """计算用户统计页面的数据"""
+
+    # 用户注册趋势（最近30天）
+    user_trend = [
+        {'date': stat['date'].strftime('%Y-%m-%d'), 'count': stat['users_joined']}
+        for stat in DailyStats.objects.series(30)
+    ]
+
+    # 用户状态分布
+    user_status = User.objects.aggregate(
+        active=Count('id', filter=Q(is_active=True)),
+        inactive=Count('id', filter=Q(is_active=False)),
+        verified=Count('id', filter=Q(is_email_verified=True)),
+        unverified=Count('id', filter=Q(is_email_verified=False)),
+    )
+
+    # 用户订阅分布（先用子查询算出每个用户的订阅数，再按订阅数分组）
+    user_subscription_count = Subscription.objects.filter(
+        user=OuterRef('pk')
+    ).order_by().values('user').annotate(total=Count('id')).values('total')
+    subscription_distribution = User.objects.annotate(
+        subscription_count=Coalesce(Subquery(user_subscription_count), 0)
+    ).values('subscription_count').annotate(
+        user_count=Count('id')
+    ).order_by('subscription_count')
+
+    return {
+        'user_trend': user_trend,
+        'user_status': user_status,
+        'subscription_distribution': list(subscription_distribution),
+    }
+
+
+STATS_BUILDERS = {
+    'dashboard': build_dashboard_stats,
+    'user_statistics': build_user_statistics,
+}
+
+
+def get_stats(name, refresh=False):
+    """
+    获取缓存的统计数据，缓存失效时重新计算
+    同一时间只有一个请求重新计算，其他请求先使用上一次的结果。
+    :param name: 统计名称（dashboard / user_statistics）
+    :param refresh: 是否忽略缓存强制重新计算
+    :return: 统计数据字典，包含计算时间computed_at
+    """
+    key = f'{CACHE_PREFIX}:{name}'
+    stale_key = f'{key}:stale'
+
+    stats = None if refresh else cache.get(key)
+    if stats is not None:
+        return stats
+
+    lock_key = f'{key}:lock'
+    if not cache.add(lock_key, 1, LOCK_TIMEOUT):
+        stats = cache.get(stale_key)
+        if stats is not None:
+            return stats
+
+    try:
+        stats = STATS_BUILDERS[name]()
+        stats['computed_at'] = timezone.now()
+        cache.set(key, stats, settings.ADMIN_STATS_CACHE_TIMEOUT)
+        cache.set(stale_key, stats, STALE_TIMEOUT)
+    finally:
+        cache.delete(lock_key)
+    return stats
+
+
+def invalidate_stats():
+    """使缓存的统计数据失效（过期数据保留，供重新计算期间使用）"""
+    cache.delete_many([f'{CACHE_PREFIX}:{name}' for name in STATS_BUILDERS])
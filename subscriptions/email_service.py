@@ -2,18 +2,49 @@ from django.core.mail import EmailMultiAlternatives
 from django.template.loader import render_to_string
 from django.conf import settings
 from django.utils import timezone
+from django.utils.safestring import mark_safe
+from monitoring.metrics import WEATHER_CACHE_REQUESTS
 from weather.services import WeatherService
-from .models import EmailLog
+from weatherblog.timing import stage
+from .models import EmailLog, EmailBody, DailyStats
+from .retry import classify_error, schedule_retry, ERROR_TRANSIENT
+from .email_templates import render_email
+from .dashboard import invalidate_stats
+from .sender_pool import SenderPool
+from .throttle import SendScheduler, is_throttle_error
+from contextlib import nullcontext
+from itertools import groupby
+from operator import attrgetter
 import logging
+import time
 
 logger = logging.getLogger(__name__)
 
+# 单封邮件的投递结果
+DELIVERY_SENT = 'sent'
+DELIVERY_FAILED = 'failed'
+DELIVERY_THROTTLED = 'throttled'
+
 
 class EmailService:
     """邮件发送服务"""
     
-    def __init__(self):
-        self.weather_service = WeatherService()
+    def __init__(self, timer=None):
+        """
+        :param timer: 投递任务的分阶段计时器（weatherblog.timing.StageTimer），为空时不计时
+        """
+        self.timer = timer
+        self.weather_service = WeatherService(timer=timer)
+        self.sender_pool = SenderPool()
+        self.last_error = ''  # 最近一次投递失败的错误信息
+        self.last_error_class = ''  # 最近一次投递失败的错误分类
+        self.failed_subscriptions = []  # 最近一封摘要邮件中未能投递的订阅
+        self._city_sections = {}  # 本次发送中已渲染的城市天气片段
+        # 批量发送的总额度为账号池内所有账号额度之和
+        self.scheduler = SendScheduler(
+            per_minute=self.sender_pool.per_minute,
+            per_day=self.sender_pool.per_day,
+        )
     
     def send_weather_email(self, subscription):
         """
@@ -21,6 +52,16 @@ class EmailService:
         :param subscription: 订阅对象
         :return: 是否发送成功
         """
+        return self.deliver_weather_email(subscription) == DELIVERY_SENT
+
+    def deliver_weather_email(self, subscription):
+        """
+        发送天气邮件并返回投递结果
+        :param subscription: 订阅对象
+        :return: DELIVERY_SENT / DELIVERY_FAILED / DELIVERY_THROTTLED
+        """
+        self.last_error = ''
+        self.last_error_class = ''
         try:
             # 获取天气数据
             weather_info = self.weather_service.get_weather_for_email(
@@ -29,12 +70,10 @@ class EmailService:
             
             if not weather_info:
                 logger.error(f"无法获取天气数据: {subscription.city.name}")
-                self._log_email_error(
-                    subscription, 
-                    "天气数据获取失败", 
-                    f"无法获取 {subscription.city.name} 的天气数据"
-                )
-                return False
+                self.last_error = f"无法获取 {subscription.city.name} 的天气数据"
+                self.last_error_class = ERROR_TRANSIENT
+                self._log_email_error([subscription], "天气数据获取失败", self.last_error)
+                return DELIVERY_FAILED
             
             # 准备邮件内容
             context = {
@@ -47,7 +86,7 @@ class EmailService:
             
             # 渲染邮件模板
             subject = f"☀️ {weather_info['city_name']} 今日天气预报"
-            html_content = render_to_string('emails/weather_report.html', context)
+            html_content = render_email('emails/weather_report.html', context)
             text_content = render_to_string('emails/weather_report.txt', context)
             
             # 创建邮件
@@ -60,19 +99,148 @@ class EmailService:
             email.attach_alternative(html_content, "text/html")
             
             # 发送邮件
-            email.send()
+            self.sender_pool.send(email)
             
             # 记录发送成功
-            self._log_email_success(subscription, subject, html_content)
+            self._log_email_success([subscription], subject, html_content)
             logger.info(f"天气邮件发送成功: {subscription.email} - {weather_info['city_name']}")
             
-            return True
+            return DELIVERY_SENT
 
         except Exception as e:
-            error_msg = str(e)
-            logger.error(f"发送天气邮件失败: {subscription.email} - {error_msg}")
-            self._log_email_error(subscription, "邮件发送失败", error_msg)
-            return False
+            return self._handle_send_error([subscription], e)
+
+    def deliver_weather_digest(self, subscriptions):
+        """
+        把同一接收邮箱的多个订阅合并为一封天气摘要邮件发送
+        每个城市的天气片段在本次发送中只获取、渲染一次，供所有订阅者共用。
+        个别城市的天气获取失败时照常发送其余城市，未能投递的订阅保存在failed_subscriptions中。
+        :param subscriptions: 同一接收邮箱的订阅列表
+        :return: DELIVERY_SENT / DELIVERY_FAILED / DELIVERY_THROTTLED
+        """
+        self.last_error = ''
+        self.last_error_class = ''
+        self.failed_subscriptions = []
+        first = subscriptions[0]
+        try:
+            sections = []
+            city_sections = {}
+            failed_cities = []
+            included = []
+            for subscription in subscriptions:
+                if subscription.city_id not in city_sections:
+                    section = city_sections[subscription.city_id] = self._get_city_section(subscription.city)
+                    if section:
+                        sections.append(section)
+                    else:
+                        logger.error(f"无法获取天气数据: {subscription.city.name}")
+                        failed_cities.append(subscription.city.name)
+                if city_sections[subscription.city_id]:
+                    included.append(subscription)
+                else:
+                    self.failed_subscriptions.append(subscription)
+
+            if failed_cities:
+                self.last_error = f"无法获取 {'、'.join(failed_cities)} 的天气数据"
+                self.last_error_class = ERROR_TRANSIENT
+            if not sections:
+                with stage(self.timer, 'log'):
+                    self._log_email_error(subscriptions, "天气数据获取失败", self.last_error)
+                return DELIVERY_FAILED
+
+            context = {
+                'sections': sections,
+                'current_date': timezone.now().strftime('%Y年%m月%d日'),
+                'website_url': self._get_website_url(),
+            }
+
+            if len(sections) == 1:
+                subject = f"☀️ {sections[0]['city_name']} 今日天气预报"
+            else:
+                subject = f"☀️ {sections[0]['short_name']}等{len(sections)}个城市今日天气预报"
+            with stage(self.timer, 'render'):
+                html_content = render_email('emails/weather_digest.html', context)
+                text_content = render_to_string('emails/weather_digest.txt', context)
+
+            email = EmailMultiAlternatives(
+                subject=subject,
+                body=text_content,
+                from_email=settings.DEFAULT_FROM_EMAIL,
+                to=[first.email]
+            )
+            email.attach_alternative(html_content, "text/html")
+            with stage(self.timer, 'smtp'):
+                self.sender_pool.send(email)
+
+            # 一封摘要邮件只记录一条日志，未包含的城市记在错误信息中，由投递记录和重试跟踪
+            with stage(self.timer, 'log'):
+                self._log_email_success(included, subject, html_content, error_message=self.last_error or None)
+            logger.info(f"天气摘要邮件发送成功: {first.email} - {len(sections)} 个城市")
+
+            return DELIVERY_SENT
+
+        except Exception as e:
+            self.failed_subscriptions = list(subscriptions)
+            return self._handle_send_error(subscriptions, e)
+
+    def record_digest_result(self, subscriptions, result, run=None, attempt=1):
+        """
+        记录一封摘要邮件的投递结果，未能投递的订阅（天气获取失败或发送失败）安排重试
+        :param subscriptions: 摘要邮件包含的订阅列表
+        :param result: deliver_weather_digest的返回值（不含DELIVERY_THROTTLED）
+        :param run: 所属投递任务
+        :param attempt: 本次是第几次尝试
+        """
+        failed = self.failed_subscriptions if result == DELIVERY_SENT else list(subscriptions)
+        if run:
+            failed_ids = [subscription.id for subscription in failed]
+            delivered_ids = [subscription.id for subscription in subscriptions if subscription.id not in failed_ids]
+            if delivered_ids:
+                run.record(delivered_ids, DELIVERY_SENT)
+            if failed_ids:
+                run.record(failed_ids, DELIVERY_FAILED, self.last_error)
+        if failed:
+            schedule_retry(failed, self.last_error_class, self.last_error, attempt=attempt, run=run)
+
+    def _get_city_section(self, city):
+        """获取城市的天气邮件片段，获取失败时返回None"""
+        if city.adcode in self._city_sections:
+            WEATHER_CACHE_REQUESTS.labels('city_section', 'hit').inc()
+        else:
+            WEATHER_CACHE_REQUESTS.labels('city_section', 'miss').inc()
+            section = None
+            weather_info = self.weather_service.get_weather_for_email(city.adcode)
+            if weather_info:
+                context = {
+                    'city_name': weather_info['city_name'],
+                    'current': weather_info['current'],
+                    'forecast': weather_info['forecast'][:4],  # 只显示4天预报
+                }
+                with stage(self.timer, 'render', f"{city.name}({city.adcode})"):
+                    section = {
+                        'city_name': weather_info['city_name'],
+                        'short_name': city.name,
+                        'reporttime': weather_info['current']['reporttime'],
+                        'html': mark_safe(render_email('emails/_city_section.html', context)),
+                        'text': render_to_string('emails/_city_section.txt', context),
+                    }
+            self._city_sections[city.adcode] = section
+        return self._city_sections[city.adcode]
+
+    def _handle_send_error(self, subscriptions, error):
+        """记录发送异常并返回投递结果"""
+        email = subscriptions[0].email
+        error_msg = self.last_error = str(error)
+        self.last_error_class = classify_error(error)
+        if is_throttle_error(error):
+            # 服务商限流，不记为失败，由调用方延后重发
+            logger.warning(f"邮件服务商限流: {email} - {error_msg}")
+            self.scheduler.penalize()
+            return DELIVERY_THROTTLED
+        logger.error(f"发送天气邮件失败: {email} - {error_msg}")
+        with stage(self.timer, 'log'):
+            self._log_email_error(subscriptions, "邮件发送失败", error_msg)
+        return DELIVERY_FAILED
 
     def send_test_weather_email(self, subscription):
         """
@@ -89,7 +257,7 @@ class EmailService:
             if not weather_info:
                 logger.error(f"无法获取天气数据: {subscription.city.name}")
                 self._log_email_error(
-                    subscription,
+                    [subscription],
                     "测试邮件 - 天气数据获取失败",
                     f"无法获取 {subscription.city.name} 的天气数据"
                 )
@@ -107,7 +275,7 @@ class EmailService:
 
             # 渲染邮件模板
             subject = f"🧪 [测试邮件] {weather_info['city_name']} 天气预报"
-            html_content = render_to_string('emails/weather_report.html', context)
+            html_content = render_email('emails/weather_report.html', context)
             text_content = render_to_string('emails/weather_report.txt', context)
 
             # 创建邮件
@@ -120,10 +288,10 @@ class EmailService:
             email.attach_alternative(html_content, "text/html")
 
             # 发送邮件
-            email.send()
+            self.sender_pool.send(email)
 
             # 记录发送成功
-            self._log_email_success(subscription, subject, html_content)
+            self._log_email_success([subscription], subject, html_content)
             logger.info(f"测试天气邮件发送成功: {subscription.email} - {weather_info['city_name']}")
 
             return True
@@ -131,47 +299,129 @@ class EmailService:
         except Exception as e:
             error_msg = str(e)
             logger.error(f"发送测试天气邮件失败: {subscription.email} - {error_msg}")
-            self._log_email_error(subscription, "测试邮件发送失败", error_msg)
+            self._log_email_error([subscription], "测试邮件发送失败", error_msg)
             return False
 
-    def send_bulk_weather_emails(self, subscriptions):
+    def send_bulk_weather_emails(self, subscriptions, run=None):
         """
         批量发送天气邮件
-        :param subscriptions: 订阅列表
-        :return: (成功数量, 失败数量)
+        同一接收邮箱的多个订阅合并为一封摘要邮件，subscriptions需要按email排序。
+        按发送调度器的限额控制速度，超出限额的邮件延后到之后的时间槽发送。
+        :param subscriptions: 按email排序的订阅列表或迭代器
+        :param run: 投递任务，指定时跳过已投递的订阅并记录每个订阅的投递结果
+        :return: (成功邮件数, 失败邮件数, 延后邮件数)
         """
         success_count = 0
         failure_count = 0
+        deferred_count = 0
+        skipped_count = 0
+        max_wait = settings.EMAIL_SEND_MAX_WAIT
         
-        for subscription in subscriptions:
-            if self.send_weather_email(subscription):
-                success_count += 1
-            else:
-                failure_count += 1
+        # 每日统计在内存中累计后批量写入，不逐封更新
+        with DailyStats.objects.batch():
+            for email, group in groupby(subscriptions, key=attrgetter('email')):
+                with self._recipient(email):
+                    group = list(group)
+                    if run:
+                        # 已被其他worker投递或正在投递的订阅不再发送
+                        with stage(self.timer, 'claim'):
+                            group = [subscription for subscription in group if run.claim(subscription.id)]
+                        if not group:
+                            skipped_count += 1
+                            continue
+
+                    with stage(self.timer, 'wait'):
+                        slot = self.scheduler.reserve()
+                        wait = (slot - timezone.now()).total_seconds()
+                        if 0 < wait <= max_wait:
+                            time.sleep(wait)
+
+                    if wait > max_wait:
+                        with stage(self.timer, 'record'):
+                            self._defer(group, slot, run)
+                        deferred_count += 1
+                        continue
+
+                    result = self.deliver_weather_digest(group)
+                    if result == DELIVERY_SENT:
+                        success_count += 1
+                    elif result == DELIVERY_THROTTLED:
+                        with stage(self.timer, 'record'):
+                            self._defer(group, self.scheduler.reserve(), run)
+                        deferred_count += 1
+                        continue
+                    else:
+                        failure_count += 1
+
+                    with stage(self.timer, 'record'):
+                        self.record_digest_result(group, result, run=run)
+
+        self.sender_pool.close()
+        invalidate_stats()
         
-        logger.info(f"批量发送完成: 成功 {success_count}, 失败 {failure_count}")
-        return success_count, failure_count
+        logger.info(
+            f"批量发送完成: 成功 {success_count}, 失败 {failure_count}, "
+            f"延后 {deferred_count}, 跳过 {skipped_count}"
+        )
+        return success_count, failure_count, deferred_count
+
+    def _recipient(self, email):
+        """统计处理一个收件人的总耗时"""
+        return self.timer.recipient(email) if self.timer is not None else nullcontext()
+
+    def _defer(self, subscriptions, slot, run=None):
+        """把同一接收邮箱的订阅安排到指定时间槽再发送"""
+        from weatherblog.celery import apply_deferred
+        from .models import Delivery
+        from .tasks import send_weather_digest
+
+        subscription_ids = [subscription.id for subscription in subscriptions]
+        if run:
+            run.record(subscription_ids, Delivery.STATUS_DEFERRED)
+        apply_deferred(
+            send_weather_digest,
+            args=[subscription_ids],
+            kwargs={'run_id': run.id if run else None},
+            eta=slot,
+        )
+        logger.info(
+            f"邮件延后发送: {subscriptions[0].email} - {timezone.localtime(slot):%Y-%m-%d %H:%M}"
+        )
     
-    def _log_email_success(self, subscription, subject, content):
-        """记录邮件发送成功"""
+    def _log_email_success(self, subscriptions, subject, content, error_message=None):
+        """
+        记录邮件发送成功（一封邮件一条日志）
+        :param subscriptions: 邮件包含的订阅列表
+        :param error_message: 部分城市未能包含时的说明
+        """
         EmailLog.objects.create(
-            subscription=subscription,
-            email=subscription.email,
+            subscription=subscriptions[0],
+            city_ids=self._city_ids(subscriptions),
+            email=subscriptions[0].email,
             subject=subject,
-            content=content,
-            is_sent=True
+            body=EmailBody.objects.store(content),
+            is_sent=True,
+            error_message=error_message
         )
     
-    def _log_email_error(self, subscription, subject, error_message):
-        """记录邮件发送失败"""
+    def _log_email_error(self, subscriptions, subject, error_message):
+        """
+        记录邮件发送失败（一封邮件一条日志）
+        :param subscriptions: 邮件包含的订阅列表
+        """
         EmailLog.objects.create(
-            subscription=subscription,
-            email=subscription.email,
+            subscription=subscriptions[0],
+            city_ids=self._city_ids(subscriptions),
+            email=subscriptions[0].email,
             subject=subject,
-            content="",
             is_sent=False,
             error_message=error_message
         )
+
+    @staticmethod
+    def _city_ids(subscriptions):
+        """邮件包含的城市ID（去重，保持顺序）"""
+        return list(dict.fromkeys(subscription.city_id for subscription in subscriptions))
     
     def _get_website_url(self):
         """获取网站URL"""
@@ -204,7 +454,7 @@ class EmailService:
             
             # 渲染邮件模板
             subject = f"🧪 测试邮件 - {weather_info['city_name']} 天气预报"
-            html_content = render_to_string('emails/weather_report.html', context)
+            html_content = render_email('emails/weather_report.html', context)
             text_content = render_to_string('emails/weather_report.txt', context)
             
             # 创建邮件
@@ -217,7 +467,7 @@ class EmailService:
             email.attach_alternative(html_content, "text/html")
             
             # 发送邮件
-            email.send()
+            self.sender_pool.send(email)
             
             logger.info(f"测试邮件发送成功: {email_address}")
             return True
@@ -0,0 +1,351 @@
+import re
+import json
+import hashlib
+import functools
+import logging
+from pathlib import Path
+
+from django.conf import settings
+from django.template import Context, Engine
+from django.template.loader import get_template, render_to_string
+
+from monitoring.metrics import TEMPLATE_RENDER_SECONDS
+
+logger = logging.getLogger(__name__)
+
+# 需要预编译的HTML邮件模板
+COMPILED_TEMPLATES = (
+    'emails/_city_section.html',
+    'emails/weather_report.html',
+    'emails/weather_digest.html',
+)
+
+# 邮件样式表，编译时内联到各元素的style属性中
+STYLESHEET = 'emails/_styles.html'
+
+MANIFEST_NAME = 'manifest.json'
+
+INCLUDE_RE = re.compile(r"""{%\s*include\s+['"]([^'"]+)['"]\s*%}""")
+STYLE_BLOCK_RE = re.compile(r'<style[^>]*>(.*?)</style>', re.S | re.I)
+COMMENT_RE = re.compile(r'<!--(?!\[if).*?-->', re.S)
+TAG_RE = re.compile(r"""<(/?)([a-zA-Z][a-zA-Z0-9]*)((?:[^>"']|"[^"]*"|'[^']*')*?)(/?)>""")
+CLASS_ATTR_RE = re.compile(r"""\sclass\s*=\s*["']([^"']*)["']""", re.I)
+STYLE_ATTR_RE = re.compile(r"""\sstyle\s*=\s*(["'])(.*?)\1""", re.I | re.S)
+
+VOID_ELEMENTS = {'area', 'base', 'br', 'col', 'hr', 'img', 'input', 'link', 'meta', 'source', 'wbr'}
+
+# 预编译模板（进程内只编译一次）：{模板名: (Template, 指纹)}
+_compiled = {}
+
+
+class CSSRule:
+    """可以内联的CSS规则（只支持标签、类和后代选择器）"""
+
+    def __init__(self, selector, declarations, order):
+        self.parts = [self._parse_compound(part) for part in selector.split()]
+        self.declarations = declarations
+        tags = sum(1 for tag, _ in self.parts if tag)
+        classes = sum(len(cls) for _, cls in self.parts)
+        self.sort_key = (classes, tags, order)
+
+    @staticmethod
+    def _parse_compound(compound):
+        tag, *classes = compound.split('.')
+        return tag.lower(), set(classes)
+
+    @staticmethod
+    def _match_compound(part, element):
+        tag, classes = part
+        element_tag, element_classes = element
+        return (not tag or tag == element_tag) and classes <= element_classes
+
+    def matches(self, element, ancestors):
+        """判断元素是否匹配选择器，ancestors为从外到内的祖先元素列表"""
+        if not self._match_compound(self.parts[-1], element):
+            return False
+        index = len(ancestors) - 1
+        for part in reversed(self.parts[:-1]):
+            while index >= 0 and not self._match_compound(part, ancestors[index]):
+                index -= 1
+            if index < 0:
+                return False
+            index -= 1
+        return True
+
+
+def _parse_declarations(block):
+    declarations = []
+    for item in block.split(';'):
+        name, sep, value = item.partition(':')
+        if sep and name.strip():
+            declarations.append((name.strip().lower(), ' '.join(value.split()).replace('"', "'")))
+    return declarations
+
+
+def _split_blocks(css):
+    """把样式表拆分为 (前缀, 块内容) 列表，正确处理@media等嵌套块"""
+    blocks = []
+    position = 0
+    while True:
+        start = css.find('{', position)
+        if start < 0:
+            break
+        depth = 0
+        for end in range(start, len(css)):
+            if css[end] == '{':
+                depth += 1
+            elif css[end] == '}':
+                depth -= 1
+                if depth == 0:
+                    break
+        blocks.append((css[position:start].strip(), css[start + 1:end]))
+        position = end + 1
+    return blocks
+
+
+def _minify_css(css):
+    css = ' '.join(css.split())
+    return re.sub(r'\s*([{};:,])\s*', r'\1', css).replace(';}', '}')
+
+
+def _important(block):
+    """给保留在<style>中的声明加上!important，使其能够覆盖内联样式"""
+    return ';'.join(
+        f"{name}:{value}" if value.endswith('!important') else f"{name}:{value} !important"
+        for name, value in _parse_declarations(block)
+    )
+
+
+def parse_stylesheet(css):
+    """
+    解析样式表
+    :return: (可内联的规则列表, 需要保留在<style>中的CSS)
+    """
+    css = re.sub(r'/\*.*?\*/', '', css, flags=re.S)
+    rules = []
+    residual = []
+    for prelude, block in _split_blocks(css):
+        if prelude.startswith('@'):
+            # 媒体查询等无法内联，保留并提高优先级
+            inner = ''.join(
+                f"{selector}{{{_important(body)}}}"
+                for selector, body in _split_blocks(block)
+            )
+            residual.append(f"{prelude}{{{inner}}}")
+            continue
+        declarations = _parse_declarations(block)
+        for selector in prelude.split(','):
+            selector = ' '.join(selector.split())
+            if re.fullmatch(r'[\w.\- ]+', selector):
+                rules.append(CSSRule(selector, declarations, len(rules)))
+            else:
+                # 伪类、子元素等选择器无法内联
+                residual.append(f"{selector}{{{_important(block)}}}")
+    return rules, _minify_css(''.join(residual))
+
+
+def inline_css(html, rules, keep_classes=()):
+    """
+    把规则写入匹配元素的style属性，已有的内联样式优先
+    :param keep_classes: 仍被<style>中的规则使用的类名，其余类名内联后删除
+    """
+    ancestors = []
+    output = []
+    position = 0
+
+    for match in TAG_RE.finditer(html):
+        closing, tag, attrs, self_closing = match.groups()
+        tag = tag.lower()
+        output.append(html[position:match.start()])
+        position = match.end()
+
+        if closing:
+            for index in range(len(ancestors) - 1, -1, -1):
+                if ancestors[index][0] == tag:
+                    del ancestors[index:]
+                    break
+            output.append(match.group(0))
+            continue
+
+        class_match = CLASS_ATTR_RE.search(attrs)
+        classes = {
+            name for name in (class_match.group(1).split() if class_match else [])
+            if '{' not in name and '}' not in name
+        }
+        element = (tag, classes)
+
+        if class_match and '{' not in class_match.group(1):
+            kept = [name for name in class_match.group(1).split() if name in keep_classes]
+            replacement = f' class="{" ".join(kept)}"' if kept else ''
+            attrs = attrs[:class_match.start()] + replacement + attrs[class_match.end():]
+
+        matched = sorted(
+            (rule for rule in rules if rule.matches(element, ancestors)),
+            key=lambda rule: rule.sort_key
+        )
+        if matched:
+            styles = {}
+            for rule in matched:
+                styles.update(rule.declarations)
+            style_match = STYLE_ATTR_RE.search(attrs)
+            if style_match:
+                styles.update(_parse_declarations(style_match.group(2)))
+                attrs = attrs[:style_match.start()] + attrs[style_match.end():]
+            style = ';'.join(f"{name}:{value}" for name, value in styles.items())
+            attrs = f'{attrs.rstrip()} style="{style}"'
+
+        output.append(f"<{tag}{attrs}{self_closing}>")
+        if tag not in VOID_ELEMENTS and not self_closing:
+            ancestors.append(element)
+
+    output.append(html[position:])
+    return ''.join(output)
+
+
+def minify_html(html):
+    """去掉注释和标签之间多余的空白"""
+    html = COMMENT_RE.sub('', html)
+    html = re.sub(r'\s+', ' ', html)
+    html = re.sub(r'>\s+<', '><', html)
+    html = re.sub(r'(%}|>)\s+({%|<)', r'\1\2', html)
+    return html.strip()
+
+
+def _template_source(name):
+    return get_template(name).template.source
+
+
+def _flatten(source):
+    """展开模板中的include（样式表除外），得到单个模板源码"""
+    def replace(match):
+        if match.group(1) == STYLESHEET:
+            return match.group(0)
+        return _flatten(_template_source(match.group(1)))
+    return INCLUDE_RE.sub(replace, source)
+
+
+def _load_sources(name):
+    """返回展开后的模板源码、样式表源码和两者的哈希"""
+    source = _flatten(_template_source(name))
+    stylesheet = _template_source(STYLESHEET)
+    source_hash = hashlib.sha256((stylesheet + source).encode('utf-8')).hexdigest()
+    return source, stylesheet, source_hash
+
+
+def compile_template(name):
+    """
+    编译邮件模板：展开include、内联CSS并压缩空白
+    :param name: 模板名称
+    :return: (编译后的模板源码, 源码哈希)
+    """
+    source, stylesheet, source_hash = _load_sources(name)
+
+    css = ''.join(STYLE_BLOCK_RE.findall(stylesheet))
+    rules, residual = parse_stylesheet(css)
+    residual_block = f"<style>{residual}</style>" if residual else ''
+    source = re.sub(
+        r"""{%\s*include\s+['"]""" + re.escape(STYLESHEET) + r"""['"]\s*%}""",
+        lambda match: residual_block, source
+    )
+
+    keep_classes = set(re.findall(r'\.([\w-]+)', residual))
+    compiled = minify_html(inline_css(source, rules, keep_classes))
+    return compiled, source_hash
+
+
+def fingerprint(content):
+    """编译结果的指纹"""
+    return hashlib.sha256(content.encode('utf-8')).hexdigest()[:12]
+
+
+def _build_dir():
+    return Path(settings.EMAIL_TEMPLATE_BUILD_DIR)
+
+
+def build_email_templates(build_dir=None):
+    """
+    预编译所有HTML邮件模板并写入构建目录
+    :return: 清单 {模板名: {'fingerprint': 指纹, 'source_hash': 源码哈希, 'size': 字节数}}
+    """
+    build_dir = Path(build_dir or _build_dir())
+    manifest = {}
+    for name in COMPILED_TEMPLATES:
+        compiled, source_hash = compile_template(name)
+        path = build_dir / name
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_text(compiled, encoding='utf-8')
+        manifest[name] = {
+            'fingerprint': fingerprint(compiled),
+            'source_hash': source_hash,
+            'size': len(compiled.encode('utf-8')),
+        }
+    (build_dir / MANIFEST_NAME).write_text(
+        json.dumps(manifest, ensure_ascii=False, indent=2), encoding='utf-8'
+    )
+    _compiled.clear()
+    _get_engine.cache_clear()
+    return manifest
+
+
+@functools.lru_cache(maxsize=None)
+def _get_engine(build_dir):
+    """读取构建目录的模板引擎（使用缓存加载器），每个构建目录只创建一次"""
+    return Engine(
+        dirs=[build_dir],
+        loaders=[('django.template.loaders.cached.Loader', [
+            'django.template.loaders.filesystem.Loader',
+        ])],
+    )
+
+
+def _load_manifest():
+    try:
+        return json.loads((_build_dir() / MANIFEST_NAME).read_text(encoding='utf-8'))
+    except (OSError, ValueError):
+        return {}
+
+
+def load_compiled_templates():
+    """
+    加载预编译模板：优先使用构建目录中与源码一致的结果，否则在内存中编译
+    在进程启动时调用一次，之后每封邮件只需要填充数据
+    """
+    engine = _get_engine(str(_build_dir()))
+    manifest = _load_manifest()
+    for name in COMPILED_TEMPLATES:
+        _, _, source_hash = _load_sources(name)
+        entry = manifest.get(name)
+        if entry and entry['source_hash'] == source_hash:
+            _compiled[name] = (engine.get_template(name), entry['fingerprint'])
+            continue
+
+        if entry:
+            logger.warning(f"邮件模板构建结果已过期，使用内存编译: {name}")
+        compiled, _ = compile_template(name)
+        _compiled[name] = (engine.from_string(compiled), fingerprint(compiled))
+    return _compiled
+
+
+def render_email(name, context):
+    """
+    渲染HTML邮件
+    :param name: 模板名称
+    :param context: 模板上下文
+    :return: HTML内容
+    """
+    with TEMPLATE_RENDER_SECONDS.labels(name).time():
+        if not settings.EMAIL_TEMPLATE_PRECOMPILE or name not in COMPILED_TEMPLATES:
+            return render_to_string(name, context)
+        if not _compiled:
+            load_compiled_templates()
+        template, _ = _compiled[name]
+        return template.render(Context(context))
+
+
+def get_fingerprint(name):
+    """获取预编译模板的指纹，未启用预编译时返回空字符串"""
+    if not settings.EMAIL_TEMPLATE_PRECOMPILE or name not in COMPILED_TEMPLATES:
+        return ''
+    if not _compiled:
+        load_compiled_templates()
+    return _compiled[name][1]
@@ -0,0 +1,28 @@
+import uuid
+
+from django.core.cache import cache
+
+# 模板片段缓存时间（秒）。片段的缓存键包含数据版本，数据变化后旧片段不再被读取，
+# 这里只用来限制旧片段占用缓存的时间
+FRAGMENT_CACHE_TIMEOUT = 24 * 3600
+
+VERSION_PREFIX = 'subscriptions:version'
+
+
+def subscription_version(user_id):
+    """
+    获取用户订阅数据的版本号，用于模板片段缓存键
+    :param user_id: 用户ID
+    :return: 版本号字符串
+    """
+    key = f'{VERSION_PREFIX}:{user_id}'
+    version = cache.get(key)
+    if version is None:
+        cache.add(key, uuid.uuid4().hex, None)
+        version = cache.get(key)
+    return version
+
+
+def bump_subscription_versions(user_ids):
+    """用户的订阅发生变化后更新版本号，使该用户的订阅列表片段失效"""
+    cache.set_many({f'{VERSION_PREFIX}:{user_id}': uuid.uuid4().hex for user_id in user_ids}, None)
@@ -0,0 +1,73 @@
+from datetime import datetime, time, timedelta
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Count
+from django.db.models.functions import TruncDate
+from django.utils import timezone
+
+from accounts.models import User
+from subscriptions.models import Subscription, EmailLog, DailyStats
+
+
+class Command(BaseCommand):
+    help = '根据用户、订阅和邮件日志重建每日统计'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--days',
+            type=int,
+            default=30,
+            help='重建最近多少天的统计（邮件日志只保留30天，更早的邮件统计无法重建），默认30'
+        )
+
+    def handle(self, *args, **options):
+        days = options['days']
+        start = timezone.localdate() - timedelta(days=days - 1)
+        start_time = timezone.make_aware(datetime.combine(start, time.min))
+
+        stats = {}
+
+        def add(date, city_id, **counts):
+            row = stats.setdefault((date, city_id), dict.fromkeys(DailyStats.objects.COUNTERS, 0))
+            for name, value in counts.items():
+                row[name] += value
+
+        users = User.objects.filter(date_joined__gte=start_time).annotate(
+            day=TruncDate('date_joined')
+        ).values('day').annotate(count=Count('id')).order_by()
+        for row in users:
+            add(row['day'], None, users_joined=row['count'])
+
+        subscriptions = Subscription.objects.filter(created_at__gte=start_time).annotate(
+            day=TruncDate('created_at')
+        ).values('day', 'city_id').annotate(count=Count('id')).order_by()
+        for row in subscriptions:
+            add(row['day'], None, subscriptions_created=row['count'])
+            add(row['day'], row['city_id'], subscriptions_created=row['count'])
+
+        # 一封摘要邮件包含多个城市（city_ids），逐条读取后按城市累加
+        emails = EmailLog.objects.filter(sent_at__gte=start_time).annotate(
+            day=TruncDate('sent_at')
+        ).values_list('day', 'is_sent', 'city_ids', 'subscription__city_id').order_by()
+        for day, is_sent, city_ids, subscription_city_id in emails.iterator(chunk_size=2000):
+            counter = 'emails_sent' if is_sent else 'emails_failed'
+            add(day, None, **{counter: 1})
+            for city_id in city_ids or [subscription_city_id]:
+                add(day, city_id, **{counter: 1})
+
+        with transaction.atomic():
+            deleted, _ = DailyStats.objects.filter(date__gte=start).delete()
+            DailyStats.objects.bulk_create(
+                [
+                    DailyStats(date=date, city_id=city_id, city_key=city_id or 0, **counts)
+                    for (date, city_id), counts in stats.items()
+                ],
+                batch_size=1000,
+            )
+
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"已重建 {start} 起 {days} 天的每日统计: 删除 {deleted} 条, 生成 {len(stats)} 条"
+            )
+        )
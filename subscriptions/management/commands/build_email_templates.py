@@ -0,0 +1,24 @@
+from django.core.management.base import BaseCommand
+from subscriptions.email_templates import build_email_templates
+
+
+class Command(BaseCommand):
+    help = '预编译HTML邮件模板（内联CSS、压缩空白）'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--output',
+            help='输出目录，默认为 EMAIL_TEMPLATE_BUILD_DIR'
+        )
+
+    def handle(self, *args, **options):
+        manifest = build_email_templates(options.get('output'))
+
+        for name, entry in manifest.items():
+            self.stdout.write(
+                f"  {name}: {entry['size']} 字节 (指纹 {entry['fingerprint']})"
+            )
+
+        self.stdout.write(
+            self.style.SUCCESS(f"已编译 {len(manifest)} 个邮件模板")
+        )
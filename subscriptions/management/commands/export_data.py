@@ -0,0 +1,61 @@
+from datetime import datetime, time, timedelta
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from subscriptions.admin import EmailLogAdmin
+from subscriptions.models import EmailLog
+from weather.admin import WeatherDataAdmin
+from weather.models import WeatherData
+from weatherblog.exports import EXPORT_FORMATS, export_filename, iter_export
+
+# 可导出的数据：(模型, 导出字段, 时间字段, 城市字段)
+EXPORTS = {
+    'emaillog': (EmailLog, EmailLogAdmin.export_fields, 'sent_at', 'subscription__city__adcode'),
+    'weatherdata': (WeatherData, WeatherDataAdmin.export_fields, 'created_at', 'city__adcode'),
+}
+
+
+class Command(BaseCommand):
+    help = '流式导出邮件日志或天气数据（CSV / JSONL，可选gzip压缩）'
+
+    def add_arguments(self, parser):
+        parser.add_argument('model', choices=sorted(EXPORTS), help='要导出的数据')
+        parser.add_argument('--format', choices=EXPORT_FORMATS, default='csv', help='导出格式，默认csv')
+        parser.add_argument('--gzip', action='store_true', help='使用gzip压缩')
+        parser.add_argument('--since', help='开始日期（YYYY-MM-DD，包含）')
+        parser.add_argument('--until', help='结束日期（YYYY-MM-DD，包含）')
+        parser.add_argument('--city', help='只导出指定城市（adcode）')
+        parser.add_argument('--output', help='输出文件路径，默认在当前目录按时间生成文件名')
+
+    def _parse_date(self, value, end=False):
+        try:
+            date = datetime.strptime(value, '%Y-%m-%d').date()
+        except ValueError:
+            raise CommandError(f"日期格式错误: {value}，应为YYYY-MM-DD")
+        if end:
+            date += timedelta(days=1)
+        return timezone.make_aware(datetime.combine(date, time.min))
+
+    def handle(self, *args, **options):
+        model, fields, date_field, city_field = EXPORTS[options['model']]
+        queryset = model.objects.all()
+
+        if options['since']:
+            queryset = queryset.filter(**{f'{date_field}__gte': self._parse_date(options['since'])})
+        if options['until']:
+            queryset = queryset.filter(**{f'{date_field}__lt': self._parse_date(options['until'], end=True)})
+        if options['city']:
+            queryset = queryset.filter(**{city_field: options['city']})
+
+        fmt = options['format']
+        compress = options['gzip']
+        output = options['output'] or export_filename(options['model'], fmt, compress)
+
+        size = 0
+        with open(output, 'wb') as f:
+            for chunk in iter_export(queryset, fields, fmt, compress):
+                f.write(chunk)
+                size += len(chunk)
+
+        self.stdout.write(self.style.SUCCESS(f"已导出到 {output}（{size} 字节）"))
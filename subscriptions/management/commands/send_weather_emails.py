@@ -1,6 +1,11 @@
+from itertools import groupby
+from operator import attrgetter
+
 from django.core.management.base import BaseCommand
-from subscriptions.models import Subscription
-from subscriptions.email_service import EmailService
+from django.utils import timezone
+from subscriptions.models import Subscription, DeliveryRun, Delivery
+from subscriptions.email_service import EmailService, DELIVERY_SENT
+from weatherblog.timing import STAGE_LABELS, StageTimer
 
 
 class Command(BaseCommand):
@@ -36,7 +41,7 @@ class Command(BaseCommand):
         elif user_id:
             queryset = queryset.filter(user_id=user_id)
         
-        subscriptions = queryset.select_related('user', 'city')
+        subscriptions = queryset.select_related('user', 'city').order_by('email', 'id')
         
         if not subscriptions.exists():
             self.stdout.write(
@@ -55,27 +60,55 @@ class Command(BaseCommand):
                 )
             return
         
-        # 实际发送邮件
-        email_service = EmailService()
+        # 实际发送邮件，本次发送记录为一条手动投递任务，便于在后台对比耗时
+        run = DeliveryRun.objects.create(run_key=f"manual-{timezone.localtime():%Y%m%d-%H%M%S}")
+        timer = StageTimer()
+        email_service = EmailService(timer=timer)
         success_count = 0
         failure_count = 0
+        deliveries = []
         
-        for subscription in subscriptions:
-            self.stdout.write(
-                f"正在发送邮件给 {subscription.email} "
-                f"({subscription.city.get_full_name()})..."
-            )
+        # 同一接收邮箱的订阅合并为一封邮件
+        for email, group in groupby(subscriptions, key=attrgetter('email')):
+            group = list(group)
+            city_names = '、'.join(subscription.city.get_full_name() for subscription in group)
+            self.stdout.write(f"正在发送邮件给 {email} ({city_names})...")
             
-            if email_service.send_weather_email(subscription):
+            with timer.recipient(email):
+                sent = email_service.deliver_weather_digest(group) == DELIVERY_SENT
+            failed = email_service.failed_subscriptions
+            if sent and not failed:
                 success_count += 1
                 self.stdout.write(
                     self.style.SUCCESS(f"  ✓ 发送成功")
                 )
+            elif sent:
+                success_count += 1
+                self.stdout.write(
+                    self.style.WARNING(f"  ✓ 发送成功，{email_service.last_error}")
+                )
             else:
                 failure_count += 1
                 self.stdout.write(
                     self.style.ERROR(f"  ✗ 发送失败")
                 )
+            deliveries.extend(
+                Delivery(
+                    run=run,
+                    subscription=subscription,
+                    status=Delivery.STATUS_FAILED if subscription in failed else Delivery.STATUS_SENT,
+                    attempts=1,
+                    error_message=email_service.last_error if subscription in failed else '',
+                )
+                for subscription in group
+            )
+
+        email_service.sender_pool.close()
+        Delivery.objects.bulk_create(deliveries)
+        run.total_count = len(deliveries)
+        run.save(update_fields=['total_count'])
+        run.add_timing(timer.summary(), 'manual')
+        run.refresh_status()
         
         # 显示总结
         self.stdout.write("\n" + "="*50)
@@ -83,6 +116,7 @@ class Command(BaseCommand):
         self.stdout.write(f"  成功: {success_count}")
         self.stdout.write(f"  失败: {failure_count}")
         self.stdout.write(f"  总计: {success_count + failure_count}")
+        self._write_timing(run.timing)
         
         if success_count > 0:
             self.stdout.write(
@@ -93,3 +127,18 @@ class Command(BaseCommand):
             self.stdout.write(
                 self.style.ERROR(f"有 {failure_count} 封邮件发送失败")
             )
+
+    def _write_timing(self, timing):
+        """显示各阶段耗时"""
+        self.stdout.write(f"\n耗时统计（总计 {timing['wall']:.2f} 秒）:")
+        for name, label in STAGE_LABELS.items():
+            stats = timing['stages'].get(name)
+            if stats:
+                self.stdout.write(
+                    f"  {label}: {stats['count']} 次, 合计 {stats['total']:.2f} 秒, "
+                    f"p50 {stats['p50'] * 1000:.0f}ms, p95 {stats['p95'] * 1000:.0f}ms"
+                )
+        if timing['slowest_cities']:
+            self.stdout.write("  最慢城市: " + ', '.join(
+                f"{city} {seconds:.2f}秒" for city, seconds in timing['slowest_cities'][:5]
+            ))
@@ -1,5 +1,5 @@
 from django.core.management.base import BaseCommand
-from django_celery_beat.models import PeriodicTask, CrontabSchedule
+from django_celery_beat.models import PeriodicTask, CrontabSchedule, IntervalSchedule
 import json
 
 
@@ -29,7 +29,7 @@ class Command(BaseCommand):
             name='每日天气邮件发送',
             defaults={
                 'crontab': schedule,
-                'task': 'subscriptions.tasks.send_daily_weather_emails',
+                'task': 'subscriptions.tasks.start_daily_weather_emails',
                 'enabled': True,
             }
         )
@@ -41,7 +41,7 @@ class Command(BaseCommand):
         else:
             # 更新现有任务
             task.crontab = schedule
-            task.task = 'subscriptions.tasks.send_daily_weather_emails'
+            task.task = 'subscriptions.tasks.start_daily_weather_emails'
             task.enabled = True
             task.save()
             self.stdout.write(
@@ -80,9 +80,95 @@ class Command(BaseCommand):
                 self.style.SUCCESS("更新了清理旧邮件日志任务")
             )
         
+        # 创建每分钟补发发件箱邮件的定时任务
+        minute_schedule, created = IntervalSchedule.objects.get_or_create(
+            every=1,
+            period=IntervalSchedule.MINUTES,
+        )
+
+        outbox_task, created = PeriodicTask.objects.get_or_create(
+            name='补发发件箱邮件',
+            defaults={
+                'interval': minute_schedule,
+                'task': 'accounts.tasks.flush_outbox',
+                'enabled': True,
+            }
+        )
+
+        if created:
+            self.stdout.write(
+                self.style.SUCCESS("创建了补发发件箱邮件任务")
+            )
+        else:
+            outbox_task.interval = minute_schedule
+            outbox_task.task = 'accounts.tasks.flush_outbox'
+            outbox_task.enabled = True
+            outbox_task.save()
+            self.stdout.write(
+                self.style.SUCCESS("更新了补发发件箱邮件任务")
+            )
+
+        # 创建每天清理过期验证令牌和未验证账户的定时任务
+        daily_cleanup_schedule, created = CrontabSchedule.objects.get_or_create(
+            minute=30,
+            hour=3,
+            day_of_week='*',
+            day_of_month='*',
+            month_of_year='*',
+            timezone='Asia/Shanghai'
+        )
+
+        verification_task, created = PeriodicTask.objects.get_or_create(
+            name='清理过期验证令牌和未验证账户',
+            defaults={
+                'crontab': daily_cleanup_schedule,
+                'task': 'accounts.tasks.cleanup_expired_verifications',
+                'enabled': True,
+            }
+        )
+
+        if created:
+            self.stdout.write(
+                self.style.SUCCESS("创建了清理过期验证令牌和未验证账户任务")
+            )
+        else:
+            verification_task.crontab = daily_cleanup_schedule
+            verification_task.task = 'accounts.tasks.cleanup_expired_verifications'
+            verification_task.enabled = True
+            verification_task.save()
+            self.stdout.write(
+                self.style.SUCCESS("更新了清理过期验证令牌和未验证账户任务")
+            )
+
+        # 慢请求记录和性能分析文件与验证令牌在同一时间清理
+        slow_request_task, created = PeriodicTask.objects.get_or_create(
+            name='清理慢请求记录和性能分析文件',
+            defaults={
+                'crontab': daily_cleanup_schedule,
+                'task': 'monitoring.tasks.cleanup_old_slow_requests',
+                'enabled': True,
+            }
+        )
+
+        if created:
+            self.stdout.write(
+                self.style.SUCCESS("创建了清理慢请求记录和性能分析文件任务")
+            )
+        else:
+            slow_request_task.crontab = daily_cleanup_schedule
+            slow_request_task.task = 'monitoring.tasks.cleanup_old_slow_requests'
+            slow_request_task.enabled = True
+            slow_request_task.save()
+            self.stdout.write(
+                self.style.SUCCESS("更新了清理慢请求记录和性能分析文件任务")
+            )
+
         self.stdout.write(
             self.style.SUCCESS("定时任务设置完成！")
         )
         self.stdout.write("任务列表:")
         self.stdout.write("1. 每日天气邮件发送 - 每天早上6:00")
         self.stdout.write("2. 清理旧邮件日志 - 每周一凌晨2:00")
+        self.stdout.write("3. 补发发件箱邮件 - 每分钟")
+        self.stdout.write("4. 清理过期验证令牌和未验证账户 - 每天凌晨3:30")
+        self.stdout.write("5. 清理慢请求记录和性能分析文件 - 每天凌晨3:30")
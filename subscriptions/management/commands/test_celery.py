@@ -1,5 +1,5 @@
 from django.core.management.base import BaseCommand
-from subscriptions.tasks import test_celery_task, send_daily_weather_emails
+from subscriptions.tasks import test_celery_task, send_daily_weather_emails, daily_run_key
 
 
 class Command(BaseCommand):
@@ -41,7 +41,7 @@ class Command(BaseCommand):
             self.stdout.write("正在测试天气邮件发送任务...")
             
             # 异步执行天气邮件发送任务
-            result = send_daily_weather_emails.delay()
+            result = send_daily_weather_emails.delay(run_key=daily_run_key())
             
             self.stdout.write(f"任务ID: {result.id}")
             self.stdout.write("等待任务完成...")
@@ -0,0 +1,96 @@
+# Generated by Django 4.2.7 on 2026-10-19 16:28
+
+import hashlib
+import zlib
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def move_content_to_body(apps, schema_editor):
+    """把已有日志中的邮件正文迁移到按哈希去重的正文表"""
+    EmailLog = apps.get_model("subscriptions", "EmailLog")
+    EmailBody = apps.get_model("subscriptions", "EmailBody")
+
+    bodies = {}
+    logs = EmailLog.objects.exclude(content="").only("id", "content")
+    for log in logs.iterator(chunk_size=500):
+        raw = log.content.encode("utf-8")
+        content_hash = hashlib.sha256(raw).hexdigest()
+        body_id = bodies.get(content_hash)
+        if body_id is None:
+            compressed = zlib.compress(raw, 6)
+            body, _ = EmailBody.objects.get_or_create(
+                content_hash=content_hash,
+                defaults={
+                    "data": compressed if len(compressed) < len(raw) else raw,
+                    "is_compressed": len(compressed) < len(raw),
+                    "size": len(raw),
+                },
+            )
+            body_id = bodies[content_hash] = body.id
+        EmailLog.objects.filter(id=log.id).update(body_id=body_id)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("subscriptions", "0001_initial"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="EmailBody",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                (
+                    "content_hash",
+                    models.CharField(
+                        max_length=64, unique=True, verbose_name="内容哈希"
+                    ),
+                ),
+                ("data", models.BinaryField(verbose_name="正文数据")),
+                (
+                    "is_compressed",
+                    models.BooleanField(default=False, verbose_name="是否压缩"),
+                ),
+                (
+                    "size",
+                    models.PositiveIntegerField(default=0, verbose_name="原始大小"),
+                ),
+                (
+                    "created_at",
+                    models.DateTimeField(auto_now_add=True, verbose_name="创建时间"),
+                ),
+            ],
+            options={
+                "verbose_name": "邮件正文",
+                "verbose_name_plural": "邮件正文",
+            },
+        ),
+        migrations.AddField(
+            model_name="emaillog",
+            name="body",
+            field=models.ForeignKey(
+                blank=True,
+                null=True,
+                on_delete=django.db.models.deletion.PROTECT,
+                related_name="logs",
+                to="subscriptions.emailbody",
+                verbose_name="邮件内容",
+            ),
+        ),
+        migrations.RunPython(move_content_to_body, migrations.RunPython.noop),
+        migrations.RemoveField(
+            model_name="emaillog",
+            name="content",
+        ),
+    ]
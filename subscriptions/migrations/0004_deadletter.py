@@ -0,0 +1,73 @@
+# Generated by Django 4.2.7 on 2026-10-19 16:35
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("subscriptions", "0003_deliveryrun"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="DeadLetter",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                (
+                    "error_class",
+                    models.CharField(max_length=20, verbose_name="错误类型"),
+                ),
+                (
+                    "error_message",
+                    models.TextField(blank=True, default="", verbose_name="错误信息"),
+                ),
+                (
+                    "attempts",
+                    models.PositiveIntegerField(default=0, verbose_name="尝试次数"),
+                ),
+                (
+                    "created_at",
+                    models.DateTimeField(auto_now_add=True, verbose_name="创建时间"),
+                ),
+                (
+                    "redriven_at",
+                    models.DateTimeField(
+                        blank=True, null=True, verbose_name="重新投递时间"
+                    ),
+                ),
+                (
+                    "run",
+                    models.ForeignKey(
+                        blank=True,
+                        null=True,
+                        on_delete=django.db.models.deletion.SET_NULL,
+                        to="subscriptions.deliveryrun",
+                        verbose_name="投递任务",
+                    ),
+                ),
+                (
+                    "subscription",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        to="subscriptions.subscription",
+                        verbose_name="订阅",
+                    ),
+                ),
+            ],
+            options={
+                "verbose_name": "死信邮件",
+                "verbose_name_plural": "死信邮件",
+                "ordering": ["-created_at"],
+            },
+        ),
+    ]
@@ -0,0 +1,31 @@
+# Generated by Django 4.2.7 on 2026-10-19 16:43
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("subscriptions", "0004_deadletter"),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name="emaillog",
+            index=models.Index(
+                fields=["sent_at", "is_sent"], name="emaillog_sent_at_is_sent_idx"
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="subscription",
+            index=models.Index(
+                fields=["is_active", "city"], name="subscription_active_city_idx"
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="subscription",
+            index=models.Index(
+                fields=["email", "id"], name="subscription_email_id_idx"
+            ),
+        ),
+    ]
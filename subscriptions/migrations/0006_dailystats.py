@@ -0,0 +1,67 @@
+# Generated by Django 4.2.7 on 2026-10-19 16:45
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("weather", "0002_indexes"),
+        ("subscriptions", "0005_indexes"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="DailyStats",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("date", models.DateField(verbose_name="日期")),
+                (
+                    "users_joined",
+                    models.PositiveIntegerField(default=0, verbose_name="新增用户"),
+                ),
+                (
+                    "subscriptions_created",
+                    models.PositiveIntegerField(default=0, verbose_name="新增订阅"),
+                ),
+                (
+                    "emails_sent",
+                    models.PositiveIntegerField(default=0, verbose_name="发送成功"),
+                ),
+                (
+                    "emails_failed",
+                    models.PositiveIntegerField(default=0, verbose_name="发送失败"),
+                ),
+                (
+                    "updated_at",
+                    models.DateTimeField(auto_now=True, verbose_name="更新时间"),
+                ),
+                (
+                    "city",
+                    models.ForeignKey(
+                        blank=True,
+                        null=True,
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="daily_stats",
+                        to="weather.city",
+                        verbose_name="城市",
+                    ),
+                ),
+            ],
+            options={
+                "verbose_name": "每日统计",
+                "verbose_name_plural": "每日统计",
+                "ordering": ["-date"],
+                "unique_together": {("date", "city")},
+            },
+        ),
+    ]
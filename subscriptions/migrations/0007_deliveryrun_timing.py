@@ -0,0 +1,18 @@
+# Generated by Django 4.2.7 on 2026-10-19 17:11
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("subscriptions", "0006_dailystats"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="deliveryrun",
+            name="timing",
+            field=models.JSONField(blank=True, default=dict, verbose_name="耗时统计"),
+        ),
+    ]
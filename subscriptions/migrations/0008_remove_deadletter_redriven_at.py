@@ -0,0 +1,17 @@
+# Generated by Django 4.2.7 on 2026-10-19 17:21
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("subscriptions", "0007_deliveryrun_timing"),
+    ]
+
+    operations = [
+        migrations.RemoveField(
+            model_name="deadletter",
+            name="redriven_at",
+        ),
+    ]
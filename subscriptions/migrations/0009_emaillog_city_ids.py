@@ -0,0 +1,18 @@
+# Generated by Django 4.2.7 on 2026-10-19 17:31
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("subscriptions", "0008_remove_deadletter_redriven_at"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="emaillog",
+            name="city_ids",
+            field=models.JSONField(blank=True, default=list, verbose_name="包含城市"),
+        ),
+    ]
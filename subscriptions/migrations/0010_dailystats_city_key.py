@@ -0,0 +1,42 @@
+# Generated by Django 4.2.7 on 2026-10-19 19:05
+
+from django.db import migrations, models
+from django.db.models import F, Sum
+
+COUNTERS = ('users_joined', 'subscriptions_created', 'emails_sent', 'emails_failed')
+
+
+def fill_city_key(apps, schema_editor):
+    """城市统计的city_key取城市ID；同一天重复的全站统计合并为一条"""
+    DailyStats = apps.get_model('subscriptions', 'DailyStats')
+    DailyStats.objects.filter(city__isnull=False).update(city_key=F('city_id'))
+
+    duplicated = DailyStats.objects.filter(city__isnull=True).values('date').annotate(
+        rows=models.Count('id'), **{name: Sum(name) for name in COUNTERS}
+    ).filter(rows__gt=1)
+    for row in duplicated:
+        ids = list(DailyStats.objects.filter(
+            date=row['date'], city__isnull=True
+        ).order_by('id').values_list('id', flat=True))
+        DailyStats.objects.filter(id=ids[0]).update(**{name: row[name] for name in COUNTERS})
+        DailyStats.objects.filter(id__in=ids[1:]).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("subscriptions", "0009_emaillog_city_ids"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="dailystats",
+            name="city_key",
+            field=models.PositiveIntegerField(default=0, verbose_name="城市键"),
+        ),
+        migrations.RunPython(fill_city_key, migrations.RunPython.noop),
+        migrations.AlterUniqueTogether(
+            name="dailystats",
+            unique_together={("date", "city_key")},
+        ),
+    ]
@@ -0,0 +1,30 @@
+# Generated by Django 4.2.7 on 2026-10-19 17:45
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("subscriptions", "0010_dailystats_city_key"),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name="delivery",
+            name="status",
+            field=models.CharField(
+                choices=[
+                    ("pending", "待发送"),
+                    ("sending", "发送中"),
+                    ("sent", "已发送"),
+                    ("failed", "发送失败"),
+                    ("deferred", "延后发送"),
+                    ("retrying", "等待重试"),
+                ],
+                default="pending",
+                max_length=20,
+                verbose_name="状态",
+            ),
+        ),
+    ]
@@ -1,6 +1,45 @@
-from django.db import models
+import contextvars
+import hashlib
+import zlib
+from contextlib import contextmanager
+from datetime import timedelta
+
+from django.db import IntegrityError, models, transaction
 from django.conf import settings
+from django.utils import timezone
 from weather.models import City
+from weatherblog.timing import merge_timing
+
+
+class SubscriptionQuerySet(models.QuerySet):
+    """订阅查询集"""
+
+    def for_delivery(self):
+        """只加载发送邮件需要的字段"""
+        return self.select_related('city').only(
+            'id', 'email', 'city', 'city__adcode', 'city__name'
+        )
+
+    def iter_by_email(self, chunk_size=1000):
+        """
+        按 (email, id) 键集分页逐批读取订阅
+        不使用OFFSET，每批都从上一批的最后一行继续，内存占用与订阅总数无关；
+        同一接收邮箱的订阅总是相邻，方便合并为一封邮件。
+        :param chunk_size: 每批读取的数量
+        """
+        queryset = self.order_by('email', 'id')
+        last = None
+        while True:
+            chunk = queryset
+            if last is not None:
+                chunk = chunk.filter(
+                    models.Q(email__gt=last.email) | models.Q(email=last.email, id__gt=last.id)
+                )
+            chunk = list(chunk[:chunk_size])
+            yield from chunk
+            if len(chunk) < chunk_size:
+                return
+            last = chunk[-1]
 
 
 class Subscription(models.Model):
@@ -12,22 +51,95 @@ class Subscription(models.Model):
     created_at = models.DateTimeField(auto_now_add=True, verbose_name="创建时间")
     updated_at = models.DateTimeField(auto_now=True, verbose_name="更新时间")
 
+    objects = SubscriptionQuerySet.as_manager()
+
     class Meta:
         verbose_name = "天气订阅"
         verbose_name_plural = "天气订阅"
         unique_together = ['user', 'city']  # 用户对同一城市只能订阅一次
         ordering = ['-created_at']
+        indexes = [
+            # 按城市统计、发送活跃订阅
+            models.Index(fields=['is_active', 'city'], name='subscription_active_city_idx'),
+            # 每日任务按 (email, id) 键集分页读取订阅
+            models.Index(fields=['email', 'id'], name='subscription_email_id_idx'),
+        ]
 
     def __str__(self):
         return f"{self.user.email} - {self.city.name}"
 
 
+class EmailBodyManager(models.Manager):
+    """邮件正文管理器"""
+
+    def store(self, content):
+        """
+        按内容哈希存储邮件正文，相同内容只保存一份
+        :param content: 渲染后的邮件HTML
+        :return: EmailBody对象
+        """
+        raw = content.encode('utf-8')
+        content_hash = hashlib.sha256(raw).hexdigest()
+
+        data = raw
+        is_compressed = False
+        if getattr(settings, 'EMAIL_BODY_COMPRESSION', True):
+            compressed = zlib.compress(raw, 6)
+            # 只有压缩后更小才使用压缩数据
+            if len(compressed) < len(raw):
+                data = compressed
+                is_compressed = True
+
+        body, _ = self.get_or_create(
+            content_hash=content_hash,
+            defaults={
+                'data': data,
+                'is_compressed': is_compressed,
+                'size': len(raw),
+            }
+        )
+        return body
+
+
+class EmailBody(models.Model):
+    """邮件正文（按内容哈希去重存储）"""
+    content_hash = models.CharField(max_length=64, unique=True, verbose_name="内容哈希")
+    data = models.BinaryField(verbose_name="正文数据")
+    is_compressed = models.BooleanField(default=False, verbose_name="是否压缩")
+    size = models.PositiveIntegerField(default=0, verbose_name="原始大小")
+    created_at = models.DateTimeField(auto_now_add=True, verbose_name="创建时间")
+
+    objects = EmailBodyManager()
+
+    class Meta:
+        verbose_name = "邮件正文"
+        verbose_name_plural = "邮件正文"
+
+    def __str__(self):
+        return self.content_hash[:12]
+
+    @property
+    def content(self):
+        """解压并返回邮件正文"""
+        data = bytes(self.data)
+        if self.is_compressed:
+            data = zlib.decompress(data)
+        return data.decode('utf-8')
+
+
 class EmailLog(models.Model):
-    """邮件发送日志"""
+    """
+    邮件发送日志
+    一封摘要邮件只记录一条日志，subscription为其中第一个订阅，city_ids为邮件包含的全部城市。
+    """
     subscription = models.ForeignKey(Subscription, on_delete=models.CASCADE, verbose_name="订阅")
+    city_ids = models.JSONField(default=list, blank=True, verbose_name="包含城市")
     email = models.EmailField(verbose_name="接收邮箱")
     subject = models.CharField(max_length=200, verbose_name="邮件主题")
-    content = models.TextField(verbose_name="邮件内容")
+    body = models.ForeignKey(
+        EmailBody, on_delete=models.PROTECT, null=True, blank=True,
+        related_name='logs', verbose_name="邮件内容"
+    )
     is_sent = models.BooleanField(default=False, verbose_name="是否发送成功")
     error_message = models.TextField(null=True, blank=True, verbose_name="错误信息")
     sent_at = models.DateTimeField(auto_now_add=True, verbose_name="发送时间")
@@ -36,6 +148,305 @@ class EmailLog(models.Model):
         verbose_name = "邮件日志"
         verbose_name_plural = "邮件日志"
         ordering = ['-sent_at']
+        indexes = [
+            # 仪表板按时间范围统计成功/失败数，后台按发送时间倒序列表
+            models.Index(fields=['sent_at', 'is_sent'], name='emaillog_sent_at_is_sent_idx'),
+        ]
 
     def __str__(self):
         return f"{self.email} - {self.subject}"
+
+    @property
+    def content(self):
+        """邮件正文（访问时才加载）"""
+        return self.body.content if self.body_id else ""
+
+    def get_city_ids(self):
+        """邮件包含的城市ID，合并发送之前的日志只有订阅本身的城市"""
+        return self.city_ids or [self.subscription.city_id]
+
+
+class DeliveryRun(models.Model):
+    """投递任务（每次定时发送对应一条记录）"""
+    STATUS_RUNNING = 'running'
+    STATUS_COMPLETED = 'completed'
+    STATUS_CHOICES = [
+        (STATUS_RUNNING, '进行中'),
+        (STATUS_COMPLETED, '已完成'),
+    ]
+
+    run_key = models.CharField(max_length=50, unique=True, verbose_name="任务标识")
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default=STATUS_RUNNING, verbose_name="状态")
+    total_count = models.PositiveIntegerField(default=0, verbose_name="投递总数")
+    created_at = models.DateTimeField(auto_now_add=True, verbose_name="创建时间")
+    finished_at = models.DateTimeField(null=True, blank=True, verbose_name="完成时间")
+    # 分阶段耗时统计，由weatherblog.timing.StageTimer.summary()生成，多次执行时用merge_timing合并
+    timing = models.JSONField(default=dict, blank=True, verbose_name="耗时统计")
+
+    class Meta:
+        verbose_name = "投递任务"
+        verbose_name_plural = "投递任务"
+        ordering = ['-created_at']
+
+    def __str__(self):
+        return self.run_key
+
+    def claim(self, subscription_id):
+        """
+        认领一个订阅的投递，已投递或正在投递的订阅不会被重复认领
+        :return: 是否认领成功
+        """
+        updated = self.deliveries.filter(
+            Delivery.claimable_q(include_deferred=True),
+            subscription_id=subscription_id,
+        ).update(
+            status=Delivery.STATUS_SENDING,
+            attempts=models.F('attempts') + 1,
+            updated_at=timezone.now(),
+        )
+        return updated == 1
+
+    def record(self, subscription_ids, status, error_message=''):
+        """记录一组订阅的投递结果"""
+        self.deliveries.filter(subscription_id__in=subscription_ids).update(
+            status=status,
+            error_message=error_message,
+            updated_at=timezone.now(),
+        )
+
+    def progress(self):
+        """按状态统计投递进度"""
+        counts = dict(
+            self.deliveries.values_list('status').annotate(count=models.Count('id'))
+        )
+        progress = {status: counts.get(status, 0) for status, _ in Delivery.STATUS_CHOICES}
+        progress['total'] = sum(counts.values())
+        return progress
+
+    def add_timing(self, summary, label):
+        """
+        把一次执行的耗时统计合并到任务的统计中
+        重试等任务在多个worker上并发执行，加行锁后读取合并，避免互相覆盖。
+        :param summary: StageTimer.summary()
+        :param label: 执行类型，如 daily / deferred / retry
+        """
+        with transaction.atomic():
+            timing = DeliveryRun.objects.select_for_update().values_list('timing', flat=True).get(pk=self.pk)
+            self.timing = merge_timing(timing, summary, label)
+            DeliveryRun.objects.filter(pk=self.pk).update(timing=self.timing)
+
+    def refresh_status(self):
+        """所有投递都有结果后把任务标记为已完成，已安排重试的失败投递仍算未完成"""
+        unfinished = self.deliveries.filter(status__in=[
+            Delivery.STATUS_PENDING, Delivery.STATUS_SENDING, Delivery.STATUS_DEFERRED,
+            Delivery.STATUS_RETRYING,
+        ]).exists()
+        status = self.STATUS_RUNNING if unfinished else self.STATUS_COMPLETED
+        if status != self.status:
+            self.status = status
+            self.finished_at = None if unfinished else timezone.now()
+            self.save(update_fields=['status', 'finished_at'])
+
+
+class Delivery(models.Model):
+    """投递记录（每个投递任务中每个订阅一条）"""
+    STATUS_PENDING = 'pending'
+    STATUS_SENDING = 'sending'
+    STATUS_SENT = 'sent'
+    STATUS_FAILED = 'failed'
+    STATUS_DEFERRED = 'deferred'
+    STATUS_RETRYING = 'retrying'
+    STATUS_CHOICES = [
+        (STATUS_PENDING, '待发送'),
+        (STATUS_SENDING, '发送中'),
+        (STATUS_SENT, '已发送'),
+        (STATUS_FAILED, '发送失败'),
+        (STATUS_DEFERRED, '延后发送'),
+        (STATUS_RETRYING, '等待重试'),
+    ]
+
+    run = models.ForeignKey(DeliveryRun, on_delete=models.CASCADE, related_name='deliveries', verbose_name="投递任务")
+    subscription = models.ForeignKey(Subscription, on_delete=models.CASCADE, related_name='deliveries', verbose_name="订阅")
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default=STATUS_PENDING, verbose_name="状态")
+    attempts = models.PositiveIntegerField(default=0, verbose_name="尝试次数")
+    error_message = models.TextField(blank=True, default='', verbose_name="错误信息")
+    updated_at = models.DateTimeField(auto_now=True, verbose_name="更新时间")
+
+    class Meta:
+        verbose_name = "投递记录"
+        verbose_name_plural = "投递记录"
+        unique_together = ['run', 'subscription']
+
+    def __str__(self):
+        return f"{self.run.run_key} - {self.subscription_id}"
+
+    @classmethod
+    def claimable_q(cls, prefix='', include_deferred=False):
+        """
+        可以（重新）认领的投递：待发送、发送失败，
+        以及worker异常退出后长时间停留在发送中的投递。
+        延后发送、等待重试的投递只由对应的延后任务、重试任务认领。
+        """
+        statuses = [cls.STATUS_PENDING, cls.STATUS_FAILED]
+        if include_deferred:
+            statuses.extend([cls.STATUS_DEFERRED, cls.STATUS_RETRYING])
+        stale_before = timezone.now() - timedelta(seconds=settings.EMAIL_DELIVERY_CLAIM_TIMEOUT)
+        return (
+            models.Q(**{f'{prefix}status__in': statuses})
+            | models.Q(**{f'{prefix}status': cls.STATUS_SENDING, f'{prefix}updated_at__lt': stale_before})
+        )
+
+
+class DeadLetter(models.Model):
+    """死信邮件（多次重试仍失败或遇到永久错误的邮件）"""
+    subscription = models.ForeignKey(Subscription, on_delete=models.CASCADE, verbose_name="订阅")
+    run = models.ForeignKey(DeliveryRun, on_delete=models.SET_NULL, null=True, blank=True, verbose_name="投递任务")
+    error_class = models.CharField(max_length=20, verbose_name="错误类型")
+    error_message = models.TextField(blank=True, default='', verbose_name="错误信息")
+    attempts = models.PositiveIntegerField(default=0, verbose_name="尝试次数")
+    created_at = models.DateTimeField(auto_now_add=True, verbose_name="创建时间")
+
+    class Meta:
+        verbose_name = "死信邮件"
+        verbose_name_plural = "死信邮件"
+        ordering = ['-created_at']
+
+    def __str__(self):
+        return f"{self.subscription.email} - {self.error_class}"
+
+
+class _PendingStats:
+    """批量模式下尚未写入数据库的统计增量"""
+
+    def __init__(self):
+        self.rows = {}  # {(日期, 城市键): {计数字段: 增量}}
+        self.events = 0
+
+
+# 当前上下文中的批量统计，见DailyStatsManager.batch()
+_pending_stats = contextvars.ContextVar('daily_stats_pending', default=None)
+
+
+class DailyStatsManager(models.Manager):
+    """每日统计管理器"""
+
+    COUNTERS = ('users_joined', 'subscriptions_created', 'emails_sent', 'emails_failed')
+
+    # 批量模式下累计多少次增量后写入一次数据库
+    BATCH_FLUSH_EVENTS = 200
+
+    def increment(self, date, city_id=None, **deltas):
+        """
+        累加某天（某城市）的统计数
+        在batch()中调用时先在内存中累计，批量写入。
+        :param date: 日期
+        :param city_id: 城市ID，为None时累加全站统计
+        :param deltas: 各计数字段的增量
+        """
+        pending = _pending_stats.get()
+        if pending is None:
+            self._apply(date, city_id or 0, deltas)
+            return
+
+        row = pending.rows.setdefault((date, city_id or 0), {})
+        for name, value in deltas.items():
+            row[name] = row.get(name, 0) + value
+        pending.events += 1
+        if pending.events >= self.BATCH_FLUSH_EVENTS:
+            self._flush(pending)
+
+    @contextmanager
+    def batch(self):
+        """
+        批量累加统计（如批量发送邮件时）
+        每封邮件都要累加全站统计，逐条更新时全站记录是热点行；批量模式下
+        每BATCH_FLUSH_EVENTS次增量、以及退出时，每条统计记录只更新一次。
+        """
+        if _pending_stats.get() is not None:
+            # 已在批量模式中
+            yield
+            return
+
+        pending = _PendingStats()
+        token = _pending_stats.set(pending)
+        try:
+            yield
+        finally:
+            _pending_stats.reset(token)
+            self._flush(pending)
+
+    def _flush(self, pending):
+        # 按固定顺序更新，多个worker同时写入时不会互相等待对方持有的行锁
+        for (date, city_key), deltas in sorted(pending.rows.items()):
+            self._apply(date, city_key, deltas)
+        pending.rows = {}
+        pending.events = 0
+
+    def _apply(self, date, city_key, deltas):
+        """
+        把增量写入数据库：通常已有当天的记录，直接用一条UPDATE累加
+        :param city_key: 城市ID，全站统计为0
+        """
+        updates = {name: models.F(name) + value for name, value in deltas.items()}
+        rows = self.filter(date=date, city_key=city_key)
+        if rows.update(updated_at=timezone.now(), **updates):
+            return
+        try:
+            with transaction.atomic():
+                self.create(date=date, city_id=city_key or None, city_key=city_key, **deltas)
+        except IntegrityError:
+            # 并发创建了同一天的记录，改为累加
+            rows.update(updated_at=timezone.now(), **updates)
+
+    def series(self, days, city_id=None):
+        """
+        最近days天的统计（包含今天），没有数据的日期补0
+        :return: [{'date': date, 'users_joined': ..., ...}] 按日期升序
+        """
+        start = timezone.localdate() - timedelta(days=days - 1)
+        rows = self.filter(date__gte=start, city_key=city_id or 0).values('date').annotate(
+            **{name: models.Sum(name) for name in self.COUNTERS}
+        ).order_by('date')
+        by_date = {row.pop('date'): row for row in rows}
+
+        empty = dict.fromkeys(self.COUNTERS, 0)
+        return [
+            {'date': day, **by_date.get(day, empty)}
+            for day in (start + timedelta(days=i) for i in range(days))
+        ]
+
+
+class DailyStats(models.Model):
+    """
+    每日统计汇总
+    city为空的记录是全站统计，其余为各城市的订阅和邮件统计。
+    由信号在用户、订阅、邮件日志创建时增量更新，可以用backfill_daily_stats命令重建。
+    """
+    date = models.DateField(verbose_name="日期")
+    city = models.ForeignKey(
+        City, on_delete=models.CASCADE, null=True, blank=True,
+        related_name='daily_stats', verbose_name="城市"
+    )
+    # 唯一约束中NULL互不相等，全站统计用0代替空的城市，保证每天只有一条全站记录
+    city_key = models.PositiveIntegerField(default=0, verbose_name="城市键")
+    users_joined = models.PositiveIntegerField(default=0, verbose_name="新增用户")
+    subscriptions_created = models.PositiveIntegerField(default=0, verbose_name="新增订阅")
+    emails_sent = models.PositiveIntegerField(default=0, verbose_name="发送成功")
+    emails_failed = models.PositiveIntegerField(default=0, verbose_name="发送失败")
+    updated_at = models.DateTimeField(auto_now=True, verbose_name="更新时间")
+
+    objects = DailyStatsManager()
+
+    class Meta:
+        verbose_name = "每日统计"
+        verbose_name_plural = "每日统计"
+        unique_together = ['date', 'city_key']
+        ordering = ['-date']
+
+    def __str__(self):
+        scope = self.city.name if self.city_id else '全站'
+        return f"{self.date} - {scope}"
+
+    def save(self, *args, **kwargs):
+        self.city_key = self.city_id or 0
+        super().save(*args, **kwargs)
@@ -0,0 +1,96 @@
+import random
+import smtplib
+import socket
+import logging
+
+from django.conf import settings
+
+from .throttle import is_throttle_error
+
+logger = logging.getLogger(__name__)
+
+# 错误分类
+ERROR_TRANSIENT = 'transient'
+ERROR_PERMANENT = 'permanent'
+
+
+def classify_error(error):
+    """
+    判断发送异常是临时错误（可以重试）还是永久错误
+    :param error: 异常对象
+    :return: ERROR_TRANSIENT / ERROR_PERMANENT
+    """
+    if is_throttle_error(error):
+        return ERROR_TRANSIENT
+    if isinstance(error, smtplib.SMTPRecipientsRefused):
+        codes = [code for code, _ in error.recipients.values()]
+        return ERROR_TRANSIENT if codes and all(400 <= code < 500 for code in codes) else ERROR_PERMANENT
+    if isinstance(error, smtplib.SMTPResponseException):
+        return ERROR_TRANSIENT if 400 <= error.smtp_code < 500 else ERROR_PERMANENT
+    if isinstance(error, smtplib.SMTPServerDisconnected):
+        return ERROR_TRANSIENT
+    if isinstance(error, smtplib.SMTPException):
+        return ERROR_PERMANENT
+    if isinstance(error, (socket.timeout, ConnectionError, OSError)):
+        # 网络超时、连接失败
+        return ERROR_TRANSIENT
+    return ERROR_PERMANENT
+
+
+def backoff_delay(attempt):
+    """
+    计算第attempt次重试前的等待秒数（指数退避，带上限和随机抖动）
+    """
+    delay = min(
+        settings.EMAIL_RETRY_BASE_DELAY * (2 ** (attempt - 1)),
+        settings.EMAIL_RETRY_MAX_DELAY,
+    )
+    return int(delay * random.uniform(0.8, 1.2))
+
+
+def schedule_retry(subscriptions, error_class, error_message, attempt=1, run=None):
+    """
+    安排失败邮件重试；永久错误或超过最大重试次数时转入死信表
+    :param subscriptions: 同一封邮件包含的订阅列表
+    :param error_class: 错误分类
+    :param error_message: 错误信息
+    :param attempt: 已经尝试的次数
+    :param run: 所属投递任务
+    :return: 是否安排了重试
+    """
+    from weatherblog.celery import apply_deferred
+    from .models import DeadLetter, Delivery
+    from .tasks import retry_weather_email
+
+    email = subscriptions[0].email
+    if error_class == ERROR_PERMANENT or attempt >= settings.EMAIL_RETRY_MAX_ATTEMPTS:
+        DeadLetter.objects.bulk_create([
+            DeadLetter(
+                subscription=subscription,
+                run=run,
+                error_class=error_class,
+                error_message=error_message,
+                attempts=attempt,
+            )
+            for subscription in subscriptions
+        ])
+        logger.error(f"邮件转入死信表: {email} - 尝试 {attempt} 次 - {error_message}")
+        return False
+
+    if run:
+        # 重试完成前投递任务不算完成；先标记再安排，避免重试先执行后状态被覆盖
+        run.record(
+            [subscription.id for subscription in subscriptions],
+            Delivery.STATUS_RETRYING, error_message,
+        )
+
+    countdown = backoff_delay(attempt)
+    apply_deferred(
+        retry_weather_email,
+        args=[[subscription.id for subscription in subscriptions]],
+        kwargs={'attempt': attempt + 1, 'run_id': run.id if run else None},
+        countdown=countdown,
+        queue=settings.EMAIL_RETRY_QUEUE,
+    )
+    logger.info(f"邮件将在 {countdown} 秒后重试: {email} - 第 {attempt + 1} 次")
+    return True
@@ -0,0 +1,191 @@
+import re
+import time
+import smtplib
+import logging
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.mail import get_connection
+from django.utils import timezone
+
+from monitoring.metrics import SMTP_SEND_FAILURES, SMTP_SEND_SECONDS
+from .retry import classify_error
+from .throttle import SendScheduler, SendThrottled, is_throttle_error
+
+logger = logging.getLogger(__name__)
+
+# 除限流响应外，这些响应码也说明账号暂时不可用（认证失败）。
+# 554等针对单封邮件的拒绝（内容、策略）不摘除账号，按永久错误处理，也不换账号重发。
+DRAIN_SMTP_CODES = {535}
+
+
+def should_drain(error):
+    """判断发送异常是否需要把账号暂时摘除"""
+    if is_throttle_error(error):
+        return True
+    if isinstance(error, smtplib.SMTPResponseException):
+        return error.smtp_code in DRAIN_SMTP_CODES
+    return isinstance(error, (smtplib.SMTPConnectError, smtplib.SMTPAuthenticationError))
+
+
+class SenderAccount:
+    """发件账号"""
+
+    def __init__(self, username, password, host=None, port=None, use_tls=None,
+                 from_email=None, per_minute=None, per_day=None, is_default=False):
+        self.username = username
+        self.password = password
+        self.host = host or settings.EMAIL_HOST
+        self.port = port or settings.EMAIL_PORT
+        self.use_tls = settings.EMAIL_USE_TLS if use_tls is None else use_tls
+        self.from_email = from_email or username
+        self.is_default = is_default
+        # 缓存键中只保留安全字符
+        self.key_name = re.sub(r'[^\w.@-]', '_', username)
+        self.scheduler = SendScheduler(
+            name=f'sender:{self.key_name}',
+            per_minute=per_minute,
+            per_day=per_day,
+        )
+        self._connection = None
+
+    def __str__(self):
+        return self.username
+
+    @property
+    def _health_key(self):
+        return f'email_sender:drained:{self.key_name}'
+
+    def is_healthy(self):
+        """账号是否可用（未被摘除）"""
+        return not cache.get(self._health_key)
+
+    def drain(self, error=None):
+        """暂时摘除账号，冷却期后自动恢复"""
+        cache.set(self._health_key, str(error or True), settings.EMAIL_SENDER_DRAIN_SECONDS)
+        self.close()
+        logger.warning(f"发件账号已摘除: {self.username} - {error}")
+
+    def get_connection(self):
+        """获取（复用）该账号的SMTP连接"""
+        if self._connection is None:
+            if self.is_default:
+                # 单账号时沿用全局邮件配置
+                self._connection = get_connection()
+            else:
+                self._connection = get_connection(
+                    host=self.host,
+                    port=self.port,
+                    username=self.username,
+                    password=self.password,
+                    use_tls=self.use_tls,
+                )
+            self._connection.open()
+        return self._connection
+
+    def close(self):
+        if self._connection is not None:
+            try:
+                self._connection.close()
+            except Exception:
+                pass
+            self._connection = None
+
+
+class SenderPool:
+    """
+    发件账号池
+    按轮询顺序把邮件分配给健康且有发送余量的账号，
+    账号返回限流等响应时自动摘除，冷却后恢复。
+    """
+
+    def __init__(self, accounts=None):
+        self.accounts = accounts or self._load_accounts()
+
+    @staticmethod
+    def _load_accounts():
+        configured = settings.EMAIL_SENDER_ACCOUNTS
+        if not configured:
+            return [SenderAccount(
+                username=settings.EMAIL_HOST_USER,
+                password=settings.EMAIL_HOST_PASSWORD,
+                from_email=settings.DEFAULT_FROM_EMAIL,
+                is_default=True,
+            )]
+        return [SenderAccount(**config) for config in configured]
+
+    @property
+    def per_minute(self):
+        """账号池每分钟总发送额度"""
+        return sum(account.scheduler.per_minute for account in self.accounts)
+
+    @property
+    def per_day(self):
+        """账号池每天总发送额度"""
+        return sum(account.scheduler.per_day for account in self.accounts)
+
+    def _rotation(self):
+        """从轮询游标开始排列账号"""
+        cache.add('email_sender:rr', 0, None)
+        start = cache.incr('email_sender:rr') % len(self.accounts)
+        return self.accounts[start:] + self.accounts[:start]
+
+    def send(self, message):
+        """
+        通过账号池发送邮件
+        只有服务商返回限流响应或所有账号都没有余量时才抛出SendThrottled，
+        其他发送异常原样抛出，由调用方按失败处理；发送失败时归还占用的发送名额。
+        :param message: EmailMessage对象
+        :return: 实际使用的发件账号
+        """
+        last_error = None
+
+        for account in self._rotation():
+            now = timezone.now()
+            if not account.is_healthy() or not account.scheduler.try_acquire(now):
+                continue
+
+            message.from_email = account.from_email
+            try:
+                self._send_with_reconnect(account, message)
+                return account
+            except smtplib.SMTPServerDisconnected as e:
+                # 重新连接后仍被断开，换下一个账号
+                account.scheduler.release(now)
+                account.close()
+                last_error = e
+            except Exception as e:
+                account.scheduler.release(now)
+                if not should_drain(e):
+                    raise
+                account.drain(e)
+                last_error = e
+
+        if last_error is None or is_throttle_error(last_error):
+            raise SendThrottled("没有可用的发件账号") from last_error
+        raise last_error
+
+    def _send_with_reconnect(self, account, message):
+        """用指定账号发送邮件，复用的连接已被服务器断开时重新连接并重试一次"""
+        try:
+            self._send_once(account, message)
+        except smtplib.SMTPServerDisconnected:
+            logger.info(f"SMTP连接已断开，重新连接: {account.username}")
+            account.close()
+            self._send_once(account, message)
+
+    @staticmethod
+    def _send_once(account, message):
+        started = time.perf_counter()
+        try:
+            message.connection = account.get_connection()
+            message.send()
+        except Exception as e:
+            SMTP_SEND_FAILURES.labels('weather', classify_error(e)).inc()
+            raise
+        SMTP_SEND_SECONDS.labels('weather').observe(time.perf_counter() - started)
+
+    def close(self):
+        """关闭所有账号的SMTP连接"""
+        for account in self.accounts:
+            account.close()
@@ -0,0 +1,61 @@
+from django.conf import settings
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+from django.utils import timezone
+
+from .models import Subscription, EmailLog, DailyStats
+from .dashboard import invalidate_stats
+from .fragments import bump_subscription_versions
+
+
+@receiver(post_save, sender=settings.AUTH_USER_MODEL)
+def count_user_joined(sender, instance, created, raw=False, **kwargs):
+    """新用户注册时累加每日统计"""
+    if created and not raw:
+        DailyStats.objects.increment(timezone.localdate(instance.date_joined), users_joined=1)
+
+
+@receiver(post_save, sender=Subscription)
+def count_subscription_created(sender, instance, created, raw=False, **kwargs):
+    """新增订阅时累加全站和城市的每日统计"""
+    if created and not raw:
+        date = timezone.localdate(instance.created_at)
+        DailyStats.objects.increment(date, subscriptions_created=1)
+        DailyStats.objects.increment(date, city_id=instance.city_id, subscriptions_created=1)
+
+
+@receiver(post_save, sender=EmailLog)
+def count_email_sent(sender, instance, created, raw=False, **kwargs):
+    """
+    记录邮件日志时累加全站统计，以及邮件包含的每个城市的发送统计
+    批量发送在DailyStats.objects.batch()中进行，增量先在内存中累计。
+    """
+    if created and not raw:
+        date = timezone.localdate(instance.sent_at)
+        counter = 'emails_sent' if instance.is_sent else 'emails_failed'
+        DailyStats.objects.increment(date, **{counter: 1})
+        for city_id in instance.get_city_ids():
+            DailyStats.objects.increment(date, city_id=city_id, **{counter: 1})
+
+
+@receiver(post_save, sender=settings.AUTH_USER_MODEL)
+@receiver(post_delete, sender=settings.AUTH_USER_MODEL)
+@receiver(post_save, sender=Subscription)
+@receiver(post_delete, sender=Subscription)
+def invalidate_admin_stats(sender, raw=False, update_fields=None, **kwargs):
+    """
+    用户、订阅变化时使管理后台统计缓存失效
+    邮件日志数量多，不逐条处理，由批量发送和清理任务结束时统一失效。
+    """
+    if raw or update_fields == frozenset(['last_login']):
+        # 登录只更新last_login，不影响统计
+        return
+    invalidate_stats()
+
+
+@receiver(post_save, sender=Subscription)
+@receiver(post_delete, sender=Subscription)
+def bump_subscription_version(sender, instance, raw=False, **kwargs):
+    """订阅变化时使该用户的订阅列表片段缓存失效"""
+    if not raw:
+        bump_subscription_versions([instance.user_id])
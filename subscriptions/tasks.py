@@ -1,48 +1,122 @@
+import time
+
 from celery import shared_task
 from django.utils import timezone
-from .models import Subscription
-from .email_service import EmailService
+from monitoring.metrics import DELIVERY_EMAILS, DELIVERY_RUN_SECONDS
+from weatherblog.timing import StageTimer, stage
+from .models import Subscription, DeliveryRun, Delivery
+from .email_service import EmailService, DELIVERY_SENT, DELIVERY_THROTTLED
+from .retry import schedule_retry
+from .dashboard import invalidate_stats
 import logging
 
 logger = logging.getLogger(__name__)
 
+# 每日任务每批处理的订阅数量
+DELIVERY_CHUNK_SIZE = 1000
+
+
+def daily_run_key(date=None):
+    """每日投递任务的标识"""
+    return f"daily-{date or timezone.localdate():%Y-%m-%d}"
+
 
 @shared_task
-def send_daily_weather_emails():
+def start_daily_weather_emails():
+    """
+    由定时任务调用，在提交时确定当天的投递任务标识
+    send_daily_weather_emails在worker退出后可能较晚才被重新投递，
+    标识不能在执行时才计算，否则跨过零点后会生成新的投递任务，把已发送的订阅再发一遍。
+    """
+    run_key = daily_run_key()
+    send_daily_weather_emails.delay(run_key=run_key)
+    return run_key
+
+
+@shared_task(acks_late=True, reject_on_worker_lost=True)
+def send_daily_weather_emails(run_key=None):
     """
     每日定时发送天气邮件任务
+    每次运行对应一条投递任务记录，重复执行时只会发送尚未投递成功的订阅，
+    因此worker中途退出后可以安全地重新执行。
+    :param run_key: 投递任务标识，由调用方在提交任务时确定（见start_daily_weather_emails）；
+                    为空时使用当天日期，只适合直接调用
     """
-    logger.info("开始执行每日天气邮件发送任务")
-    
-    # 获取所有活跃的订阅
-    active_subscriptions = Subscription.objects.filter(
+    run_key = run_key or daily_run_key()
+    logger.info(f"开始执行每日天气邮件发送任务: {run_key}")
+
+    run, created = DeliveryRun.objects.get_or_create(run_key=run_key)
+    if run.status == DeliveryRun.STATUS_COMPLETED:
+        logger.info(f"投递任务 {run_key} 已完成，任务结束")
+        return f"投递任务 {run_key} 已完成"
+
+    # 为所有活跃订阅创建投递记录（已存在的记录保持不变）
+    subscription_ids = Subscription.objects.filter(
         is_active=True
-    ).select_related('user', 'city')
-    
-    if not active_subscriptions.exists():
-        logger.info("没有活跃的订阅，任务结束")
-        return "没有活跃的订阅"
-    
-    logger.info(f"找到 {active_subscriptions.count()} 个活跃订阅")
+    ).values_list('id', flat=True).order_by('id')
+    batch = []
+    for subscription_id in subscription_ids.iterator(chunk_size=DELIVERY_CHUNK_SIZE):
+        batch.append(Delivery(run=run, subscription_id=subscription_id))
+        if len(batch) >= DELIVERY_CHUNK_SIZE:
+            Delivery.objects.bulk_create(batch, ignore_conflicts=True)
+            batch = []
+    if batch:
+        Delivery.objects.bulk_create(batch, ignore_conflicts=True)
+
+    run.total_count = run.deliveries.count()
+    run.save(update_fields=['total_count'])
+
+    # 只处理待发送和发送失败的投递，只加载发送需要的字段
+    pending_subscriptions = Subscription.objects.filter(
+        Delivery.claimable_q(prefix='deliveries__'),
+        deliveries__run=run,
+        is_active=True,
+    ).for_delivery()
+
+    # 同一接收邮箱的订阅合并为一封邮件
+    pending_count = pending_subscriptions.values('email').distinct().count()
+    if not pending_count:
+        run.refresh_status()
+        logger.info("没有待发送的订阅，任务结束")
+        return "没有待发送的订阅"
+
+    logger.info(f"投递任务 {run_key}: 共 {run.total_count} 个订阅, 待发送 {pending_count} 封邮件")
+    started = time.perf_counter()
     
-    # 创建邮件服务实例
-    email_service = EmailService()
+    # 创建邮件服务实例，记录各阶段耗时
+    timer = StageTimer()
+    email_service = EmailService(timer=timer)
+
+    # 按发送限额估算本次任务的完成时间
+    projection = email_service.scheduler.publish_projection(pending_count)
+    if projection:
+        logger.info(f"预计完成时间: {timezone.localtime(projection):%Y-%m-%d %H:%M}")
     
-    # 批量发送邮件
-    success_count, failure_count = email_service.send_bulk_weather_emails(
-        active_subscriptions
+    # 按键集分页逐批读取订阅并直接发送，不一次性加载全部订阅
+    success_count, failure_count, deferred_count = email_service.send_bulk_weather_emails(
+        pending_subscriptions.iter_by_email(chunk_size=DELIVERY_CHUNK_SIZE), run=run
     )
+    run.refresh_status()
+    run.add_timing(timer.summary(), 'daily')
+
+    DELIVERY_RUN_SECONDS.observe(time.perf_counter() - started)
+    DELIVERY_EMAILS.labels('sent').inc(success_count)
+    DELIVERY_EMAILS.labels('failed').inc(failure_count)
+    DELIVERY_EMAILS.labels('deferred').inc(deferred_count)
     
-    result_message = f"邮件发送完成: 成功 {success_count}, 失败 {failure_count}"
+    result_message = (
+        f"邮件发送完成: 成功 {success_count}, 失败 {failure_count}, 延后 {deferred_count}"
+    )
     logger.info(result_message)
     
     return result_message
 
 
-@shared_task
-def send_weather_email_for_subscription(subscription_id):
+@shared_task(acks_late=True)
+def send_weather_email_for_subscription(subscription_id, run_id=None):
     """
     为单个订阅发送天气邮件
+    :param run_id: 所属投递任务，指定时已投递的订阅不会重复发送
     """
     try:
         subscription = Subscription.objects.get(
@@ -50,19 +124,43 @@ def send_weather_email_for_subscription(subscription_id):
             is_active=True
         )
 
+        run = DeliveryRun.objects.get(id=run_id) if run_id else None
+        if run and not run.claim(subscription_id):
+            return f"订阅 {subscription_id} 已投递，跳过"
+
         email_service = EmailService()
-        success = email_service.send_weather_email(subscription)
+        result = email_service.deliver_weather_email(subscription)
 
-        if success:
+        if result == DELIVERY_THROTTLED:
+            # 服务商限流，重新预约时间槽后再发送
+            email_service._defer([subscription], email_service.scheduler.reserve(), run)
+            return f"订阅 {subscription_id} 邮件已延后发送"
+
+        if run:
+            run.record([subscription_id], result, email_service.last_error)
+        if result != DELIVERY_SENT:
+            schedule_retry(
+                [subscription], email_service.last_error_class,
+                email_service.last_error, run=run
+            )
+        if run:
+            # 安排重试之后再刷新，等待重试的投递不算完成
+            run.refresh_status()
+
+        if result == DELIVERY_SENT:
             logger.info(f"订阅 {subscription_id} 邮件发送成功")
             return f"订阅 {subscription_id} 邮件发送成功"
         else:
             logger.error(f"订阅 {subscription_id} 邮件发送失败")
             return f"订阅 {subscription_id} 邮件发送失败"
 
-    except Subscription.DoesNotExist:
+    except (Subscription.DoesNotExist, DeliveryRun.DoesNotExist):
         error_msg = f"订阅 {subscription_id} 不存在或已停用"
         logger.error(error_msg)
+        if run_id:
+            Delivery.objects.filter(
+                run_id=run_id, subscription_id=subscription_id
+            ).update(status=Delivery.STATUS_FAILED, error_message=error_msg)
         return error_msg
     except Exception as e:
         error_msg = f"订阅 {subscription_id} 邮件发送异常: {str(e)}"
@@ -97,6 +195,11 @@ def send_weather_email(subscription_id, is_test=False):
             return f"订阅 {subscription_id} {action}发送成功"
         else:
             logger.error(f"订阅 {subscription_id} {action}发送失败")
+            if not is_test:
+                schedule_retry(
+                    [subscription], email_service.last_error_class,
+                    email_service.last_error
+                )
             return f"订阅 {subscription_id} {action}发送失败"
 
     except Subscription.DoesNotExist:
@@ -109,6 +212,77 @@ def send_weather_email(subscription_id, is_test=False):
         return error_msg
 
 
+@shared_task(acks_late=True)
+def send_weather_digest(subscription_ids, run_id=None):
+    """
+    把同一接收邮箱的多个订阅合并为一封天气摘要邮件发送
+    :param subscription_ids: 订阅ID列表
+    :param run_id: 所属投递任务，指定时已投递的订阅不会重复发送
+    """
+    return _deliver_digest(subscription_ids, run_id=run_id)
+
+
+@shared_task(acks_late=True)
+def retry_weather_email(subscription_ids, attempt=2, run_id=None):
+    """
+    重试发送失败的天气邮件（在独立的低优先级队列中执行）
+    :param subscription_ids: 同一封邮件包含的订阅ID列表（兼容单个订阅ID）
+    :param attempt: 本次是第几次尝试
+    :param run_id: 所属投递任务
+    """
+    if isinstance(subscription_ids, int):
+        subscription_ids = [subscription_ids]
+    return _deliver_digest(subscription_ids, run_id=run_id, attempt=attempt)
+
+
+def _deliver_digest(subscription_ids, run_id=None, attempt=1):
+    """发送摘要邮件，记录投递结果，失败时安排重试"""
+    subscriptions = list(
+        Subscription.objects.filter(
+            id__in=subscription_ids,
+            is_active=True
+        ).select_related('city').order_by('id')
+    )
+    if not subscriptions:
+        error_msg = f"订阅 {subscription_ids} 不存在或已停用"
+        logger.error(error_msg)
+        return error_msg
+
+    run = DeliveryRun.objects.filter(id=run_id).first() if run_id else None
+    # 属于投递任务的发送计入任务的耗时统计
+    timer = StageTimer() if run else None
+    if run:
+        with stage(timer, 'claim'):
+            subscriptions = [subscription for subscription in subscriptions if run.claim(subscription.id)]
+        if not subscriptions:
+            return f"订阅 {subscription_ids} 已投递，跳过"
+
+    email = subscriptions[0].email
+    email_service = EmailService(timer=timer)
+    with email_service._recipient(email):
+        result = email_service.deliver_weather_digest(subscriptions)
+
+        with stage(timer, 'record'):
+            if result == DELIVERY_THROTTLED:
+                # 服务商限流，重新预约时间槽后再发送
+                email_service._defer(subscriptions, email_service.scheduler.reserve(), run)
+            else:
+                email_service.record_digest_result(subscriptions, result, run=run, attempt=attempt)
+
+    if run:
+        run.add_timing(timer.summary(), 'retry' if attempt > 1 else 'deferred')
+    if result == DELIVERY_THROTTLED:
+        return f"{email} 的邮件已延后发送"
+
+    if run:
+        run.refresh_status()
+
+    if result == DELIVERY_SENT:
+        logger.info(f"{email} 的天气邮件第 {attempt} 次发送成功")
+        return f"{email} 的天气邮件发送成功"
+    return f"{email} 的天气邮件第 {attempt} 次发送失败"
+
+
 @shared_task
 def test_celery_task():
     """
@@ -126,14 +300,18 @@ def cleanup_old_email_logs():
     清理旧的邮件日志（保留30天）
     """
     from datetime import timedelta
-    from .models import EmailLog
+    from .models import EmailLog, EmailBody
     
     cutoff_date = timezone.now() - timedelta(days=30)
     
     deleted_count, _ = EmailLog.objects.filter(
         sent_at__lt=cutoff_date
     ).delete()
+
+    # 清理不再被任何日志引用的邮件正文
+    body_count, _ = EmailBody.objects.filter(logs__isnull=True).delete()
+    invalidate_stats()
     
-    message = f"清理了 {deleted_count} 条旧邮件日志"
+    message = f"清理了 {deleted_count} 条旧邮件日志, {body_count} 份邮件正文"
     logger.info(message)
     return message
@@ -1,3 +1,1080 @@
-from django.test import TestCase
+import csv
+import gzip
+import json
+import os
+import re
+import smtplib
+import tempfile
+from datetime import datetime, timedelta
+from io import StringIO
+from unittest import mock
 
-# Create your tests here.
+from django.core import mail
+from django.core.mail import EmailMessage
+from django.core.cache import cache
+from django.core.management import CommandError, call_command
+from django.core.exceptions import ImproperlyConfigured
+from django.db import IntegrityError, connection, transaction
+from django.db.models import Count
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+
+from accounts.models import User
+from weatherblog.celery import app, apply_deferred, forward_deferred
+from weatherblog.exports import EXPORT_CHUNK_SIZE, iter_export, iter_rows
+from weather.models import City, WeatherData
+from .admin import EmailLogAdmin
+from .email_service import EmailService, DELIVERY_SENT
+from .email_templates import compile_template, inline_css, parse_stylesheet
+from .fragments import subscription_version
+from .retry import ERROR_PERMANENT, classify_error
+from .sender_pool import SenderAccount, SenderPool
+from .tasks import (
+    cleanup_old_email_logs, daily_run_key, retry_weather_email, send_daily_weather_emails, send_weather_digest, start_daily_weather_emails,
+)
+from .throttle import SendScheduler, SendThrottled
+from .models import Subscription, EmailLog, EmailBody, DeliveryRun, Delivery, DeadLetter, DailyStats
+
+
+class QueryPlanTests(TestCase):
+    """热点查询的执行计划回归测试：任何一个查询退化为全表扫描都会失败"""
+
+    @classmethod
+    def setUpTestData(cls):
+        province = City.objects.create(name='浙江省', adcode='330000', level=1)
+        cls.cities = [
+            City.objects.create(name=f'城市{i:02d}', adcode=f'3301{i:02d}', level=2, parent=province)
+            for i in range(20)
+        ]
+        cls.province = province
+
+        for u in range(50):
+            user = User.objects.create(username=f'user{u}', email=f'user{u}@example.com')
+            for city in cls.cities[u % 5::5]:
+                subscription = Subscription.objects.create(
+                    user=user, city=city, email=user.email, is_active=u % 7 != 0
+                )
+                EmailLog.objects.create(
+                    subscription=subscription, email=user.email,
+                    subject='天气预报', is_sent=u % 3 != 0
+                )
+
+        for city in cls.cities:
+            for _ in range(3):
+                WeatherData.objects.create(
+                    city=city, weather='晴', temperature='20', winddirection='北',
+                    windpower='3', humidity='40', reporttime='2026-01-01 08:00:00'
+                )
+
+    def assertNoFullScan(self, queryset):
+        """断言查询使用了索引，而不是全表扫描"""
+        vendor = connection.vendor
+        if vendor == 'sqlite':
+            plan = queryset.explain()
+            full_scans = [
+                line for line in plan.splitlines()
+                if re.search(r'\bSCAN \w+$', line.strip())
+            ]
+            self.assertFalse(full_scans, f"查询退化为全表扫描:\n{queryset.query}\n{plan}")
+        elif vendor == 'mysql':
+            plan = json.loads(queryset.explain(format='json'))
+            full_scans = re.findall(r'"table_name": "(\w+)"[^{}]*"access_type": "ALL"', json.dumps(plan))
+            self.assertFalse(full_scans, f"查询退化为全表扫描:\n{queryset.query}\n{plan}")
+        else:
+            self.skipTest(f"不支持检查 {vendor} 的执行计划")
+
+    def test_active_subscriptions_by_city(self):
+        queryset = Subscription.objects.filter(is_active=True).values('city').annotate(total=Count('id'))
+        self.assertNoFullScan(queryset)
+
+    def test_active_subscriptions_keyset(self):
+        queryset = Subscription.objects.filter(
+            is_active=True, email__gt='user1@example.com'
+        ).order_by('email', 'id').values('id', 'email', 'city_id')[:100]
+        self.assertNoFullScan(queryset)
+
+    def test_recent_email_logs_by_status(self):
+        since = timezone.now() - timedelta(days=30)
+        queryset = EmailLog.objects.filter(sent_at__gte=since, is_sent=True).values('id')
+        self.assertNoFullScan(queryset)
+
+    def test_email_log_admin_ordering(self):
+        queryset = EmailLog.objects.order_by('-sent_at')[:50]
+        self.assertNoFullScan(queryset)
+
+    def test_latest_weather_for_city(self):
+        queryset = WeatherData.objects.filter(city=self.cities[0]).order_by('-created_at')[:1]
+        self.assertNoFullScan(queryset)
+
+    def test_city_children(self):
+        queryset = City.objects.filter(parent=self.province, level=2).order_by('name')
+        self.assertNoFullScan(queryset)
+
+
+class SubscriptionStreamingTests(TestCase):
+    """每日任务按 (email, id) 键集分页逐批读取订阅，只加载发送需要的字段"""
+
+    @classmethod
+    def setUpTestData(cls):
+        province = City.objects.create(name='江苏省', adcode='320000', level=1)
+        cities = [
+            City.objects.create(name=f'城市{i}', adcode=f'3201{i:02d}', level=2, parent=province)
+            for i in range(3)
+        ]
+        cls.subscriptions = []
+        for i in range(3):
+            user = User.objects.create(username=f'reader{i}', email=f'reader{i}@example.com')
+            for city in cities:
+                cls.subscriptions.append(Subscription.objects.create(user=user, city=city, email=user.email))
+        # 另一个账号使用相同的接收邮箱
+        other = User.objects.create(username='family', email='family@example.com')
+        cls.subscriptions.append(Subscription.objects.create(user=other, city=cities[0], email='reader1@example.com'))
+
+    def test_keyset_order(self):
+        expected = sorted(self.subscriptions, key=lambda subscription: (subscription.email, subscription.id))
+
+        streamed = list(Subscription.objects.for_delivery().iter_by_email(chunk_size=4))
+
+        self.assertEqual(streamed, expected)
+
+    def test_queries_per_chunk(self):
+        # 10个订阅每批4个：3批，最后一批不足4个时结束
+        with self.assertNumQueries(3):
+            self.assertEqual(len(list(Subscription.objects.iter_by_email(chunk_size=4))), 10)
+        # 恰好整批时多一次空查询
+        with self.assertNumQueries(3):
+            self.assertEqual(len(list(Subscription.objects.iter_by_email(chunk_size=5))), 10)
+
+    def test_for_delivery_fields(self):
+        subscription = Subscription.objects.for_delivery().first()
+
+        self.assertIn('is_active', subscription.get_deferred_fields())
+        self.assertIn('user_id', subscription.get_deferred_fields())
+        with self.assertNumQueries(0):
+            subscription.email, subscription.city.adcode, subscription.city.name
+
+    def test_daily_task_groups_across_chunks(self):
+        weather = {
+            'city_name': '江苏省', 'forecast': [],
+            'current': {
+                'weather': '晴', 'temperature': '20', 'winddirection': '北',
+                'windpower': '3', 'humidity': '40', 'reporttime': '2026-01-01 08:00:00',
+            },
+        }
+        with mock.patch('subscriptions.tasks.DELIVERY_CHUNK_SIZE', 2), \
+                mock.patch('weather.services.WeatherService.get_weather_for_email', return_value=weather), \
+                mock.patch.object(SendScheduler, 'reserve', side_effect=lambda now=None: timezone.now()):
+            send_daily_weather_emails(run_key='daily-test')
+
+        # 同一接收邮箱的4个订阅跨越多批，仍合并为一封邮件
+        self.assertEqual(sorted(message.to[0] for message in mail.outbox), [
+            'reader0@example.com', 'reader1@example.com', 'reader2@example.com',
+        ])
+        self.assertEqual(DeliveryRun.objects.get().progress()[Delivery.STATUS_SENT], 10)
+
+
+class AdminStatisticsQueryTests(TestCase):
+    """管理后台统计页面的查询次数测试，防止重新出现逐日/逐条查询"""
+
+    @classmethod
+    def setUpTestData(cls):
+        # 与导入的高德数据一致，以国家为根节点：区县 → 城市 → 省 → 国家
+        country = City.objects.create(name='中华人民共和国', adcode='100000', level=0)
+        province = City.objects.create(name='广东省', adcode='440000', level=1, parent=country)
+        city = City.objects.create(name='广州市', adcode='440100', level=2, parent=province)
+        districts = [
+            City.objects.create(name=f'区{i}', adcode=f'4401{i:02d}', level=3, parent=city)
+            for i in range(1, 6)
+        ]
+
+        for u in range(12):
+            user = User.objects.create(
+                username=f'member{u}', email=f'member{u}@example.com',
+                is_email_verified=u % 2 == 0
+            )
+            for district in districts[:u % 4 + 1]:
+                subscription = Subscription.objects.create(user=user, city=district, email=user.email)
+                EmailLog.objects.create(
+                    subscription=subscription, email=user.email,
+                    subject='天气预报', is_sent=u % 3 != 0
+                )
+
+        cls.staff = User.objects.create(
+            username='staff', email='staff@example.com', is_staff=True, is_superuser=True
+        )
+
+    def setUp(self):
+        cache.clear()
+        self.client.force_login(self.staff)
+
+    def test_admin_dashboard_queries(self):
+        # 会话、当前用户 + 4个汇总统计 + 4个列表 + 每日统计
+        with self.assertNumQueries(11):
+            response = self.client.get(reverse('admin_dashboard'))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.context['total_subscriptions'], 30)
+        self.assertEqual(len(response.context['daily_email_stats']), 7)
+        self.assertEqual(response.context['daily_email_stats'][-1]['sent'], 20)
+        self.assertEqual(response.context['failed_emails'], 10)
+
+    def test_user_statistics_queries(self):
+        # 会话、当前用户 + 注册趋势、状态分布、订阅分布
+        with self.assertNumQueries(5):
+            response = self.client.get(reverse('admin_user_statistics'))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.context['user_trend']), 30)
+        self.assertEqual(response.context['user_trend'][-1]['count'], 13)
+        self.assertEqual(response.context['user_status']['verified'], 6)
+        distribution = {
+            item['subscription_count']: item['user_count']
+            for item in response.context['subscription_distribution']
+        }
+        self.assertEqual(distribution, {0: 1, 1: 3, 2: 3, 3: 3, 4: 3})
+
+    def test_cached_statistics(self):
+        self.client.get(reverse('admin_dashboard'))
+
+        # 缓存有效期内只查询会话和当前用户
+        with self.assertNumQueries(2):
+            response = self.client.get(reverse('admin_dashboard'))
+        self.assertContains(response, '数据计算时间')
+        computed_at = response.context['computed_at']
+
+        # 新增订阅后缓存失效，重新计算
+        Subscription.objects.create(
+            user=self.staff, city=City.objects.get(adcode='440101'), email=self.staff.email
+        )
+        response = self.client.get(reverse('admin_dashboard'))
+        self.assertEqual(response.context['total_subscriptions'], 31)
+        self.assertGreater(response.context['computed_at'], computed_at)
+
+
+class AdminChangelistQueryTests(TestCase):
+    """订阅、邮件日志列表的查询次数测试：区县级城市的完整名称要逐级读取到国家"""
+
+    @classmethod
+    def setUpTestData(cls):
+        country = City.objects.create(name='中华人民共和国', adcode='100000', level=0)
+        province = City.objects.create(name='广东省', adcode='440000', level=1, parent=country)
+        city = City.objects.create(name='广州市', adcode='440100', level=2, parent=province)
+        for i in range(1, 6):
+            district = City.objects.create(name=f'区{i}', adcode=f'4401{i:02d}', level=3, parent=city)
+            user = User.objects.create(username=f'member{i}', email=f'member{i}@example.com')
+            subscription = Subscription.objects.create(user=user, city=district, email=user.email)
+            EmailLog.objects.create(subscription=subscription, email=user.email, subject='天气预报')
+
+        cls.staff = User.objects.create(
+            username='staff', email='staff@example.com', is_staff=True, is_superuser=True
+        )
+
+    def setUp(self):
+        self.client.force_login(self.staff)
+
+    def test_subscription_changelist_queries(self):
+        # 会话、当前用户 + 计数、列表（连同四级城市）、城市级别筛选项
+        with self.assertNumQueries(5):
+            response = self.client.get(reverse('admin:subscriptions_subscription_changelist'))
+        self.assertContains(response, '中华人民共和国 广东省 广州市 区1')
+
+    def test_email_log_changelist_queries(self):
+        # 会话、当前用户 + 计数、列表（连同四级城市）、日期导航的两个查询
+        with self.assertNumQueries(6):
+            response = self.client.get(reverse('admin:subscriptions_emaillog_changelist'))
+        self.assertEqual(response.status_code, 200)
+
+
+class ExportTests(TestCase):
+    """邮件日志流式导出：CSV / JSONL、gzip压缩、键集分页、后台操作与管理命令"""
+
+    @classmethod
+    def setUpTestData(cls):
+        province = City.objects.create(name='湖北省', adcode='420000', level=1)
+        wuhan = City.objects.create(name='武汉市', adcode='420100', level=2, parent=province)
+        yichang = City.objects.create(name='宜昌市', adcode='420500', level=2, parent=province)
+        for i, city in enumerate([wuhan, wuhan, yichang], 1):
+            user = User.objects.create(username=f'reader{i}', email=f'reader{i}@example.com')
+            subscription = Subscription.objects.create(user=user, city=city, email=user.email)
+            EmailLog.objects.create(
+                subscription=subscription, email=user.email, subject=f'{city.name}天气预报',
+                city_ids=[city.id], is_sent=True,
+            )
+        cls.fields = EmailLogAdmin.export_fields
+        cls.staff = User.objects.create(
+            username='staff', email='staff@example.com', is_staff=True, is_superuser=True
+        )
+
+    def export(self, fmt='csv', compress=False, chunk_size=EXPORT_CHUNK_SIZE):
+        return b''.join(iter_export(EmailLog.objects.all(), self.fields, fmt, compress, chunk_size))
+
+    def test_csv(self):
+        lines = self.export().decode('utf-8').splitlines()
+
+        # 表头带BOM，Excel能正确识别中文
+        self.assertTrue(lines[0].startswith('\ufeffid,sent_at,email'))
+        self.assertEqual(len(lines), 4)
+        rows = list(csv.DictReader(lines[1:], fieldnames=[header for _, header in self.fields]))
+        self.assertEqual(rows[0]['city_name'], '武汉市')
+        self.assertEqual(rows[0]['subject'], '武汉市天气预报')
+        self.assertEqual(rows[2]['username'], 'reader3')
+
+    def test_jsonl(self):
+        records = [json.loads(line) for line in self.export('jsonl').decode('utf-8').splitlines()]
+
+        self.assertEqual([record['city_adcode'] for record in records], ['420100', '420100', '420500'])
+        self.assertIs(records[0]['is_sent'], True)
+        self.assertEqual(len(records[0]['city_ids']), 1)
+        # 时间按本地时区输出ISO格式
+        self.assertEqual(
+            datetime.fromisoformat(records[0]['sent_at']),
+            EmailLog.objects.order_by('pk').first().sent_at,
+        )
+
+    def test_gzip(self):
+        for fmt in ('csv', 'jsonl'):
+            with self.subTest(fmt=fmt):
+                self.assertEqual(gzip.decompress(self.export(fmt, compress=True)), self.export(fmt))
+
+    def test_keyset_pagination(self):
+        # 每批一个查询，最后一批不足chunk_size时结束
+        with self.assertNumQueries(2):
+            rows = list(iter_rows(EmailLog.objects.all(), ['email'], chunk_size=2))
+        self.assertEqual(rows, [('reader1@example.com',), ('reader2@example.com',), ('reader3@example.com',)])
+
+        with self.assertNumQueries(4):
+            self.assertEqual(len(self.export('jsonl', chunk_size=1).splitlines()), 3)
+
+    def test_invalid_format(self):
+        with self.assertRaises(ValueError):
+            self.export('xml')
+
+    def test_admin_action(self):
+        self.client.force_login(self.staff)
+        selected = list(EmailLog.objects.filter(subscription__city__adcode='420100').values_list('pk', flat=True))
+        url = reverse('admin:subscriptions_emaillog_changelist')
+
+        response = self.client.post(url, {'action': 'export_csv', '_selected_action': selected})
+
+        self.assertTrue(response.streaming)
+        self.assertEqual(response['Content-Type'], 'text/csv; charset=utf-8')
+        self.assertRegex(response['Content-Disposition'], r'^attachment; filename="emaillog-\d{8}-\d{6}\.csv"$')
+        self.assertEqual(len(b''.join(response.streaming_content).splitlines()), 3)
+
+        response = self.client.post(url, {'action': 'export_jsonl_gzip', '_selected_action': selected})
+
+        self.assertEqual(response['Content-Type'], 'application/gzip')
+        self.assertTrue(response['Content-Disposition'].endswith('.jsonl.gz"'))
+        self.assertEqual(len(gzip.decompress(b''.join(response.streaming_content)).splitlines()), 2)
+
+    def test_export_command(self):
+        with tempfile.TemporaryDirectory() as directory:
+            output = os.path.join(directory, 'emaillog.jsonl.gz')
+            call_command(
+                'export_data', 'emaillog', '--format', 'jsonl', '--gzip',
+                '--city', '420500', '--output', output, stdout=StringIO(),
+            )
+            with gzip.open(output, 'rt', encoding='utf-8') as f:
+                records = [json.loads(line) for line in f]
+
+        self.assertEqual([record['username'] for record in records], ['reader3'])
+
+    def test_export_command_date_range(self):
+        today = timezone.localdate()
+        with tempfile.TemporaryDirectory() as directory:
+            output = os.path.join(directory, 'emaillog.csv')
+            call_command(
+                'export_data', 'emaillog', '--until', f'{today - timedelta(days=1):%Y-%m-%d}',
+                '--output', output, stdout=StringIO(),
+            )
+            with open(output, encoding='utf-8-sig') as f:
+                lines = f.read().splitlines()
+
+        # 只剩表头
+        self.assertEqual(len(lines), 1)
+
+        with self.assertRaises(CommandError):
+            call_command('export_data', 'emaillog', '--since', '2026/01/01', stdout=StringIO())
+
+
+class SubscriptionFragmentTests(TestCase):
+    """订阅列表片段缓存：缓存键包含订阅版本，订阅变化后片段失效"""
+
+    @classmethod
+    def setUpTestData(cls):
+        city = City.objects.create(name='长沙市', adcode='430100', level=2)
+        cls.user = User.objects.create(username='reader', email='reader@example.com')
+        cls.other = User.objects.create(username='other', email='other@example.com')
+        cls.subscription = Subscription.objects.create(user=cls.user, city=city, email=cls.user.email)
+        Subscription.objects.create(user=cls.other, city=city, email=cls.other.email)
+        cls.staff = User.objects.create(
+            username='staff', email='staff@example.com', is_staff=True, is_superuser=True
+        )
+
+    def setUp(self):
+        cache.clear()
+
+    def list_queries(self):
+        """打开订阅列表，返回读取订阅表的查询"""
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse('subscriptions:list'))
+        self.assertEqual(response.status_code, 200)
+        return response, [query for query in queries if 'FROM "subscriptions_subscription"' in query['sql']]
+
+    def test_cached_list_skips_query(self):
+        self.client.force_login(self.user)
+
+        response, queries = self.list_queries()
+        self.assertTrue(queries)
+        self.assertContains(response, '长沙市')
+
+        response, queries = self.list_queries()
+        self.assertFalse(queries)
+        self.assertContains(response, '长沙市')
+
+    def test_toggle_invalidates_list(self):
+        self.client.force_login(self.user)
+        response, _ = self.list_queries()
+        self.assertContains(response, 'badge bg-success')
+
+        self.client.get(reverse('subscriptions:toggle', args=[self.subscription.id]))
+
+        response, queries = self.list_queries()
+        self.assertTrue(queries)
+        self.assertContains(response, 'badge bg-secondary')
+
+    def test_save_and_delete_bump_version(self):
+        version = subscription_version(self.user.id)
+        other_version = subscription_version(self.other.id)
+        # 版本号生成后保持不变
+        self.assertEqual(subscription_version(self.user.id), version)
+
+        self.subscription.save()
+        self.assertNotEqual(subscription_version(self.user.id), version)
+
+        version = subscription_version(self.user.id)
+        self.subscription.delete()
+        self.assertNotEqual(subscription_version(self.user.id), version)
+        # 其他用户的片段不受影响
+        self.assertEqual(subscription_version(self.other.id), other_version)
+
+    def test_admin_bulk_action_bumps_version(self):
+        version = subscription_version(self.user.id)
+        self.client.force_login(self.staff)
+
+        self.client.post(reverse('admin:subscriptions_subscription_changelist'), {
+            'action': 'deactivate_subscriptions', '_selected_action': [self.subscription.id],
+        })
+
+        # 批量update不触发信号，由操作本身更新版本号
+        self.assertNotEqual(subscription_version(self.user.id), version)
+
+
+class EmailBodyTests(TestCase):
+    """邮件正文按内容哈希去重存储，详情页才读取正文"""
+
+    CONTENT = '<html><body>' + '<p>今天晴，气温20度</p>' * 200 + '</body></html>'
+
+    @classmethod
+    def setUpTestData(cls):
+        city = City.objects.create(name='南京市', adcode='320100', level=2)
+        user = User.objects.create(username='reader', email='reader@example.com')
+        cls.subscription = Subscription.objects.create(user=user, city=city, email=user.email)
+        cls.staff = User.objects.create(
+            username='staff', email='staff@example.com', is_staff=True, is_superuser=True
+        )
+
+    def create_log(self, content):
+        return EmailLog.objects.create(
+            subscription=self.subscription, email=self.subscription.email,
+            subject='天气预报', body=EmailBody.objects.store(content), is_sent=True,
+        )
+
+    def test_store_deduplicates(self):
+        first = self.create_log(self.CONTENT)
+        second = self.create_log(self.CONTENT)
+
+        self.assertEqual(first.body_id, second.body_id)
+        self.assertEqual(EmailBody.objects.count(), 1)
+        self.assertEqual(second.content, self.CONTENT)
+
+    def test_compression(self):
+        body = EmailBody.objects.store(self.CONTENT)
+
+        self.assertTrue(body.is_compressed)
+        self.assertEqual(body.size, len(self.CONTENT.encode('utf-8')))
+        self.assertLess(len(bytes(body.data)), body.size // 10)
+        body.refresh_from_db()
+        self.assertEqual(body.content, self.CONTENT)
+
+    def test_incompressible_content_is_stored_raw(self):
+        body = EmailBody.objects.store('晴')
+        self.assertFalse(body.is_compressed)
+        self.assertEqual(body.content, '晴')
+
+    @override_settings(EMAIL_BODY_COMPRESSION=False)
+    def test_compression_disabled(self):
+        body = EmailBody.objects.store(self.CONTENT)
+        self.assertFalse(body.is_compressed)
+        self.assertEqual(bytes(body.data).decode('utf-8'), self.CONTENT)
+
+    def test_admin_loads_body_on_detail_page_only(self):
+        log = self.create_log(self.CONTENT)
+        self.client.force_login(self.staff)
+
+        with mock.patch.object(EmailBody, 'content', new_callable=mock.PropertyMock) as content:
+            content.return_value = '正文'
+            response = self.client.get(reverse('admin:subscriptions_emaillog_changelist'))
+            self.assertEqual(response.status_code, 200)
+            content.assert_not_called()
+
+            response = self.client.get(reverse('admin:subscriptions_emaillog_change', args=[log.id]))
+            self.assertContains(response, '正文')
+            content.assert_called_once()
+
+    def test_cleanup_removes_unreferenced_bodies(self):
+        old = self.create_log('旧邮件' * 100)
+        EmailLog.objects.filter(pk=old.pk).update(sent_at=timezone.now() - timedelta(days=31))
+        kept = self.create_log(self.CONTENT)
+
+        cleanup_old_email_logs()
+
+        self.assertEqual(list(EmailBody.objects.values_list('id', flat=True)), [kept.body_id])
+
+
+class DeadLetterRedriveTests(TestCase):
+    """死信重新投递：同一收件邮箱、同一投递任务的死信合并为一封邮件"""
+
+    @classmethod
+    def setUpTestData(cls):
+        province = City.objects.create(name='江苏省', adcode='320000', level=1)
+        cities = [
+            City.objects.create(name=f'城市{i}', adcode=f'3201{i:02d}', level=2, parent=province)
+            for i in range(3)
+        ]
+        run = DeliveryRun.objects.create(run_key='daily-test')
+        user = User.objects.create(username='reader', email='reader@example.com')
+        other = User.objects.create(username='other', email='other@example.com')
+        for city in cities:
+            subscription = Subscription.objects.create(user=user, city=city, email=user.email)
+            DeadLetter.objects.create(subscription=subscription, run=run, error_class='transient')
+        subscription = Subscription.objects.create(user=other, city=cities[0], email=other.email)
+        DeadLetter.objects.create(subscription=subscription, run=run, error_class='transient')
+
+        cls.delivery_run = run
+        cls.staff = User.objects.create(
+            username='staff', email='staff@example.com', is_staff=True, is_superuser=True
+        )
+
+    def test_redrive_groups_by_recipient_and_run(self):
+        self.client.force_login(self.staff)
+        with mock.patch('subscriptions.tasks.retry_weather_email.apply_async') as apply_async:
+            self.client.post(reverse('admin:subscriptions_deadletter_changelist'), {
+                'action': 'redrive_dead_letters',
+                '_selected_action': list(DeadLetter.objects.values_list('pk', flat=True)),
+            })
+
+        self.assertEqual(apply_async.call_count, 2)
+        batches = sorted(len(call.kwargs['args'][0]) for call in apply_async.call_args_list)
+        self.assertEqual(batches, [1, 3])
+        for call in apply_async.call_args_list:
+            self.assertEqual(call.kwargs['kwargs']['run_id'], self.delivery_run.pk)
+        self.assertFalse(DeadLetter.objects.exists())
+
+
+class DigestDeliveryTests(TestCase):
+    """摘要邮件投递：个别城市天气获取失败时照常发送其余城市，只重试失败的订阅"""
+
+    @classmethod
+    def setUpTestData(cls):
+        province = City.objects.create(name='福建省', adcode='350000', level=1)
+        cls.good_city = City.objects.create(name='福州市', adcode='350100', level=2, parent=province)
+        cls.bad_city = City.objects.create(name='厦门市', adcode='350200', level=2, parent=province)
+        user = User.objects.create(username='reader', email='reader@example.com')
+        cls.good = Subscription.objects.create(user=user, city=cls.good_city, email=user.email)
+        cls.bad = Subscription.objects.create(user=user, city=cls.bad_city, email=user.email)
+        cls.delivery_run = DeliveryRun.objects.create(run_key='daily-test')
+        Delivery.objects.bulk_create([
+            Delivery(run=cls.delivery_run, subscription=subscription)
+            for subscription in (cls.good, cls.bad)
+        ])
+
+    def setUp(self):
+        cache.clear()
+
+    @staticmethod
+    def fake_weather(adcode):
+        if adcode != '350100':
+            return None
+        return {
+            'city_name': '福建省 福州市',
+            'current': {
+                'weather': '晴', 'temperature': '25', 'winddirection': '东',
+                'windpower': '3', 'humidity': '60', 'reporttime': '2026-01-01 08:00:00',
+            },
+            'forecast': [],
+        }
+
+    def test_partial_digest(self):
+        service = EmailService()
+        with mock.patch.object(service.weather_service, 'get_weather_for_email', side_effect=self.fake_weather), \
+                mock.patch('subscriptions.tasks.retry_weather_email.apply_async') as apply_async:
+            result = service.deliver_weather_digest([self.good, self.bad])
+            service.record_digest_result([self.good, self.bad], result, run=self.delivery_run)
+
+        self.assertEqual(result, DELIVERY_SENT)
+        self.assertEqual(len(mail.outbox), 1)
+        self.assertIn('福州市', mail.outbox[0].body)
+        self.assertEqual(service.failed_subscriptions, [self.bad])
+
+        # 只有天气获取失败的订阅安排重试
+        apply_async.assert_called_once()
+        self.assertEqual(apply_async.call_args.kwargs['args'], [[self.bad.id]])
+        statuses = dict(self.delivery_run.deliveries.values_list('subscription_id', 'status'))
+        self.assertEqual(statuses, {self.good.id: Delivery.STATUS_SENT, self.bad.id: Delivery.STATUS_RETRYING})
+        # 重试完成前投递任务不算完成
+        self.delivery_run.refresh_status()
+        self.assertEqual(self.delivery_run.status, DeliveryRun.STATUS_RUNNING)
+
+        # 一封邮件一条日志，未包含的城市记在错误信息中
+        log = EmailLog.objects.get()
+        self.assertTrue(log.is_sent)
+        self.assertEqual(log.city_ids, [self.good_city.id])
+        self.assertIn('厦门市', log.error_message)
+        self.assertEqual(DailyStats.objects.get(city=self.good_city).emails_sent, 1)
+        bad_stats = DailyStats.objects.get(city=self.bad_city)
+        self.assertEqual((bad_stats.emails_sent, bad_stats.emails_failed), (0, 0))
+
+    def test_digest_logs_once(self):
+        # 另一个用户的订阅使用同一接收邮箱
+        family = User.objects.create(username='family', email='family@example.com')
+        other = Subscription.objects.create(user=family, city=self.bad_city, email=self.good.email)
+        service = EmailService()
+        with mock.patch.object(service.weather_service, 'get_weather_for_email', return_value=self.fake_weather('350100')):
+            result = service.deliver_weather_digest([self.good, self.bad, other])
+
+        self.assertEqual(result, DELIVERY_SENT)
+        self.assertEqual(len(mail.outbox), 1)
+        log = EmailLog.objects.get()
+        self.assertEqual(log.city_ids, [self.good_city.id, self.bad_city.id])
+        # 全站按邮件计数，城市按包含该城市的邮件计数
+        self.assertEqual(DailyStats.objects.get(date=timezone.localdate(log.sent_at), city=None).emails_sent, 1)
+        self.assertEqual(DailyStats.objects.get(city=self.good_city).emails_sent, 1)
+        self.assertEqual(DailyStats.objects.get(city=self.bad_city).emails_sent, 1)
+
+
+class DailyStatsTests(TestCase):
+    """每日统计：已有记录时一条UPDATE累加，批量模式合并写入，全站记录每天只有一条"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.city = City.objects.create(name='四川省', adcode='510000', level=1)
+        cls.date = timezone.localdate()
+
+    def test_increment(self):
+        DailyStats.objects.increment(self.date, emails_sent=1)
+        with self.assertNumQueries(1):
+            DailyStats.objects.increment(self.date, emails_sent=2)
+
+        stats = DailyStats.objects.get(date=self.date, city=None)
+        self.assertEqual(stats.emails_sent, 3)
+        self.assertEqual(stats.city_key, 0)
+
+    def test_single_global_row(self):
+        DailyStats.objects.increment(self.date, users_joined=1)
+        with self.assertRaises(IntegrityError), transaction.atomic():
+            DailyStats.objects.create(date=self.date, city=None)
+
+    def test_batch(self):
+        with DailyStats.objects.batch():
+            with self.assertNumQueries(0):
+                for _ in range(3):
+                    DailyStats.objects.increment(self.date, emails_sent=1)
+                    DailyStats.objects.increment(self.date, city_id=self.city.id, emails_sent=1)
+                DailyStats.objects.increment(self.date, emails_failed=1)
+
+        self.assertEqual(
+            list(DailyStats.objects.order_by('city_key').values_list('city_id', 'emails_sent', 'emails_failed')),
+            [(None, 3, 1), (self.city.id, 3, 0)],
+        )
+
+    def test_batch_flushes_periodically(self):
+        with mock.patch.object(DailyStats.objects, 'BATCH_FLUSH_EVENTS', 2), DailyStats.objects.batch():
+            DailyStats.objects.increment(self.date, emails_sent=1)
+            self.assertFalse(DailyStats.objects.exists())
+            DailyStats.objects.increment(self.date, emails_sent=1)
+            self.assertEqual(DailyStats.objects.get().emails_sent, 2)
+
+
+class EmailTemplateInlinerTests(TestCase):
+    """邮件模板编译：CSS内联的选择器匹配、优先级，以及<style>中保留的规则"""
+
+    CSS = """
+        p { color: black; margin: 0 }
+        .note { color: gray }
+        td.cell { padding: 4px }
+        table .note { font-size: 12px }
+        a:hover { color: red }
+        @media (max-width: 480px) { .note { display: block } }
+    """
+
+    def inline(self, html, css=CSS, keep_classes=()):
+        rules, _ = parse_stylesheet(css)
+        return inline_css(html, rules, keep_classes)
+
+    def test_parse_stylesheet(self):
+        rules, residual = parse_stylesheet(self.CSS)
+
+        self.assertEqual(len(rules), 4)
+        self.assertIn('a:hover{color:red !important}', residual)
+        self.assertIn('@media (max-width:480px){.note{display:block !important}}', residual)
+
+    def test_selector_matching(self):
+        html = self.inline(
+            '<table><tr><td class="cell"><span class="note">a</span></td><td>b</td></tr></table>'
+            '<div class="note">c</div>'
+        )
+
+        self.assertIn('<td style="padding:4px">', html)
+        self.assertIn('<td>b</td>', html)
+        # 后代选择器只匹配table中的元素
+        self.assertIn('<span style="color:gray;font-size:12px">a</span>', html)
+        self.assertIn('<div style="color:gray">c</div>', html)
+
+    def test_precedence(self):
+        # 类选择器优先于标签选择器，与书写顺序无关
+        html = self.inline('<p class="note">a</p>', css='.note { color: gray } p { color: black }')
+        self.assertIn('<p style="color:gray">a</p>', html)
+
+        # 相同优先级时后面的规则生效
+        html = self.inline('<p>a</p>', css='p { color: black } p { color: blue }')
+        self.assertIn('<p style="color:blue">a</p>', html)
+
+        # 元素上已有的内联样式优先
+        html = self.inline('<p class="note" style="color: green">a</p>')
+        self.assertIn('<p style="color:green;margin:0">a</p>', html)
+
+    def test_classes_kept_for_style_block(self):
+        html = self.inline('<p class="note other">a</p><br class="note"/>', keep_classes={'note'})
+
+        self.assertIn('<p class="note" style="color:gray;margin:0">a</p>', html)
+        self.assertIn('<br class="note" style="color:gray"/>', html)
+
+    def test_compiled_template_keeps_media_query(self):
+        compiled, _ = compile_template('emails/weather_digest.html')
+
+        style = re.search(r'<style>(.*?)</style>', compiled, re.S).group(1)
+        self.assertIn('@media (max-width:480px)', style)
+        self.assertIn('flex-direction:column !important', style)
+        # 仍被<style>中的规则使用的类名保留
+        self.assertIn('<div class="city-section" style="margin-bottom:40px">', compiled)
+
+
+class SendSchedulerTests(TestCase):
+    """发送调度器：按分钟/按天限额预约时间槽，限制在投递窗口内"""
+
+    def setUp(self):
+        cache.clear()
+        self.now = timezone.make_aware(datetime(2026, 1, 5, 10, 0))
+
+    def scheduler(self, per_minute=2, per_day=5, window=(6, 22)):
+        return SendScheduler(name='test', per_minute=per_minute, per_day=per_day, window=window)
+
+    def at(self, day, hour, minute=0):
+        return timezone.make_aware(datetime(2026, 1, day, hour, minute))
+
+    def test_invalid_config(self):
+        for options in (
+            {'per_minute': 0}, {'per_day': 0}, {'per_minute': -1},
+            {'window': (22, 6)}, {'window': (8, 8)}, {'window': (6, 25)},
+        ):
+            with self.subTest(**options), self.assertRaises(ImproperlyConfigured):
+                self.scheduler(**options)
+
+    def test_align_to_window(self):
+        scheduler = self.scheduler()
+        self.assertEqual(scheduler._align(self.at(5, 5, 30)), self.at(5, 6))
+        self.assertEqual(scheduler._align(self.at(5, 22)), self.at(6, 6))
+        self.assertEqual(scheduler._align(self.at(5, 10, 30) + timedelta(seconds=15)), self.at(5, 10, 30))
+
+    def test_full_day_window(self):
+        scheduler = self.scheduler(window=(0, 24))
+        self.assertEqual(scheduler._window_bounds(self.now), (self.at(5, 0), self.at(6, 0)))
+        self.assertEqual(scheduler._align(self.at(5, 23, 59)), self.at(5, 23, 59))
+
+    def test_reserve_per_minute(self):
+        scheduler = self.scheduler()
+        slots = [scheduler.reserve(self.now) for _ in range(3)]
+        self.assertEqual(slots, [self.now, self.now, self.at(5, 10, 1)])
+
+    def test_reserve_per_day(self):
+        scheduler = self.scheduler(per_minute=10, per_day=2)
+        slots = [scheduler.reserve(self.now) for _ in range(3)]
+        self.assertEqual(slots, [self.now, self.now, self.at(6, 6)])
+
+    def test_penalize(self):
+        scheduler = self.scheduler()
+        scheduler.penalize(self.now)
+        self.assertEqual(scheduler.reserve(self.now), self.at(5, 10, 1))
+        self.assertFalse(scheduler.try_acquire(self.now))
+
+    def test_try_acquire_and_release(self):
+        scheduler = self.scheduler()
+        self.assertTrue(scheduler.try_acquire(self.now))
+        self.assertTrue(scheduler.try_acquire(self.now))
+        scheduler.release(self.now)
+        self.assertTrue(scheduler.try_acquire(self.now))
+        self.assertFalse(scheduler.try_acquire(self.now))
+
+    def test_projection(self):
+        scheduler = self.scheduler()
+        self.assertEqual(scheduler.projected_completion(0, self.now), self.now)
+        self.assertEqual(scheduler.projected_completion(5, self.now), self.at(5, 10, 3))
+        # 当天限额用完后顺延到下一个投递窗口
+        self.assertEqual(scheduler.projected_completion(7, self.now), self.at(6, 6, 1))
+
+    def test_projection_outside_window(self):
+        scheduler = self.scheduler()
+        self.assertEqual(scheduler.projected_completion(1, self.at(5, 23)), self.at(6, 6, 1))
+
+    def test_projection_capped(self):
+        scheduler = self.scheduler()
+        self.assertIsNone(scheduler.projected_completion(10 ** 9, self.now))
+
+
+class SenderPoolTests(TestCase):
+    """发件账号池：断开的连接重新连接一次，只有限流响应才算限流，发送失败归还名额"""
+
+    def setUp(self):
+        cache.clear()
+        self.now = timezone.now()
+        patcher = mock.patch('subscriptions.sender_pool.timezone.now', return_value=self.now)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.account = SenderAccount('sender@example.com', 'secret', per_minute=10, per_day=100)
+        self.pool = SenderPool(accounts=[self.account])
+        self.message = EmailMessage('天气预报', '晴', to=['reader@example.com'])
+
+    def connections(self, *results):
+        """依次返回的SMTP连接，send_messages按results抛出异常或返回发送数量"""
+        connections = []
+        for result in results:
+            connection = mock.Mock()
+            connection.send_messages.side_effect = [result]
+            connections.append(connection)
+        return mock.patch('subscriptions.sender_pool.get_connection', side_effect=connections)
+
+    def used_quota(self):
+        return cache.get(self.account.scheduler._minute_key(self.now)) or 0
+
+    def test_reconnect_after_disconnect(self):
+        with self.connections(smtplib.SMTPServerDisconnected('closed'), 1) as get_connection:
+            self.assertIs(self.pool.send(self.message), self.account)
+        self.assertEqual(get_connection.call_count, 2)
+        self.assertEqual(self.used_quota(), 1)
+
+    def test_repeated_disconnect_is_not_throttling(self):
+        disconnected = smtplib.SMTPServerDisconnected('closed')
+        with self.connections(disconnected, disconnected):
+            with self.assertRaises(smtplib.SMTPServerDisconnected):
+                self.pool.send(self.message)
+        self.assertTrue(self.account.is_healthy())
+        self.assertEqual(self.used_quota(), 0)
+
+    def test_throttle_response_drains_account(self):
+        with self.connections(smtplib.SMTPResponseException(421, 'too many messages')):
+            with self.assertRaises(SendThrottled):
+                self.pool.send(self.message)
+        self.assertFalse(self.account.is_healthy())
+        self.assertEqual(self.used_quota(), 0)
+
+    def test_rejected_message_is_not_rotated(self):
+        other = SenderAccount('backup@example.com', 'secret', per_minute=10, per_day=100)
+        pool = SenderPool(accounts=[self.account, other])
+        rejected = smtplib.SMTPDataError(554, 'message rejected as spam')
+        with self.connections(rejected) as get_connection:
+            with self.assertRaises(smtplib.SMTPDataError):
+                pool.send(self.message)
+        self.assertEqual(get_connection.call_count, 1)
+        self.assertTrue(self.account.is_healthy())
+        self.assertTrue(other.is_healthy())
+        self.assertEqual(classify_error(rejected), ERROR_PERMANENT)
+
+
+class DeliveryRunTests(TestCase):
+    """投递任务：每个订阅只认领一次，重新执行时跳过已投递的订阅"""
+
+    @classmethod
+    def setUpTestData(cls):
+        province = City.objects.create(name='湖北省', adcode='420000', level=1)
+        cls.city = City.objects.create(name='武汉市', adcode='420100', level=2, parent=province)
+        cls.subscriptions = []
+        for i in range(2):
+            user = User.objects.create(username=f'reader{i}', email=f'reader{i}@example.com')
+            cls.subscriptions.append(Subscription.objects.create(user=user, city=cls.city, email=user.email))
+
+    def setUp(self):
+        cache.clear()
+
+    def fake_weather(self, adcode):
+        return {
+            'city_name': '湖北省 武汉市',
+            'current': {
+                'weather': '晴', 'temperature': '25', 'winddirection': '东',
+                'windpower': '3', 'humidity': '60', 'reporttime': '2026-01-01 08:00:00',
+            },
+            'forecast': [],
+        }
+
+    def run_daily(self, run_key):
+        # 不受投递窗口和限速影响，时间槽总是当前时间
+        with mock.patch('weather.services.WeatherService.get_weather_for_email', side_effect=self.fake_weather), \
+                mock.patch.object(SendScheduler, 'reserve', side_effect=lambda now=None: timezone.now()):
+            return send_daily_weather_emails(run_key=run_key)
+
+    def test_claim(self):
+        run = DeliveryRun.objects.create(run_key='daily-test')
+        subscription = self.subscriptions[0]
+        Delivery.objects.create(run=run, subscription=subscription)
+
+        self.assertTrue(run.claim(subscription.id))
+        self.assertFalse(run.claim(subscription.id))
+        run.record([subscription.id], Delivery.STATUS_FAILED, 'timeout')
+        self.assertTrue(run.claim(subscription.id))
+        run.record([subscription.id], Delivery.STATUS_SENT)
+        self.assertFalse(run.claim(subscription.id))
+        self.assertEqual(run.deliveries.get().attempts, 2)
+
+    def test_resume_skips_delivered(self):
+        served, pending = self.subscriptions
+        run = DeliveryRun.objects.create(run_key='daily-test')
+        Delivery.objects.create(run=run, subscription=served, status=Delivery.STATUS_SENT)
+
+        self.run_daily('daily-test')
+
+        self.assertEqual([message.to for message in mail.outbox], [[pending.email]])
+        self.assertEqual(run.progress()[Delivery.STATUS_SENT], 2)
+        run.refresh_from_db()
+        self.assertEqual(run.status, DeliveryRun.STATUS_COMPLETED)
+
+        # 已完成的投递任务再次执行不会发送
+        self.run_daily('daily-test')
+        self.assertEqual(len(mail.outbox), 1)
+
+    def test_run_key_fixed_at_enqueue(self):
+        with mock.patch.object(send_daily_weather_emails, 'delay') as delay:
+            run_key = start_daily_weather_emails()
+        self.assertEqual(run_key, daily_run_key())
+        delay.assert_called_once_with(run_key=run_key)
+
+
+    def test_completed_after_retries_finish(self):
+        city = City.objects.create(name='宜昌市', adcode='420500', level=2, parent=self.city.parent)
+        user = User.objects.create(username='reader9', email='reader9@example.com')
+        flaky = Subscription.objects.create(user=user, city=city, email=user.email)
+        failures = {'420500'}
+
+        def fake_weather(adcode):
+            # 第一次获取宜昌的天气失败，重试时成功
+            if adcode in failures:
+                failures.discard(adcode)
+                return None
+            return self.fake_weather(adcode)
+
+        with mock.patch('weather.services.WeatherService.get_weather_for_email', side_effect=fake_weather), \
+                mock.patch.object(SendScheduler, 'reserve', side_effect=lambda now=None: timezone.now()), \
+                mock.patch('weatherblog.celery.apply_deferred') as apply_deferred:
+            send_daily_weather_emails(run_key='daily-test')
+
+            run = DeliveryRun.objects.get(run_key='daily-test')
+            self.assertEqual(run.deliveries.get(subscription=flaky).status, Delivery.STATUS_RETRYING)
+            self.assertEqual(run.status, DeliveryRun.STATUS_RUNNING)
+            # 每日任务恢复执行时不会认领等待重试的投递
+            self.assertFalse(run.deliveries.filter(Delivery.claimable_q(), subscription=flaky).exists())
+
+            retry_weather_email(*apply_deferred.call_args.kwargs['args'], **apply_deferred.call_args.kwargs['kwargs'])
+
+        run.refresh_from_db()
+        self.assertEqual(run.status, DeliveryRun.STATUS_COMPLETED)
+        self.assertEqual(run.progress()[Delivery.STATUS_SENT], 3)
+
+    def test_timing_merged_across_passes(self):
+        run = DeliveryRun.objects.create(run_key='daily-test')
+        first = {
+            'wall': 10.0,
+            'stages': {'smtp': {'count': 3, 'total': 3.0, 'p50': 1.0, 'p95': 1.0, 'max': 1.2}},
+            'slowest_cities': [['武汉市(420100)', 2.0]],
+            'slowest_recipients': [['reader0@example.com', 1.5]],
+        }
+        second = {
+            'wall': 2.0,
+            'stages': {
+                'smtp': {'count': 1, 'total': 2.0, 'p50': 2.0, 'p95': 2.0, 'max': 2.0},
+                'claim': {'count': 1, 'total': 0.01, 'p50': 0.01, 'p95': 0.01, 'max': 0.01},
+            },
+            'slowest_cities': [['武汉市(420100)', 1.0]],
+            'slowest_recipients': [['reader1@example.com', 2.5]],
+        }
+
+        run.add_timing(first, 'daily')
+        run.add_timing(second, 'retry')
+
+        run.refresh_from_db()
+        timing = run.timing
+        self.assertEqual(timing['wall'], 12.0)
+        self.assertEqual(timing['stages']['smtp']['count'], 4)
+        self.assertEqual(timing['stages']['smtp']['total'], 5.0)
+        self.assertEqual(timing['stages']['smtp']['max'], 2.0)
+        self.assertEqual(timing['stages']['claim']['count'], 1)
+        self.assertEqual(timing['slowest_cities'], [['武汉市(420100)', 3.0]])
+        self.assertEqual(timing['slowest_recipients'][0], ['reader1@example.com', 2.5])
+        self.assertEqual([item['label'] for item in timing['passes']], ['daily', 'retry'])
+        self.assertEqual(timing['passes'][0]['stages']['smtp']['count'], 3)
+
+    def test_retry_adds_timing(self):
+        served, failed = self.subscriptions
+        run = DeliveryRun.objects.create(run_key='daily-test')
+        Delivery.objects.create(run=run, subscription=served, status=Delivery.STATUS_SENT)
+        Delivery.objects.create(run=run, subscription=failed, status=Delivery.STATUS_FAILED)
+        self.run_daily('daily-test')
+        run.refresh_from_db()
+        self.assertEqual(run.timing['stages']['smtp']['count'], 1)
+
+        Delivery.objects.filter(subscription=failed).update(status=Delivery.STATUS_FAILED)
+        with mock.patch('weather.services.WeatherService.get_weather_for_email', side_effect=self.fake_weather):
+            retry_weather_email([failed.id], attempt=2, run_id=run.id)
+
+        run.refresh_from_db()
+        self.assertEqual(run.timing['stages']['smtp']['count'], 2)
+        self.assertEqual([item['label'] for item in run.timing['passes']], ['daily', 'retry'])
+
+class ApplyDeferredTests(TestCase):
+    """延后任务：等待较久的任务经延后队列转发，不占用主队列的可见性超时"""
+
+    def setUp(self):
+        # 配置来自Django设置的CELERY_命名空间，需要按带前缀的键覆盖
+        always_eager = app.conf.task_always_eager
+        app.conf.update(CELERY_TASK_ALWAYS_EAGER=False)
+        self.addCleanup(app.conf.update, CELERY_TASK_ALWAYS_EAGER=always_eager)
+
+    def test_short_delay_goes_to_main_queue(self):
+        with mock.patch.object(send_weather_digest, 'apply_async') as apply_async, \
+                mock.patch.object(forward_deferred, 'apply_async') as forward:
+            apply_deferred(send_weather_digest, args=[[1]], countdown=60)
+        apply_async.assert_called_once()
+        forward.assert_not_called()
+
+    def test_long_delay_goes_to_deferred_queue(self):
+        eta = timezone.now() + timedelta(days=1)
+        with mock.patch.object(send_weather_digest, 'apply_async') as apply_async, \
+                mock.patch.object(forward_deferred, 'apply_async') as forward:
+            apply_deferred(send_weather_digest, args=[[1]], kwargs={'run_id': 2}, eta=eta)
+        apply_async.assert_not_called()
+        forward.assert_called_once_with(args=[send_weather_digest.name, [[1]], {'run_id': 2}, None], eta=eta)
+
+    def test_forward_to_main_queue(self):
+        with mock.patch.object(app, 'send_task') as send_task:
+            forward_deferred(send_weather_digest.name, [[1]], {'run_id': 2}, 'email_retry')
+        send_task.assert_called_once_with(
+            send_weather_digest.name, args=[[1]], kwargs={'run_id': 2}, queue='email_retry'
+        )
@@ -0,0 +1,203 @@
+import math
+import smtplib
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.exceptions import ImproperlyConfigured
+from django.utils import timezone
+
+# SMTP服务商限流/临时拒绝时常见的响应码
+THROTTLE_SMTP_CODES = {421, 450, 451, 452}
+
+# 单次预约最多向后查找的分钟数，防止配置异常时死循环
+MAX_LOOKAHEAD_MINUTES = 60 * 24 * 7
+
+# 估算完成时间最多向后推算的天数，超过时不再估算
+MAX_PROJECTION_DAYS = 366
+
+
+class SendThrottled(Exception):
+    """暂时没有可用的发送名额"""
+
+
+def is_throttle_error(error):
+    """判断异常是否为SMTP服务商的限流响应"""
+    if isinstance(error, SendThrottled):
+        return True
+    if isinstance(error, smtplib.SMTPResponseException):
+        return error.smtp_code in THROTTLE_SMTP_CODES
+    if isinstance(error, smtplib.SMTPRecipientsRefused):
+        return any(
+            code in THROTTLE_SMTP_CODES
+            for code, _ in error.recipients.values()
+        )
+    return False
+
+
+class SendScheduler:
+    """
+    邮件发送调度器
+    按分钟/按天限制发送量，计数保存在缓存（Redis）中供多个worker共享。
+    超出限额的发送会被安排到投递窗口内之后的时间槽，而不是直接失败。
+    """
+
+    def __init__(self, name='default', per_minute=None, per_day=None, window=None):
+        self.name = name
+        self.per_minute = settings.EMAIL_SEND_RATE_LIMIT_PER_MINUTE if per_minute is None else per_minute
+        self.per_day = settings.EMAIL_SEND_RATE_LIMIT_PER_DAY if per_day is None else per_day
+        self.window = settings.EMAIL_DELIVERY_WINDOW if window is None else tuple(window)
+
+        if self.per_minute <= 0 or self.per_day <= 0:
+            raise ImproperlyConfigured(
+                f"发送调度器 {name} 的限额必须大于0: per_minute={self.per_minute}, per_day={self.per_day}"
+            )
+        start_hour, end_hour = self.window
+        if not 0 <= start_hour < end_hour <= 24:
+            raise ImproperlyConfigured(
+                f"发送调度器 {name} 的投递窗口无效: {self.window}，需要 0 <= 开始小时 < 结束小时 <= 24"
+            )
+
+    def _key(self, *parts):
+        return ':'.join(('email_throttle', self.name) + parts)
+
+    def _minute_key(self, slot):
+        return self._key('m', timezone.localtime(slot).strftime('%Y%m%d%H%M'))
+
+    def _day_key(self, slot):
+        return self._key('d', timezone.localtime(slot).strftime('%Y%m%d'))
+
+    def _incr(self, key, timeout):
+        cache.add(key, 0, timeout)
+        return cache.incr(key)
+
+    def _window_bounds(self, moment):
+        """返回moment当天投递窗口的起止时间"""
+        midnight = timezone.localtime(moment).replace(hour=0, minute=0, second=0, microsecond=0)
+        start_hour, end_hour = self.window
+        # 结束小时可以是24（当天结束）
+        return midnight + timedelta(hours=start_hour), midnight + timedelta(hours=end_hour)
+
+    def _next_window_start(self, moment):
+        start, _ = self._window_bounds(moment)
+        return start + timedelta(days=1)
+
+    def _align(self, moment):
+        """把时间调整到投递窗口内并按分钟取整"""
+        start, end = self._window_bounds(moment)
+        if moment < start:
+            return start
+        if moment >= end:
+            return self._next_window_start(moment)
+        return moment.replace(second=0, microsecond=0)
+
+    def reserve(self, now=None):
+        """
+        预约一个发送时间槽
+        :return: 允许发送的时间（不早于当前时间）
+        """
+        now = now or timezone.now()
+        slot = self._align(now)
+
+        # 游标记录最早可能还有余量的分钟，避免每次都从头扫描
+        cursor = cache.get(self._key('cursor'))
+        if cursor and cursor > slot:
+            slot = self._align(cursor)
+
+        for _ in range(MAX_LOOKAHEAD_MINUTES):
+            day_key = self._day_key(slot)
+            if (cache.get(day_key) or 0) >= self.per_day:
+                slot = self._next_window_start(slot)
+                continue
+
+            ttl = int((slot - now).total_seconds()) + 120
+            minute_key = self._minute_key(slot)
+            if self._incr(minute_key, ttl) > self.per_minute:
+                slot = self._align(slot + timedelta(minutes=1))
+                cache.set(self._key('cursor'), slot, ttl + 60)
+                continue
+
+            if self._incr(day_key, ttl + 86400) > self.per_day:
+                cache.decr(minute_key)
+                slot = self._next_window_start(slot)
+                continue
+
+            return max(slot, now)
+
+        raise RuntimeError(f"发送调度器 {self.name} 在 {MAX_LOOKAHEAD_MINUTES} 分钟内找不到可用时间槽")
+
+    def try_acquire(self, now=None):
+        """
+        尝试立即占用一个发送名额（不受投递窗口限制）
+        :return: 是否占用成功
+        """
+        now = now or timezone.now()
+        day_key = self._day_key(now)
+        if (cache.get(day_key) or 0) >= self.per_day:
+            return False
+
+        minute_key = self._minute_key(now)
+        if self._incr(minute_key, 120) > self.per_minute:
+            return False
+
+        if self._incr(day_key, 2 * 86400) > self.per_day:
+            cache.decr(minute_key)
+            return False
+
+        return True
+
+    def release(self, now):
+        """
+        归还try_acquire占用但没有用掉的发送名额（如发送失败）
+        :param now: 调用try_acquire时传入的时间
+        """
+        for key in (self._minute_key(now), self._day_key(now)):
+            try:
+                cache.decr(key)
+            except ValueError:
+                # 计数已过期
+                pass
+
+    def penalize(self, now=None):
+        """服务商返回限流响应时，把当前分钟标记为已满"""
+        now = now or timezone.now()
+        cache.set(self._minute_key(now), self.per_minute, 120)
+
+    def projected_completion(self, remaining, now=None):
+        """
+        估算发送完剩余邮件的完成时间
+        :param remaining: 剩余待发送数量
+        :return: 预计完成时间，超过MAX_PROJECTION_DAYS天时返回None
+        """
+        now = now or timezone.now()
+        moment = self._align(now)
+        cursor = cache.get(self._key('cursor'))
+        if cursor and cursor > moment:
+            moment = self._align(cursor)
+
+        if remaining <= 0:
+            return moment
+
+        for _ in range(MAX_PROJECTION_DAYS):
+            _, end = self._window_bounds(moment)
+            minutes_left = int((end - moment).total_seconds() // 60)
+            day_left = max(self.per_day - (cache.get(self._day_key(moment)) or 0), 0)
+            capacity = min(day_left, minutes_left * self.per_minute)
+
+            if remaining <= capacity:
+                return moment + timedelta(minutes=math.ceil(remaining / self.per_minute))
+
+            remaining -= capacity
+            moment = self._next_window_start(moment)
+
+        return None
+
+    def publish_projection(self, remaining, now=None):
+        """记录当前发送任务的预计完成时间，供管理后台等查询"""
+        projection = self.projected_completion(remaining, now=now)
+        cache.set(self._key('projection'), projection, 86400)
+        return projection
+
+    def get_projection(self):
+        """获取当前发送任务的预计完成时间"""
+        return cache.get(self._key('projection'))
@@ -4,6 +4,7 @@ from django.contrib import messages
 from django.http import JsonResponse
 from django.db.models import Q
 from weather.models import City
+from .fragments import FRAGMENT_CACHE_TIMEOUT, subscription_version
 from .models import Subscription
 from .forms import SubscriptionForm, CitySearchForm
 
@@ -11,9 +12,14 @@ from .forms import SubscriptionForm, CitySearchForm
 @login_required
 def subscription_list(request):
     """订阅列表视图"""
-    subscriptions = Subscription.objects.filter(user=request.user).order_by('-created_at')
+    # 列表按订阅版本缓存，缓存命中时不会执行查询
+    subscriptions = Subscription.objects.filter(user=request.user).select_related(
+        'city__parent__parent__parent'
+    ).order_by('-created_at')
     return render(request, 'subscriptions/list.html', {
-        'subscriptions': subscriptions
+        'subscriptions': subscriptions,
+        'subscription_version': subscription_version(request.user.id),
+        'fragment_cache_timeout': FRAGMENT_CACHE_TIMEOUT,
     })
 
 
@@ -69,7 +75,7 @@ def toggle_subscription(request, subscription_id):
     return redirect('subscriptions:list')
 
 
-def get_cities_ajax(request):
+async def get_cities_ajax(request):
     """AJAX获取城市列表"""
     parent_id = request.GET.get('parent_id')
     level = request.GET.get('level')
@@ -78,25 +84,25 @@ def get_cities_ajax(request):
         cities = City.objects.filter(
             parent_id=parent_id,
             level=int(level)
-        ).order_by('name')
+        ).order_by('name').values('id', 'name')
 
-        data = [{'id': city.id, 'name': city.name} for city in cities]
+        data = [city async for city in cities]
         return JsonResponse({'cities': data})
 
     return JsonResponse({'cities': []})
 
 
-def search_cities_ajax(request):
+async def search_cities_ajax(request):
     """AJAX搜索城市"""
     query = request.GET.get('q', '').strip()
 
     if len(query) >= 2:
         cities = City.objects.filter(
             Q(name__icontains=query) & Q(level__gte=2)  # 只搜索市级以上
-        ).select_related('parent')[:20]
+        ).select_related('parent__parent__parent')[:20]
 
         data = []
-        for city in cities:
+        async for city in cities:
             data.append({
                 'id': city.id,
                 'name': city.name,
@@ -147,7 +147,7 @@ def test_celery_task():
 def test_weather_email_task():
     """测试天气邮件任务"""
     try:
-        from subscriptions.tasks import send_daily_weather_emails
+        from subscriptions.tasks import send_daily_weather_emails, daily_run_key
         from subscriptions.models import Subscription
         
         print("🔍 天气邮件任务测试:")
@@ -169,7 +169,7 @@ def test_weather_email_task():
         
         # 执行邮件发送任务
         print("\n📧 执行天气邮件发送任务...")
-        result = send_daily_weather_emails.delay()
+        result = send_daily_weather_emails.delay(run_key=daily_run_key())
         
         try:
             task_result = result.get(timeout=30)
@@ -1,4 +1,6 @@
 from django.contrib import admin
+from weatherblog.exports import ExportActionsMixin
+from weatherblog.paginator import EstimatedCountPaginator
 from .models import City, WeatherData
 
 
@@ -28,13 +30,31 @@ class CityAdmin(admin.ModelAdmin):
 
 
 @admin.register(WeatherData)
-class WeatherDataAdmin(admin.ModelAdmin):
+class WeatherDataAdmin(ExportActionsMixin, admin.ModelAdmin):
     """天气数据管理"""
     list_display = ('city', 'weather', 'temperature', 'winddirection', 'windpower', 'humidity', 'created_at')
     list_filter = ('weather', 'created_at')
     search_fields = ('city__name', 'weather')
     ordering = ('-created_at',)
     list_per_page = 50
+    list_select_related = ('city',)
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+    actions = ['export_csv', 'export_csv_gzip', 'export_jsonl', 'export_jsonl_gzip']
+    # 导出字段：(字段查找路径, 列名)
+    export_fields = (
+        ('id', 'id'),
+        ('created_at', 'created_at'),
+        ('city__adcode', 'city_adcode'),
+        ('city__name', 'city_name'),
+        ('weather', 'weather'),
+        ('temperature', 'temperature'),
+        ('winddirection', 'winddirection'),
+        ('windpower', 'windpower'),
+        ('humidity', 'humidity'),
+        ('reporttime', 'reporttime'),
+        ('forecast_data', 'forecast_data'),
+    )
 
     fieldsets = (
         ('基本信息', {
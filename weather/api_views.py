@@ -0,0 +1,187 @@
+import asyncio
+import hashlib
+import re
+from datetime import datetime
+
+from django.conf import settings
+from django.http import JsonResponse
+from django.utils import timezone
+from django.utils.cache import get_conditional_response, patch_cache_control, patch_vary_headers
+from django.utils.http import http_date
+from django.utils.text import compress_string
+from .read_model import aget_weather, aget_weather_many, ainvalid_adcodes, build_entry
+from .services import AsyncWeatherService
+
+# 客户端可以缓存响应的时间（秒），过期后使用ETag/Last-Modified做条件请求
+API_MAX_AGE = 60
+
+# 可投影的字段：顶层字段，以及current下的字段（写成 current.temperature）
+TOP_LEVEL_FIELDS = ('adcode', 'city_name', 'current', 'forecast', 'updated_at')
+CURRENT_FIELDS = ('weather', 'temperature', 'winddirection', 'windpower', 'humidity', 'reporttime')
+
+re_accepts_gzip = re.compile(r'\bgzip\b')
+
+# 正在请求天气API的城市：{adcode: Task}
+_inflight = {}
+
+
+def parse_fields(value):
+    """
+    解析fields参数
+    :param value: 逗号分隔的字段列表，例如 "adcode,current.temperature,current.weather"
+    :return: 字段元组，未指定时返回None（返回全部字段）
+    """
+    if not value:
+        return None
+    fields = tuple(field.strip() for field in value.split(',') if field.strip())
+    for field in fields:
+        name, _, sub = field.partition('.')
+        if name not in TOP_LEVEL_FIELDS or (sub and (name != 'current' or sub not in CURRENT_FIELDS)):
+            raise ValueError(f"不支持的字段: {field}")
+    return fields
+
+
+def project(entry, fields):
+    """按fields裁剪天气信息"""
+    if fields is None:
+        return {name: entry[name] for name in TOP_LEVEL_FIELDS}
+
+    data = {}
+    for field in fields:
+        name, _, sub = field.partition('.')
+        if sub:
+            data.setdefault(name, {})[sub] = entry[name][sub]
+        else:
+            data[name] = entry[name]
+    return data
+
+
+def report_time(entry):
+    """天气数据的发布时间（高德返回北京时间字符串），无法解析时使用入库时间"""
+    try:
+        reporttime = datetime.strptime(entry['current']['reporttime'], '%Y-%m-%d %H:%M:%S')
+    except (TypeError, ValueError):
+        return entry['updated_at']
+    return timezone.make_aware(reporttime)
+
+
+def make_etag(entries, fields):
+    """根据各城市的发布时间和投影字段生成ETag"""
+    source = '|'.join(
+        f"{adcode}:{entry['current']['reporttime']}" for adcode, entry in sorted(entries.items())
+    )
+    source += '|' + ','.join(fields or ())
+    return '"%s"' % hashlib.md5(source.encode('utf-8')).hexdigest()
+
+
+def gzip_response(request, response):
+    """客户端支持时压缩响应内容"""
+    patch_vary_headers(response, ('Accept-Encoding',))
+    if len(response.content) < 200 or not re_accepts_gzip.search(request.META.get('HTTP_ACCEPT_ENCODING', '')):
+        return response
+
+    compressed = compress_string(response.content)
+    if len(compressed) >= len(response.content):
+        return response
+
+    response.content = compressed
+    response['Content-Length'] = str(len(compressed))
+    response['Content-Encoding'] = 'gzip'
+    # 压缩后内容与未压缩时不同，改为弱ETag
+    etag = response.get('ETag')
+    if etag and etag.startswith('"'):
+        response['ETag'] = 'W/' + etag
+    return response
+
+
+async def fetch_weather(adcode):
+    """
+    读模型中没有天气数据时异步请求天气API并保存
+    同一进程内对同一城市的并发请求共用一次上游请求；保存后读模型由信号更新。
+    :return: 天气信息字典或None
+    """
+    task = _inflight.get(adcode)
+    if task is None:
+        task = asyncio.ensure_future(AsyncWeatherService().save_weather_data(adcode))
+        _inflight[adcode] = task
+        task.add_done_callback(lambda _: _inflight.pop(adcode, None))
+    # 客户端断开时不取消上游请求，其他等待的请求仍需要结果
+    weather_data = await asyncio.shield(task)
+    return build_entry(weather_data) if weather_data else None
+
+
+def weather_response(request, entries, payload, fields):
+    """
+    生成带条件请求支持的天气接口响应
+    内容未变化时返回304，否则返回（可能压缩的）JSON
+    """
+    etag = make_etag(entries, fields)
+    last_modified = max((report_time(entry) for entry in entries.values()), default=None)
+    last_modified = int(last_modified.timestamp()) if last_modified else None
+
+    response = get_conditional_response(request, etag=etag, last_modified=last_modified)
+    modified = response is None
+    if modified:
+        response = JsonResponse(payload, json_dumps_params={'ensure_ascii': False, 'separators': (',', ':')})
+
+    response['ETag'] = etag
+    if last_modified:
+        response['Last-Modified'] = http_date(last_modified)
+    if modified:
+        response = gzip_response(request, response)
+
+    patch_cache_control(response, public=True, max_age=API_MAX_AGE)
+    return response
+
+
+async def weather_api(request, adcode):
+    """
+    单个城市的当前天气和预报，读模型中没有时异步请求天气API
+    GET /api/weather/<adcode>/?fields=adcode,current.temperature
+    """
+    try:
+        fields = parse_fields(request.GET.get('fields'))
+    except ValueError as e:
+        return JsonResponse({'error': str(e)}, status=400)
+
+    if await ainvalid_adcodes([adcode]):
+        return JsonResponse({'error': f'无效的城市编码: {adcode}'}, status=404)
+
+    entry = await aget_weather(adcode)
+    if entry is None:
+        entry = await fetch_weather(adcode)
+    if entry is None:
+        return JsonResponse({'error': '暂无该城市的天气数据'}, status=404)
+
+    return weather_response(request, {adcode: entry}, project(entry, fields), fields)
+
+
+async def weather_api_batch(request):
+    """
+    多个城市的当前天气和预报
+    GET /api/weather/?adcodes=110101,310101&fields=current
+    """
+    adcodes = list(dict.fromkeys(
+        adcode.strip() for adcode in request.GET.get('adcodes', '').split(',') if adcode.strip()
+    ))
+    if not adcodes:
+        return JsonResponse({'error': '请提供adcodes参数'}, status=400)
+    if len(adcodes) > settings.WEATHER_API_BATCH_LIMIT:
+        return JsonResponse(
+            {'error': f'一次最多查询 {settings.WEATHER_API_BATCH_LIMIT} 个城市'}, status=400
+        )
+    try:
+        fields = parse_fields(request.GET.get('fields'))
+    except ValueError as e:
+        return JsonResponse({'error': str(e)}, status=400)
+
+    invalid = await ainvalid_adcodes(adcodes)
+    if invalid:
+        return JsonResponse({'error': f"无效的城市编码: {','.join(invalid)}"}, status=400)
+
+    entries = await aget_weather_many(adcodes)
+    payload = {
+        'results': {adcode: project(entries[adcode], fields) for adcode in adcodes if adcode in entries},
+        'missing': [adcode for adcode in adcodes if adcode not in entries],
+    }
+    return weather_response(request, entries, payload, fields)
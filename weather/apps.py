@@ -4,3 +4,7 @@ from django.apps import AppConfig
 class WeatherConfig(AppConfig):
     default_auto_field = "django.db.models.BigAutoField"
     name = "weather"
+
+    def ready(self):
+        # 注册天气更新推送信号
+        from . import signals  # noqa: F401
@@ -0,0 +1,113 @@
+import asyncio
+import json
+import logging
+import threading
+
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+CHANNEL_PREFIX = 'weather:updates'
+
+
+def city_channel(city_adcode):
+    """城市天气更新的频道名"""
+    return f'{CHANNEL_PREFIX}:{city_adcode}'
+
+
+class MemoryBroker:
+    """
+    进程内的发布订阅，只能推送给同一进程内的订阅者，用于开发和测试
+    发布可以在任意线程中调用，消息投递到订阅者所在的事件循环。
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._subscribers = {}
+
+    def publish(self, channel, message):
+        with self._lock:
+            subscribers = list(self._subscribers.get(channel, ()))
+        for loop, queue in subscribers:
+            loop.call_soon_threadsafe(queue.put_nowait, message)
+
+    async def listen(self, channels):
+        loop = asyncio.get_running_loop()
+        queue = asyncio.Queue()
+        subscriber = (loop, queue)
+        with self._lock:
+            for channel in channels:
+                self._subscribers.setdefault(channel, set()).add(subscriber)
+        try:
+            while True:
+                yield await queue.get()
+        finally:
+            with self._lock:
+                for channel in channels:
+                    self._subscribers.get(channel, set()).discard(subscriber)
+
+
+class RedisBroker:
+    """通过Redis发布订阅推送，Web进程和Celery worker之间共享"""
+
+    def __init__(self, url):
+        self.url = url
+        self._client = None
+
+    def publish(self, channel, message):
+        import redis
+
+        if self._client is None:
+            self._client = redis.Redis.from_url(self.url)
+        self._client.publish(channel, json.dumps(message))
+
+    async def listen(self, channels):
+        import redis.asyncio as aioredis
+
+        client = aioredis.Redis.from_url(self.url)
+        pubsub = client.pubsub()
+        await pubsub.subscribe(*channels)
+        try:
+            async for item in pubsub.listen():
+                if item['type'] == 'message':
+                    yield json.loads(item['data'])
+        finally:
+            await pubsub.unsubscribe()
+            await pubsub.aclose()
+            await client.aclose()
+
+
+_broker = None
+
+
+def get_broker():
+    """根据WEATHER_UPDATES_BROKER获取推送使用的broker"""
+    global _broker
+    if _broker is None:
+        if settings.WEATHER_UPDATES_BROKER == 'memory':
+            _broker = MemoryBroker()
+        else:
+            _broker = RedisBroker(settings.WEATHER_UPDATES_REDIS_URL)
+    return _broker
+
+
+def publish_weather_update(weather_data):
+    """
+    发布城市天气更新
+    推送失败只记录日志，不影响天气数据的保存。
+    :param weather_data: 新保存的WeatherData对象
+    """
+    adcode = weather_data.city.adcode
+    try:
+        get_broker().publish(city_channel(adcode), {'adcode': adcode, 'weather_id': weather_data.id})
+    except Exception as e:
+        logger.warning(f"发布天气更新失败 {adcode}: {e}")
+
+
+def listen_weather_updates(city_adcodes):
+    """
+    订阅多个城市的天气更新
+    :param city_adcodes: 城市adcode列表
+    :return: 异步迭代器，每次产出 {'adcode': ..., 'weather_id': ...}
+    """
+    return get_broker().listen([city_channel(adcode) for adcode in city_adcodes])
@@ -0,0 +1,66 @@
+import asyncio
+import json
+from urllib.parse import parse_qs
+
+from django.core.management.base import BaseCommand
+
+
+def build_payload(adcode, extensions):
+    """生成与高德天气API格式一致的示例数据"""
+    if extensions == 'base':
+        return {
+            'status': '1', 'count': '1', 'info': 'OK', 'infocode': '10000',
+            'lives': [{
+                'adcode': adcode, 'weather': '晴', 'temperature': '20',
+                'winddirection': '北', 'windpower': '≤3', 'humidity': '40',
+                'reporttime': '2025-01-01 08:00:00',
+            }],
+        }
+    return {
+        'status': '1', 'count': '1', 'info': 'OK', 'infocode': '10000',
+        'forecasts': [{
+            'adcode': adcode, 'reporttime': '2025-01-01 08:00:00',
+            'casts': [{
+                'date': '2025-01-01', 'week': '3', 'dayweather': '晴', 'nightweather': '多云',
+                'daytemp': '22', 'nighttemp': '12', 'daywind': '北', 'nightwind': '北',
+                'daypower': '≤3', 'nightpower': '≤3',
+            }],
+        }],
+    }
+
+
+class Command(BaseCommand):
+    help = '启动模拟的天气API（固定延迟返回示例数据），用于压测时代替高德接口'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--host', default='127.0.0.1', help='监听地址')
+        parser.add_argument('--port', type=int, default=9000, help='监听端口，默认9000')
+        parser.add_argument('--delay', type=float, default=1.0, help='每个请求的响应延迟（秒），默认1.0')
+
+    def handle(self, *args, **options):
+        import uvicorn
+
+        delay = options['delay']
+
+        async def app(scope, receive, send):
+            if scope['type'] != 'http':
+                return
+            params = parse_qs(scope['query_string'].decode())
+            adcode = params.get('city', ['110101'])[0]
+            extensions = params.get('extensions', ['all'])[0]
+
+            await asyncio.sleep(delay)
+
+            body = json.dumps(build_payload(adcode, extensions), ensure_ascii=False).encode('utf-8')
+            await send({
+                'type': 'http.response.start',
+                'status': 200,
+                'headers': [(b'content-type', b'application/json; charset=utf-8')],
+            })
+            await send({'type': 'http.response.body', 'body': body})
+
+        self.stdout.write(
+            f"模拟天气API: http://{options['host']}:{options['port']}/ （延迟 {delay} 秒）\n"
+            f"启动Django前设置环境变量 WEATHER_API_URL 指向该地址"
+        )
+        uvicorn.run(app, host=options['host'], port=options['port'], lifespan='off', log_level='warning')
@@ -0,0 +1,90 @@
+import asyncio
+import statistics
+import time
+
+import httpx
+from django.core.management.base import BaseCommand
+
+
+def percentile(values, percent):
+    """计算百分位数（最近秩法）"""
+    if not values:
+        return 0
+    values = sorted(values)
+    index = max(0, int(round(percent / 100 * len(values))) - 1)
+    return values[index]
+
+
+async def run_load(url, total, concurrency, cookies):
+    """
+    以固定并发数向url发送total个请求
+    :return: (各请求耗时列表, 失败数, 总耗时)
+    """
+    latencies = []
+    errors = 0
+    remaining = iter(range(total))
+
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+    async with httpx.AsyncClient(cookies=cookies, timeout=60, limits=limits) as client:
+
+        async def worker():
+            nonlocal errors
+            for _ in remaining:
+                start = time.perf_counter()
+                try:
+                    response = await client.get(url)
+                    if response.status_code != 200:
+                        errors += 1
+                        continue
+                except httpx.HTTPError:
+                    errors += 1
+                    continue
+                latencies.append(time.perf_counter() - start)
+
+        started = time.perf_counter()
+        await asyncio.gather(*[worker() for _ in range(concurrency)])
+        elapsed = time.perf_counter() - started
+
+    return latencies, errors, elapsed
+
+
+class Command(BaseCommand):
+    help = '对一个或多个地址做并发压测并对比结果（例如同一页面的WSGI和ASGI部署）'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'urls',
+            nargs='+',
+            help='压测地址，可写成 名称=地址，例如 wsgi=http://127.0.0.1:8001/ asgi=http://127.0.0.1:8002/'
+        )
+        parser.add_argument('--requests', type=int, default=200, help='每个地址的请求总数，默认200')
+        parser.add_argument('--concurrency', type=int, default=50, help='并发数，默认50')
+        parser.add_argument('--session', help='登录后的sessionid，用于压测需要登录的页面')
+
+    def handle(self, *args, **options):
+        cookies = {'sessionid': options['session']} if options['session'] else None
+
+        rows = []
+        for item in options['urls']:
+            if '=' in item and not item.startswith('http'):
+                name, url = item.split('=', 1)
+            else:
+                name = url = item
+            self.stdout.write(f"压测 {name}: {options['requests']} 个请求，并发 {options['concurrency']} ...")
+            latencies, errors, elapsed = asyncio.run(
+                run_load(url, options['requests'], options['concurrency'], cookies)
+            )
+            rows.append((name, latencies, errors, elapsed))
+
+        header = f"{'名称':<24}{'成功':>8}{'失败':>8}{'吞吐(req/s)':>14}{'平均(ms)':>12}{'p50(ms)':>10}{'p95(ms)':>10}{'p99(ms)':>10}"
+        self.stdout.write('\n' + header)
+        for name, latencies, errors, elapsed in rows:
+            mean = statistics.mean(latencies) if latencies else 0
+            self.stdout.write(
+                f"{name:<24}{len(latencies):>8}{errors:>8}"
+                f"{len(latencies) / elapsed if elapsed else 0:>14.1f}"
+                f"{mean * 1000:>12.0f}"
+                f"{percentile(latencies, 50) * 1000:>10.0f}"
+                f"{percentile(latencies, 95) * 1000:>10.0f}"
+                f"{percentile(latencies, 99) * 1000:>10.0f}"
+            )
@@ -0,0 +1,25 @@
+# Generated by Django 4.2.7 on 2026-10-19 16:42
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("weather", "0001_initial"),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name="city",
+            index=models.Index(
+                fields=["parent", "level", "name"], name="city_parent_level_name_idx"
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="weatherdata",
+            index=models.Index(
+                fields=["city", "-created_at"], name="weatherdata_city_latest_idx"
+            ),
+        ),
+    ]
@@ -15,6 +15,10 @@ class City(models.Model):
         verbose_name = "城市"
         verbose_name_plural = "城市"
         ordering = ['level', 'name']
+        indexes = [
+            # 按上级城市和级别查询下级城市，并按名称排序
+            models.Index(fields=['parent', 'level', 'name'], name='city_parent_level_name_idx'),
+        ]
 
     def __str__(self):
         return self.name
@@ -45,6 +49,10 @@ class WeatherData(models.Model):
         verbose_name = "天气数据"
         verbose_name_plural = "天气数据"
         ordering = ['-created_at']
+        indexes = [
+            # 查询城市最新的天气数据
+            models.Index(fields=['city', '-created_at'], name='weatherdata_city_latest_idx'),
+        ]
 
     def __str__(self):
         return f"{self.city.name} - {self.weather} - {self.temperature}°C"
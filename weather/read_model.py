@@ -0,0 +1,122 @@
+import re
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Max
+
+from monitoring.metrics import WEATHER_CACHE_REQUESTS
+from .models import City, WeatherData
+from .services import WeatherService
+
+# 城市当前天气的缓存读模型：每个城市最近一次的天气保存为一条缓存，新的天气数据保存后立即更新。
+# 仪表板、天气推送和天气接口都从这里读取，正常情况下不查询数据库也不请求天气API。
+CACHE_PREFIX = 'weather:current'
+
+# 没有天气数据的城市也缓存一段时间（秒），避免反复查询数据库
+MISSING_TIMEOUT = 60
+
+# 全部城市adcode的缓存，城市数据变化时失效
+ADCODES_KEY = 'weather:adcodes'
+
+re_adcode = re.compile(r'[0-9]{6}')
+
+
+def _key(city_adcode):
+    return f'{CACHE_PREFIX}:{city_adcode}'
+
+
+def build_entry(weather_data):
+    """
+    根据天气数据记录生成读模型条目
+    :param weather_data: WeatherData对象
+    :return: 天气信息字典（在格式化的天气信息基础上增加adcode和updated_at）
+    """
+    entry = WeatherService().format_weather_info(weather_data)
+    entry['adcode'] = weather_data.city.adcode
+    entry['updated_at'] = weather_data.created_at
+    return entry
+
+
+def update_weather(weather_data):
+    """新的天气数据保存后更新读模型"""
+    entry = build_entry(weather_data)
+    cache.set(_key(entry['adcode']), entry, settings.WEATHER_READ_MODEL_TIMEOUT)
+    return entry
+
+
+def known_adcodes():
+    """全部城市的adcode集合"""
+    adcodes = cache.get(ADCODES_KEY)
+    if adcodes is None:
+        adcodes = frozenset(City.objects.values_list('adcode', flat=True))
+        cache.set(ADCODES_KEY, adcodes, settings.WEATHER_READ_MODEL_TIMEOUT)
+    return adcodes
+
+
+def invalidate_adcodes():
+    """城市数据变化后清除adcode缓存"""
+    cache.delete(ADCODES_KEY)
+
+
+def invalid_adcodes(city_adcodes):
+    """
+    找出格式不正确（不是6位数字）或不存在的城市adcode
+    接口参数要先经过校验，避免任意值被当作城市查询并写入缓存。
+    :param city_adcodes: 城市adcode列表
+    :return: 无效的adcode列表
+    """
+    known = known_adcodes()
+    return [adcode for adcode in city_adcodes if not re_adcode.fullmatch(adcode) or adcode not in known]
+
+
+def get_weather_many(city_adcodes):
+    """
+    批量读取城市的当前天气，缓存未命中的城市用一次查询从数据库补齐
+    :param city_adcodes: 城市adcode列表
+    :return: {adcode: 天气信息}，没有天气数据的城市不包含在结果中
+    """
+    keys = {_key(adcode): adcode for adcode in city_adcodes}
+    cached = cache.get_many(list(keys))
+    entries = {keys[key]: entry for key, entry in cached.items()}
+
+    missing = [adcode for adcode in city_adcodes if adcode not in entries]
+    WEATHER_CACHE_REQUESTS.labels('read_model', 'hit').inc(len(entries))
+    WEATHER_CACHE_REQUESTS.labels('read_model', 'miss').inc(len(missing))
+    if missing:
+        latest_ids = WeatherData.objects.filter(
+            city__adcode__in=missing
+        ).order_by().values('city').annotate(latest_id=Max('id')).values('latest_id')
+        found = {}
+        for weather_data in WeatherData.objects.filter(
+            id__in=latest_ids
+        ).select_related('city__parent__parent__parent'):
+            entry = build_entry(weather_data)
+            found[entry['adcode']] = entry
+
+        if found:
+            cache.set_many(
+                {_key(adcode): entry for adcode, entry in found.items()},
+                settings.WEATHER_READ_MODEL_TIMEOUT
+            )
+        not_found = [adcode for adcode in missing if adcode not in found]
+        if not_found:
+            cache.set_many({_key(adcode): {} for adcode in not_found}, MISSING_TIMEOUT)
+        entries.update(found)
+
+    # 空字典表示该城市没有天气数据
+    return {adcode: entry for adcode, entry in entries.items() if entry}
+
+
+def get_weather(city_adcode):
+    """
+    读取单个城市的当前天气
+    :param city_adcode: 城市adcode
+    :return: 天气信息字典或None
+    """
+    return get_weather_many([city_adcode]).get(city_adcode)
+
+
+aget_weather_many = sync_to_async(get_weather_many)
+aget_weather = sync_to_async(get_weather)
+ainvalid_adcodes = sync_to_async(invalid_adcodes)
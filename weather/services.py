@@ -1,15 +1,28 @@
+import asyncio
+import logging
+import time
 import requests
+import httpx
 import json
 from django.conf import settings
+from monitoring.metrics import AMAP_REQUEST_SECONDS, AMAP_REQUESTS
+from monitoring.profiling import add_upstream_time
+from weatherblog.timing import stage
 from .models import WeatherData, City
 
+logger = logging.getLogger(__name__)
+
 
 class WeatherService:
     """天气API服务类"""
     
-    def __init__(self):
+    def __init__(self, timer=None):
+        """
+        :param timer: 投递任务的分阶段计时器，为空时不计时
+        """
         self.api_key = settings.WEATHER_API_KEY
         self.api_url = settings.WEATHER_API_URL
+        self.timer = timer
     
     def get_weather_data(self, city_adcode, extensions='all'):
         """
@@ -18,6 +31,8 @@ class WeatherService:
         :param extensions: 气象类型 base/all
         :return: 天气数据字典或None
         """
+        started = time.perf_counter()
+        outcome = 'error'
         try:
             params = {
                 'key': self.api_key,
@@ -32,18 +47,32 @@ class WeatherService:
             data = response.json()
             
             if data.get('status') == '1' and data.get('infocode') == '10000':
+                outcome = 'ok'
                 return data
             else:
-                print(f"API返回错误: {data.get('info', '未知错误')}")
+                outcome = 'api_error'
+                logger.warning(f"API返回错误: {data.get('info', '未知错误')}")
                 return None
                 
         except requests.RequestException as e:
-            print(f"请求天气API失败: {str(e)}")
+            outcome = 'http_error'
+            logger.warning(f"请求天气API失败: {str(e)}")
             return None
         except json.JSONDecodeError as e:
-            print(f"解析天气API响应失败: {str(e)}")
+            outcome = 'decode_error'
+            logger.warning(f"解析天气API响应失败: {str(e)}")
             return None
+        finally:
+            self._observe(extensions, outcome, started)
     
+    @staticmethod
+    def _observe(extensions, outcome, started):
+        """记录一次天气API请求的耗时和结果"""
+        elapsed = time.perf_counter() - started
+        AMAP_REQUEST_SECONDS.labels(extensions).observe(elapsed)
+        AMAP_REQUESTS.labels(outcome).inc()
+        add_upstream_time(elapsed)
+
     def save_weather_data(self, city_adcode):
         """
         获取并保存天气数据到数据库
@@ -51,38 +80,43 @@ class WeatherService:
         :return: WeatherData对象或None
         """
         try:
-            city = City.objects.get(adcode=city_adcode)
+            with stage(self.timer, 'weather_db'):
+                city = City.objects.select_related('parent__parent__parent').get(adcode=city_adcode)
         except City.DoesNotExist:
-            print(f"城市不存在: {city_adcode}")
+            logger.warning(f"城市不存在: {city_adcode}")
             return None
+        city_key = f"{city.name}({city.adcode})"
         
         # 获取实况天气
-        live_data = self.get_weather_data(city_adcode, 'base')
+        with stage(self.timer, 'amap', city_key):
+            live_data = self.get_weather_data(city_adcode, 'base')
         if not live_data:
             return None
         
         # 获取预报天气
-        forecast_data = self.get_weather_data(city_adcode, 'all')
+        with stage(self.timer, 'amap', city_key):
+            forecast_data = self.get_weather_data(city_adcode, 'all')
         
         # 解析实况天气数据
         lives = live_data.get('lives', [])
         if not lives:
-            print(f"没有获取到实况天气数据: {city_adcode}")
+            logger.warning(f"没有获取到实况天气数据: {city_adcode}")
             return None
         
         live_info = lives[0]
         
         # 创建天气数据记录
-        weather_data = WeatherData.objects.create(
-            city=city,
-            weather=live_info.get('weather', ''),
-            temperature=live_info.get('temperature', ''),
-            winddirection=live_info.get('winddirection', ''),
-            windpower=live_info.get('windpower', ''),
-            humidity=live_info.get('humidity', ''),
-            reporttime=live_info.get('reporttime', ''),
-            forecast_data=forecast_data.get('forecasts', []) if forecast_data else []
-        )
+        with stage(self.timer, 'weather_db', city_key):
+            weather_data = WeatherData.objects.create(
+                city=city,
+                weather=live_info.get('weather', ''),
+                temperature=live_info.get('temperature', ''),
+                winddirection=live_info.get('winddirection', ''),
+                windpower=live_info.get('windpower', ''),
+                humidity=live_info.get('humidity', ''),
+                reporttime=live_info.get('reporttime', ''),
+                forecast_data=forecast_data.get('forecasts', []) if forecast_data else []
+            )
         
         return weather_data
     
@@ -96,6 +130,14 @@ class WeatherService:
         if not weather_data:
             return None
         
+        return self.format_weather_info(weather_data)
+    
+    def format_weather_info(self, weather_data):
+        """
+        将天气数据记录格式化为页面和邮件使用的字典
+        :param weather_data: WeatherData对象
+        :return: 格式化的天气信息字典
+        """
         # 格式化天气信息
         weather_info = {
             'city_name': weather_data.city.get_full_name(),
@@ -135,8 +177,112 @@ class WeatherService:
         # 使用北京的adcode测试
         test_data = self.get_weather_data('110101')
         if test_data:
-            print("天气API连接测试成功")
+            logger.info("天气API连接测试成功")
             return True
         else:
-            print("天气API连接测试失败")
+            logger.error("天气API连接测试失败")
             return False
+
+
+class AsyncWeatherService(WeatherService):
+    """
+    异步天气API服务类
+    使用httpx和异步ORM，在ASGI下等待天气API时不占用线程。
+    """
+    
+    async def get_weather_data(self, city_adcode, extensions='all', client=None):
+        """
+        获取天气数据
+        :param city_adcode: 城市adcode
+        :param extensions: 气象类型 base/all
+        :param client: 复用的httpx.AsyncClient，不传时临时创建
+        :return: 天气数据字典或None
+        """
+        params = {
+            'key': self.api_key,
+            'city': city_adcode,
+            'extensions': extensions,
+            'output': 'JSON'
+        }
+        
+        started = time.perf_counter()
+        outcome = 'error'
+        try:
+            if client is None:
+                async with httpx.AsyncClient(timeout=10) as client:
+                    response = await client.get(self.api_url, params=params)
+            else:
+                response = await client.get(self.api_url, params=params)
+            response.raise_for_status()
+            
+            data = response.json()
+            
+            if data.get('status') == '1' and data.get('infocode') == '10000':
+                outcome = 'ok'
+                return data
+            else:
+                outcome = 'api_error'
+                logger.warning(f"API返回错误: {data.get('info', '未知错误')}")
+                return None
+                
+        except httpx.HTTPError as e:
+            outcome = 'http_error'
+            logger.warning(f"请求天气API失败: {str(e)}")
+            return None
+        except json.JSONDecodeError as e:
+            outcome = 'decode_error'
+            logger.warning(f"解析天气API响应失败: {str(e)}")
+            return None
+        finally:
+            self._observe(extensions, outcome, started)
+    
+    async def save_weather_data(self, city_adcode):
+        """
+        获取并保存天气数据到数据库（实况和预报同时请求）
+        :param city_adcode: 城市adcode
+        :return: WeatherData对象或None
+        """
+        try:
+            # 预先加载各级上级城市（最多到国家），格式化时获取完整名称不再查询数据库
+            city = await City.objects.select_related('parent__parent__parent').aget(adcode=city_adcode)
+        except City.DoesNotExist:
+            logger.warning(f"城市不存在: {city_adcode}")
+            return None
+        
+        async with httpx.AsyncClient(timeout=10) as client:
+            live_data, forecast_data = await asyncio.gather(
+                self.get_weather_data(city_adcode, 'base', client=client),
+                self.get_weather_data(city_adcode, 'all', client=client),
+            )
+        if not live_data:
+            return None
+        
+        lives = live_data.get('lives', [])
+        if not lives:
+            logger.warning(f"没有获取到实况天气数据: {city_adcode}")
+            return None
+        
+        live_info = lives[0]
+        
+        return await WeatherData.objects.acreate(
+            city=city,
+            weather=live_info.get('weather', ''),
+            temperature=live_info.get('temperature', ''),
+            winddirection=live_info.get('winddirection', ''),
+            windpower=live_info.get('windpower', ''),
+            humidity=live_info.get('humidity', ''),
+            reporttime=live_info.get('reporttime', ''),
+            forecast_data=forecast_data.get('forecasts', []) if forecast_data else []
+        )
+    
+    async def get_weather_for_email(self, city_adcode):
+        """
+        获取格式化的天气信息
+        :param city_adcode: 城市adcode
+        :return: 格式化的天气信息字典
+        """
+        weather_data = await self.save_weather_data(city_adcode)
+        if not weather_data:
+            return None
+        
+        return self.format_weather_info(weather_data)
@@ -0,0 +1,34 @@
+import logging
+
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from .broker import publish_weather_update
+from .models import City, WeatherData
+from .read_model import invalidate_adcodes, update_weather
+
+logger = logging.getLogger(__name__)
+
+
+@receiver(post_save, sender=WeatherData)
+def publish_new_weather(sender, instance, created, raw=False, **kwargs):
+    """保存新的天气数据后（事务提交后）更新读模型，并推送给正在查看仪表板的用户"""
+    if created and not raw:
+        def on_commit():
+            try:
+                update_weather(instance)
+            except Exception as e:
+                # 读模型更新失败时，缓存过期后会从数据库重新读取
+                logger.warning(f"更新天气读模型失败 {instance.city.adcode}: {e}")
+            publish_weather_update(instance)
+
+        transaction.on_commit(on_commit)
+
+
+@receiver(post_save, sender=City)
+@receiver(post_delete, sender=City)
+def city_changed(sender, raw=False, **kwargs):
+    """城市数据变化后清除adcode缓存"""
+    if not raw:
+        invalidate_adcodes()
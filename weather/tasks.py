@@ -0,0 +1,34 @@
+from celery import shared_task
+from django.core.cache import cache
+from .services import WeatherService
+import logging
+
+logger = logging.getLogger(__name__)
+
+# 同一城市的刷新请求在该时间（秒）内只执行一次
+REFRESH_LOCK_TIMEOUT = 60
+
+
+def request_weather_refresh(city_adcode):
+    """
+    请求在后台刷新城市天气，短时间内重复请求会被忽略
+    新数据保存后会通过天气更新推送给仪表板。
+    :param city_adcode: 城市adcode
+    :return: 是否提交了刷新任务
+    """
+    if not cache.add(f'weather:refresh:{city_adcode}', 1, REFRESH_LOCK_TIMEOUT):
+        return False
+    refresh_city_weather.delay(city_adcode)
+    return True
+
+
+@shared_task
+def refresh_city_weather(city_adcode):
+    """
+    从天气API获取并保存城市天气
+    """
+    weather_data = WeatherService().save_weather_data(city_adcode)
+    if not weather_data:
+        logger.warning(f"刷新城市天气失败: {city_adcode}")
+        return False
+    return True
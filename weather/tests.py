@@ -1,3 +1,348 @@
-from django.test import TestCase
+import asyncio
+import gzip
+import json
+from datetime import datetime, timedelta
+from unittest import mock
 
-# Create your tests here.
+from django.core.cache import cache
+from django.template.loader import render_to_string
+from django.test import TestCase, override_settings
+from django.urls import reverse
+from django.utils import timezone
+from django.utils.http import http_date
+
+from accounts.models import User
+from subscriptions.fragments import FRAGMENT_CACHE_TIMEOUT
+from subscriptions.models import Subscription
+from .broker import MemoryBroker, city_channel
+from .management.commands.fake_weather_api import build_payload
+from .models import City, WeatherData
+from .views import _weather_events, load_dashboard_weather
+
+
+@override_settings(WEATHER_STREAM_HEARTBEAT=0.05, WEATHER_STREAM_MAX_AGE=0.3)
+class WeatherStreamTests(TestCase):
+    """仪表板天气推送（SSE）"""
+
+    @classmethod
+    def setUpTestData(cls):
+        province = City.objects.create(name='浙江省', adcode='330000', level=1)
+        city = City.objects.create(name='杭州市', adcode='330100', level=2, parent=province)
+        WeatherData.objects.create(
+            city=city, weather='晴', temperature='20', winddirection='北',
+            windpower='3', humidity='40', reporttime='2026-01-01 08:00:00'
+        )
+        user = User.objects.create(username='reader', email='reader@example.com')
+        cls.subscription = Subscription.objects.create(user=user, city=city, email=user.email)
+
+    def setUp(self):
+        cache.clear()
+        self.broker = MemoryBroker()
+        patcher = mock.patch('weather.broker._broker', self.broker)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    async def collect(self):
+        """读取整个推送流，直到连接到期结束"""
+        return [chunk async for chunk in _weather_events([self.subscription])]
+
+    async def test_stream_ends_cleanly(self):
+        loop = asyncio.get_running_loop()
+        loop.call_later(0.1, self.broker.publish, city_channel('330100'), {'adcode': '330100', 'weather_id': 1})
+
+        chunks = await self.collect()
+
+        self.assertTrue(chunks[0].startswith('retry: '))
+        self.assertIn(': ping\n\n', chunks)
+        weather_events = [chunk for chunk in chunks if chunk.startswith('event: weather')]
+        self.assertEqual(len(weather_events), 1)
+        self.assertIn('杭州市', weather_events[0])
+        # 连接结束后取消订阅
+        self.assertFalse(self.broker._subscribers[city_channel('330100')])
+
+    async def test_stream_ignores_other_cities(self):
+        loop = asyncio.get_running_loop()
+        loop.call_later(0.1, self.broker.publish, city_channel('330100'), {'adcode': '310000', 'weather_id': 1})
+
+        chunks = await self.collect()
+
+        self.assertFalse([chunk for chunk in chunks if chunk.startswith('event: weather')])
+
+
+class DashboardWeatherTests(TestCase):
+    """仪表板天气：读取最近一次的数据，过期或缺失的城市在后台刷新"""
+
+    @classmethod
+    def setUpTestData(cls):
+        province = City.objects.create(name='江苏省', adcode='320000', level=1)
+        fresh = City.objects.create(name='南京市', adcode='320100', level=2, parent=province)
+        stale = City.objects.create(name='苏州市', adcode='320500', level=2, parent=province)
+        City.objects.create(name='无锡市', adcode='320200', level=2, parent=province)
+        WeatherData.objects.create(
+            city=fresh, weather='晴', temperature='21', winddirection='东', windpower='2',
+            humidity='50', reporttime='2026-01-01 08:00:00',
+        )
+        stale_data = WeatherData.objects.create(
+            city=stale, weather='小雨', temperature='17', winddirection='南', windpower='3',
+            humidity='80', reporttime='2026-01-01 06:00:00',
+        )
+        WeatherData.objects.filter(pk=stale_data.pk).update(created_at=timezone.now() - timedelta(hours=2))
+
+        cls.user = User.objects.create(username='reader', email='reader@example.com')
+        for adcode in ('320100', '320500', '320200'):
+            Subscription.objects.create(user=cls.user, city=City.objects.get(adcode=adcode), email=cls.user.email)
+
+    def setUp(self):
+        cache.clear()
+        patcher = mock.patch('weather.tasks.refresh_city_weather.delay')
+        self.refresh = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    async def load(self):
+        subscriptions = [
+            subscription async for subscription in Subscription.objects.filter(
+                user=self.user
+            ).select_related('city').order_by('city__adcode')
+        ]
+        return await load_dashboard_weather(subscriptions)
+
+    def refreshed(self):
+        return sorted(call.args[0] for call in self.refresh.call_args_list)
+
+    async def test_stale_cities_keep_last_known_weather(self):
+        with mock.patch('weather.services.WeatherService.get_weather_data') as get_data:
+            weather_data = await self.load()
+
+        by_adcode = {item['subscription'].city.adcode: item for item in weather_data}
+        self.assertFalse(by_adcode['320100']['refreshing'])
+        # 过期的城市先显示最近一次的数据
+        self.assertTrue(by_adcode['320500']['refreshing'])
+        self.assertEqual(by_adcode['320500']['weather']['current']['temperature'], '17')
+        self.assertTrue(by_adcode['320200']['refreshing'])
+        self.assertIsNone(by_adcode['320200']['weather'])
+        # 打开仪表板不直接请求天气API，只提交后台刷新
+        get_data.assert_not_called()
+        self.assertEqual(self.refreshed(), ['320200', '320500'])
+
+    async def test_concurrent_loads_refresh_once(self):
+        await asyncio.gather(self.load(), self.load(), self.load())
+
+        self.assertEqual(self.refreshed(), ['320200', '320500'])
+
+    def test_dashboard_renders_refreshing_cards(self):
+        self.client.force_login(self.user)
+
+        response = self.client.get(reverse('weather:dashboard'))
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.context['weather_data']), 3)
+        self.assertContains(response, '刷新中', count=2)
+        self.assertContains(response, '17°C')
+        self.assertContains(response, '正在获取天气数据')
+
+
+class WeatherCardFragmentTests(TestCase):
+    """仪表板天气卡片片段缓存：缓存键包含发布时间和刷新状态"""
+
+    @classmethod
+    def setUpTestData(cls):
+        city = City.objects.create(name='成都市', adcode='510100', level=2)
+        user = User.objects.create(username='reader', email='reader@example.com')
+        cls.subscription = Subscription.objects.create(user=user, city=city, email=user.email)
+
+    def setUp(self):
+        cache.clear()
+
+    def render_card(self, temperature, reporttime, refreshing=False):
+        return render_to_string('weather/_weather_card.html', {
+            'item': {
+                'subscription': self.subscription,
+                'weather': {
+                    'city_name': '成都市',
+                    'current': {
+                        'weather': '阴', 'temperature': temperature, 'winddirection': '北',
+                        'windpower': '2', 'humidity': '70', 'reporttime': reporttime,
+                    },
+                    'forecast': [],
+                },
+                'refreshing': refreshing,
+            },
+            'fragment_cache_timeout': FRAGMENT_CACHE_TIMEOUT,
+        })
+
+    def test_same_reporttime_is_cached(self):
+        self.assertIn('15°C', self.render_card('15', '2026-01-01 08:00:00'))
+        # 同一次发布的数据直接使用缓存的片段
+        self.assertIn('15°C', self.render_card('16', '2026-01-01 08:00:00'))
+
+    def test_new_reporttime_invalidates(self):
+        self.render_card('15', '2026-01-01 08:00:00')
+
+        self.assertIn('16°C', self.render_card('16', '2026-01-01 09:00:00'))
+
+    def test_refreshing_is_part_of_key(self):
+        self.assertIn('刷新中', self.render_card('15', '2026-01-01 08:00:00', refreshing=True))
+
+        self.assertNotIn('刷新中', self.render_card('15', '2026-01-01 08:00:00'))
+
+
+FORECAST = [{'casts': [
+    {
+        'date': f'2026-01-0{day}', 'week': str(day), 'dayweather': '晴', 'nightweather': '多云',
+        'daytemp': '22', 'nighttemp': '12', 'daywind': '北', 'nightwind': '北',
+        'daypower': '1-3', 'nightpower': '1-3',
+    }
+    for day in range(1, 5)
+]}]
+
+
+class WeatherApiTests(TestCase):
+    """天气接口：条件请求、压缩、字段投影、批量查询"""
+
+    @classmethod
+    def setUpTestData(cls):
+        province = City.objects.create(name='浙江省', adcode='330000', level=1)
+        city = City.objects.create(name='杭州市', adcode='330100', level=2, parent=province)
+        City.objects.create(name='宁波市', adcode='330200', level=2, parent=province)
+        WeatherData.objects.create(
+            city=city, weather='晴', temperature='20', winddirection='北', windpower='3',
+            humidity='40', reporttime='2026-01-01 08:00:00', forecast_data=FORECAST,
+        )
+        cls.url = reverse('weather:weather_api', args=['330100'])
+        cls.batch_url = reverse('weather:weather_api_batch')
+        cls.last_modified = http_date(timezone.make_aware(datetime(2026, 1, 1, 8)).timestamp())
+
+    def setUp(self):
+        cache.clear()
+
+    def test_weather(self):
+        response = self.client.get(self.url)
+
+        self.assertEqual(response.status_code, 200)
+        data = response.json()
+        self.assertEqual(data['adcode'], '330100')
+        self.assertEqual(data['city_name'], '浙江省 杭州市')
+        self.assertEqual(len(data['forecast']), 4)
+        self.assertTrue(response['ETag'].startswith('"'))
+        self.assertEqual(response['Last-Modified'], self.last_modified)
+        self.assertIn('max-age=60', response['Cache-Control'])
+
+    def test_etag_not_modified(self):
+        etag = self.client.get(self.url)['ETag']
+
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response.content, b'')
+        self.assertEqual(response['ETag'], etag)
+
+    def test_etag_depends_on_fields(self):
+        etag = self.client.get(self.url)['ETag']
+
+        response = self.client.get(self.url, {'fields': 'adcode'}, HTTP_IF_NONE_MATCH=etag)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+
+    def test_gzip_weak_etag(self):
+        plain = self.client.get(self.url)
+
+        response = self.client.get(self.url, HTTP_ACCEPT_ENCODING='gzip, deflate')
+
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        self.assertEqual(response['ETag'], 'W/' + plain['ETag'])
+        self.assertIn('Accept-Encoding', response['Vary'])
+        self.assertEqual(json.loads(gzip.decompress(response.content)), plain.json())
+        # 弱ETag同样可以用于条件请求
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=response['ETag'], HTTP_ACCEPT_ENCODING='gzip')
+        self.assertEqual(response.status_code, 304)
+
+    def test_small_response_not_compressed(self):
+        response = self.client.get(self.url, {'fields': 'adcode'}, HTTP_ACCEPT_ENCODING='gzip')
+
+        self.assertFalse(response.has_header('Content-Encoding'))
+        self.assertTrue(response['ETag'].startswith('"'))
+
+    def test_if_modified_since(self):
+        response = self.client.get(self.url, HTTP_IF_MODIFIED_SINCE=self.last_modified)
+        self.assertEqual(response.status_code, 304)
+
+        earlier = http_date(timezone.make_aware(datetime(2026, 1, 1, 7)).timestamp())
+        response = self.client.get(self.url, HTTP_IF_MODIFIED_SINCE=earlier)
+        self.assertEqual(response.status_code, 200)
+
+    def test_fields_projection(self):
+        response = self.client.get(self.url, {'fields': 'adcode,current.temperature,current.weather'})
+
+        self.assertEqual(response.json(), {
+            'adcode': '330100',
+            'current': {'temperature': '20', 'weather': '晴'},
+        })
+
+    def test_unsupported_field(self):
+        for fields in ('password', 'current.city', 'adcode.weather'):
+            with self.subTest(fields=fields):
+                response = self.client.get(self.url, {'fields': fields})
+                self.assertEqual(response.status_code, 400)
+
+    def test_invalid_adcode(self):
+        for adcode in ('abc', '3301000', '990000'):
+            with self.subTest(adcode=adcode):
+                response = self.client.get(reverse('weather:weather_api', args=[adcode]))
+                self.assertEqual(response.status_code, 404)
+        # 无效的adcode不会写入天气缓存
+        self.assertIsNone(cache.get('weather:current:990000'))
+
+    def test_city_without_weather(self):
+        with mock.patch('weather.services.AsyncWeatherService.get_weather_data', return_value=None) as get_data:
+            response = self.client.get(reverse('weather:weather_api', args=['330200']))
+
+        self.assertEqual(response.status_code, 404)
+        self.assertEqual(get_data.call_count, 2)
+
+    def test_fetch_from_weather_api(self):
+        async def get_weather_data(city_adcode, extensions='all', client=None):
+            return build_payload(city_adcode, extensions)
+
+        with mock.patch('weather.services.AsyncWeatherService.get_weather_data', side_effect=get_weather_data):
+            response = self.client.get(reverse('weather:weather_api', args=['330200']))
+
+        self.assertEqual(response.status_code, 200)
+        data = response.json()
+        self.assertEqual(data['city_name'], '浙江省 宁波市')
+        self.assertEqual(len(data['forecast']), 1)
+        self.assertTrue(WeatherData.objects.filter(city__adcode='330200').exists())
+
+    def test_batch(self):
+        response = self.client.get(self.batch_url, {'adcodes': '330100,330200,330100', 'fields': 'adcode'})
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json(), {
+            'results': {'330100': {'adcode': '330100'}},
+            'missing': ['330200'],
+        })
+
+    def test_batch_invalid_adcode(self):
+        response = self.client.get(self.batch_url, {'adcodes': '330100,990000,abc'})
+
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('990000,abc', response.json()['error'])
+
+    @override_settings(WEATHER_API_BATCH_LIMIT=2)
+    def test_batch_limit(self):
+        response = self.client.get(self.batch_url, {'adcodes': '330000,330100,330200'})
+        self.assertEqual(response.status_code, 400)
+
+        response = self.client.get(self.batch_url, {'adcodes': '330100,330200'})
+        self.assertEqual(response.status_code, 200)
+
+    def test_adcodes_cache_invalidated(self):
+        self.assertEqual(self.client.get(reverse('weather:weather_api', args=['330300'])).status_code, 404)
+
+        city = City.objects.create(name='温州市', adcode='330300', level=2)
+        WeatherData.objects.create(
+            city=city, weather='阴', temperature='18', winddirection='东', windpower='2',
+            humidity='60', reporttime='2026-01-01 08:00:00',
+        )
+
+        self.assertEqual(self.client.get(reverse('weather:weather_api', args=['330300'])).status_code, 200)
@@ -1,9 +1,12 @@
 from django.urls import path
-from . import views
+from . import views, api_views
 
 app_name = 'weather'
 
 urlpatterns = [
     path('', views.home_view, name='home'),
     path('dashboard/', views.dashboard_view, name='dashboard'),
+    path('api/weather/', api_views.weather_api_batch, name='weather_api_batch'),
+    path('api/weather/<str:adcode>/', api_views.weather_api, name='weather_api'),
+    path('dashboard/stream/', views.weather_stream, name='weather_stream'),
 ]
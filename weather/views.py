@@ -1,18 +1,60 @@
+import asyncio
+import contextlib
+import json
+import time
+from datetime import timedelta
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.http import StreamingHttpResponse
 from django.shortcuts import render
-from django.contrib.auth.decorators import login_required
+from django.template.loader import render_to_string
+from django.utils import timezone
+from subscriptions.fragments import FRAGMENT_CACHE_TIMEOUT
 from subscriptions.models import Subscription
-from .services import WeatherService
+from weatherblog.decorators import ais_authenticated, async_login_required
+from .broker import listen_weather_updates
+from .read_model import aget_weather, aget_weather_many
+from .tasks import request_weather_refresh
+
+
+async def load_dashboard_weather(subscriptions):
+    """
+    读取订阅城市最近一次保存的天气，打开仪表板不直接请求天气API
+    没有数据或数据已过期的城市提交后台刷新并标记为正在刷新，
+    刷新完成后通过天气推送更新页面上的卡片。
+    :param subscriptions: 订阅列表
+    :return: [{'subscription': 订阅, 'weather': 天气信息或None, 'refreshing': 是否正在刷新}, ...]
+    """
+    entries = await aget_weather_many([subscription.city.adcode for subscription in subscriptions])
+    refresh_before = timezone.now() - timedelta(seconds=settings.WEATHER_REFRESH_INTERVAL)
+    weather_data = []
+
+    for subscription in subscriptions:
+        city_adcode = subscription.city.adcode
+        entry = entries.get(city_adcode)
+        refreshing = entry is None or entry['updated_at'] < refresh_before
+        if refreshing:
+            await sync_to_async(request_weather_refresh)(city_adcode)
 
+        weather_data.append({
+            'subscription': subscription,
+            'weather': entry,
+            'refreshing': refreshing,
+        })
 
-def home_view(request):
+    return weather_data
+
+
+async def home_view(request):
     """首页视图"""
-    if request.user.is_authenticated:
-        return dashboard_view(request)
-    return render(request, 'weather/home.html')
+    if await ais_authenticated(request):
+        return await dashboard_view(request)
+    return await sync_to_async(render)(request, 'weather/home.html')
 
 
-@login_required
-def dashboard_view(request):
+@async_login_required
+async def dashboard_view(request):
     """用户仪表板"""
     # 获取用户的订阅
     subscriptions = Subscription.objects.filter(
@@ -20,22 +62,90 @@ def dashboard_view(request):
         is_active=True
     ).select_related('city')
 
-    # 获取天气数据
-    weather_service = WeatherService()
-    weather_data = []
-
-    for subscription in subscriptions[:6]:  # 最多显示6个城市的天气
-        weather_info = weather_service.get_weather_for_email(subscription.city.adcode)
-        if weather_info:
-            weather_data.append({
-                'subscription': subscription,
-                'weather': weather_info
-            })
+    # 获取天气数据（最多显示6个城市的天气）
+    displayed = [subscription async for subscription in subscriptions[:6]]
+    weather_data = await load_dashboard_weather(displayed)
 
     context = {
         'subscriptions': subscriptions,
         'weather_data': weather_data,
-        'total_subscriptions': subscriptions.count()
+        'total_subscriptions': await subscriptions.acount(),
+        'fragment_cache_timeout': FRAGMENT_CACHE_TIMEOUT,
     }
 
-    return render(request, 'weather/dashboard.html', context)
+    # 模板渲染会读取会话和消息，放到线程中执行
+    return await sync_to_async(render)(request, 'weather/dashboard.html', context)
+
+
+async def _weather_events(subscriptions):
+    """
+    生成仪表板天气推送的SSE事件
+    订阅城市有新的天气数据时推送渲染好的天气卡片，空闲时定期发送心跳；
+    连接保持WEATHER_STREAM_MAX_AGE秒后结束，浏览器会自动重连，
+    避免客户端断开后没有察觉的连接一直占用。
+    """
+    by_adcode = {subscription.city.adcode: subscription for subscription in subscriptions}
+    updates = listen_weather_updates(list(by_adcode))
+    next_update = None
+    deadline = time.monotonic() + settings.WEATHER_STREAM_MAX_AGE
+
+    yield f"retry: {settings.WEATHER_STREAM_HEARTBEAT * 1000}\n\n"
+    try:
+        while time.monotonic() < deadline:
+            if next_update is None:
+                next_update = asyncio.ensure_future(updates.__anext__())
+            done, _ = await asyncio.wait({next_update}, timeout=settings.WEATHER_STREAM_HEARTBEAT)
+            if not done:
+                yield ": ping\n\n"
+                continue
+
+            try:
+                message = next_update.result()
+            except StopAsyncIteration:
+                # 订阅连接已断开，结束推送由浏览器重连
+                break
+            finally:
+                next_update = None
+            subscription = by_adcode.get(message['adcode'])
+            entry = await aget_weather(message['adcode'])
+            if subscription is None or entry is None:
+                continue
+
+            html = await sync_to_async(render_to_string)('weather/_weather_card.html', {
+                'item': {
+                    'subscription': subscription,
+                    'weather': entry,
+                    'refreshing': False,
+                },
+                'fragment_cache_timeout': FRAGMENT_CACHE_TIMEOUT,
+            })
+            data = json.dumps({'adcode': message['adcode'], 'html': html}, ensure_ascii=False)
+            yield f"event: weather\ndata: {data}\n\n"
+    finally:
+        if next_update is not None:
+            # 等待正在读取的__anext__真正结束后再关闭，否则aclose()会因生成器仍在运行而报错
+            next_update.cancel()
+            with contextlib.suppress(asyncio.CancelledError):
+                await next_update
+        await updates.aclose()
+
+
+@async_login_required
+async def weather_stream(request):
+    """仪表板天气推送（SSE），需要以ASGI方式运行"""
+    subscriptions = [
+        subscription async for subscription in Subscription.objects.filter(
+            user=request.user,
+            is_active=True
+        ).select_related('city')[:6]
+    ]
+
+    return StreamingHttpResponse(
+        _weather_events(subscriptions),
+        content_type='text/event-stream',
+        headers={
+            'Cache-Control': 'no-cache',
+            # 关闭Nginx对推送内容的缓冲
+            'X-Accel-Buffering': 'no',
+        }
+    )
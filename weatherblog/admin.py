@@ -3,8 +3,10 @@ from django.contrib.auth.forms import AuthenticationForm
 from django import forms
 from django.core.exceptions import ValidationError
 
+from accounts.forms import ThrottledAuthenticationMixin
 
-class CustomAuthenticationForm(AuthenticationForm):
+
+class CustomAuthenticationForm(ThrottledAuthenticationMixin, AuthenticationForm):
     """自定义登录表单 - 使用邮箱登录"""
 
     username = forms.EmailField(
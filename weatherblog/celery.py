@@ -1,6 +1,10 @@
 import os
+from datetime import timedelta
+
 from celery import Celery
+from celery.signals import worker_process_init
 from django.conf import settings
+from django.utils import timezone
 
 # 设置Django设置模块
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'weatherblog.settings')
@@ -14,6 +18,46 @@ app.config_from_object('django.conf:settings', namespace='CELERY')
 # 自动发现任务
 app.autodiscover_tasks()
 
+# 延后任务应用：使用单独的Redis库（CELERY_DEFERRED_*配置）和更长的可见性超时。
+# 需要等待较久的任务先进入延后队列，由延后worker保存到期后再转发到主队列执行，
+# 这样主队列的可见性超时可以保持较短，acks_late任务在worker退出后能尽快重新投递。
+deferred_app = Celery('weatherblog_deferred', set_as_current=False)
+deferred_app.config_from_object('django.conf:settings', namespace='CELERY_DEFERRED')
+
+
+@deferred_app.task(name='weatherblog.forward_deferred')
+def forward_deferred(task_name, args=None, kwargs=None, queue=None):
+    """延后任务到期后转发到主队列执行"""
+    app.send_task(task_name, args=args, kwargs=kwargs, queue=queue)
+
+
+def apply_deferred(task, args=None, kwargs=None, eta=None, countdown=None, queue=None):
+    """
+    提交延后执行的任务
+    延后时间在主队列可见性超时的一半以内时直接带eta提交，更久的通过延后队列转发。
+    :param task: 任务
+    :param eta: 执行时间
+    :param countdown: 延后秒数（与eta二选一）
+    :param queue: 执行任务的队列，为空时使用任务的默认路由
+    """
+    now = timezone.now()
+    if eta is None:
+        eta = now + timedelta(seconds=countdown or 0)
+    threshold = settings.CELERY_BROKER_TRANSPORT_OPTIONS['visibility_timeout'] / 2
+    if app.conf.task_always_eager or (eta - now).total_seconds() <= threshold:
+        options = {'queue': queue} if queue else {}
+        return task.apply_async(args=args, kwargs=kwargs, eta=eta, **options)
+    return forward_deferred.apply_async(args=[task.name, args, kwargs, queue], eta=eta)
+
+
+@worker_process_init.connect
+def load_email_templates(**kwargs):
+    """worker进程启动时加载预编译的邮件模板"""
+    from subscriptions.email_templates import load_compiled_templates
+    if settings.EMAIL_TEMPLATE_PRECOMPILE:
+        load_compiled_templates()
+
+
 # 调试信息
 @app.task(bind=True)
 def debug_task(self):
@@ -0,0 +1,24 @@
+from functools import wraps
+
+from asgiref.sync import sync_to_async
+from django.contrib.auth.views import redirect_to_login
+
+
+async def ais_authenticated(request):
+    """
+    在异步视图中判断用户是否已登录
+    request.user需要读取会话和用户表，不能直接在事件循环中访问。
+    """
+    return await sync_to_async(lambda: request.user.is_authenticated)()
+
+
+def async_login_required(view_func):
+    """异步视图使用的login_required（Django 4.2的login_required不支持异步视图）"""
+
+    @wraps(view_func)
+    async def _wrapper_view(request, *args, **kwargs):
+        if await ais_authenticated(request):
+            return await view_func(request, *args, **kwargs)
+        return redirect_to_login(request.get_full_path())
+
+    return _wrapper_view
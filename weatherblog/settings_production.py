@@ -4,6 +4,7 @@
 或设置环境变量: export DJANGO_SETTINGS_MODULE=weatherblog.settings_production
 """
 
+import json
 import os
 from pathlib import Path
 
@@ -32,9 +33,11 @@ INSTALLED_APPS = [
     "accounts",
     "weather",
     "subscriptions",
+    "monitoring",
 ]
 
 MIDDLEWARE = [
+    "monitoring.middleware.RequestProfilingMiddleware",  # 未开启请求性能分析时不加载
     "django.middleware.security.SecurityMiddleware",
     "django.contrib.sessions.middleware.SessionMiddleware",
     "django.middleware.common.CommonMiddleware",
@@ -135,10 +138,108 @@ CELERY_ACCEPT_CONTENT = ['json']
 CELERY_TASK_SERIALIZER = 'json'
 CELERY_RESULT_SERIALIZER = 'json'
 CELERY_TIMEZONE = TIME_ZONE
+# acks_late任务在worker退出后经过可见性超时才会重新投递，保持较短；
+# 每日任务运行超过该时间时会被重新投递并从同一投递任务继续，投递记录的认领保证不会重复发送
+CELERY_BROKER_TRANSPORT_OPTIONS = {'visibility_timeout': 3600}
+# 延后队列（weatherblog.celery.deferred_app）：延后超过主队列可见性超时一半的任务
+# （如延后到第二天投递窗口的邮件）在这里等待，到期后转发到主队列。使用单独的Redis库，
+# 可见性超时需要覆盖最长的延后时间
+CELERY_DEFERRED_BROKER_URL = os.getenv('REDIS_DEFERRED_URL', 'redis://localhost:6379/2')
+CELERY_DEFERRED_BROKER_TRANSPORT_OPTIONS = {'visibility_timeout': 2 * 24 * 3600}
+CELERY_DEFERRED_TASK_DEFAULT_QUEUE = 'email_deferred'
+# 重试任务使用独立队列，由单独的低并发worker处理，不与每日发送任务争抢
+CELERY_TASK_ROUTES = {
+    'subscriptions.tasks.retry_weather_email': {'queue': 'email_retry'},
+}
+
+# Cache settings（限速计数等需要在多个worker之间共享）
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+        'LOCATION': os.getenv('REDIS_CACHE_URL', 'redis://localhost:6379/1'),
+    }
+}
 
 # Weather API settings
 WEATHER_API_KEY = os.getenv('WEATHER_API_KEY', 'you key')
-WEATHER_API_URL = 'https://restapi.amap.com/v3/weather/weatherInfo'
+WEATHER_API_URL = os.getenv('WEATHER_API_URL', 'https://restapi.amap.com/v3/weather/weatherInfo')
+# 城市当前天气读模型的缓存时间（秒），保存新的天气数据时会立即更新
+WEATHER_READ_MODEL_TIMEOUT = 24 * 3600
+# 天气接口一次最多查询的城市数
+WEATHER_API_BATCH_LIMIT = 20
+# 天气数据超过该时间（秒）后，打开仪表板时在后台刷新
+WEATHER_REFRESH_INTERVAL = 1800
+# 天气更新推送方式：redis 通过Redis发布订阅在Web进程和Celery worker之间推送；memory 仅推送给同一进程，用于开发和测试
+WEATHER_UPDATES_BROKER = 'redis'
+WEATHER_UPDATES_REDIS_URL = os.getenv('REDIS_URL', 'redis://localhost:6379/0')
+# 仪表板天气推送连接的心跳间隔和最长保持时间（秒），到时后浏览器会自动重连
+WEATHER_STREAM_HEARTBEAT = 15
+WEATHER_STREAM_MAX_AGE = 300
+
+# Prometheus指标配置
+# 多进程指标目录，Web进程和Celery worker必须使用同一目录，每次重启服务前清空；为空时只统计当前进程
+PROMETHEUS_MULTIPROC_DIR = os.getenv('PROMETHEUS_MULTIPROC_DIR', '/home/weatherapp/projects/weatherblog/run/prometheus')
+METRICS_ALLOWED_IPS = ['127.0.0.1']  # 允许访问/metrics的IP，管理员登录后也可以访问
+METRICS_CELERY_QUEUES = ['celery', 'email_retry']  # 需要统计积压任务数的队列
+
+# 请求性能分析（记录查询次数、上游请求耗时，慢请求写入后台并按采样率保存cProfile结果）
+REQUEST_PROFILING_ENABLED = os.getenv('REQUEST_PROFILING_ENABLED') == '1'
+REQUEST_PROFILING_SLOW_MS = 500  # 超过该耗时（毫秒）的请求记为慢请求
+REQUEST_PROFILING_SAMPLE_RATE = 0.05  # 运行cProfile的请求比例
+REQUEST_PROFILING_DIR = BASE_DIR / 'logs' / 'profiles'
+REQUEST_PROFILING_EXCLUDE = ['/static/', '/media/', '/metrics', '/dashboard/stream/']
+REQUEST_PROFILING_RETENTION_DAYS = 14  # 慢请求记录和分析文件的保留天数
+
+# 邮箱验证链接有效期（小时）
+EMAIL_VERIFICATION_EXPIRE_HOURS = 48
+# 注册后超过该天数仍未验证邮箱的账户会被清理
+UNVERIFIED_USER_RETENTION_DAYS = 7
+# 清理任务每批删除的行数、每次运行最多执行的批数
+ACCOUNT_CLEANUP_BATCH_SIZE = 1000
+ACCOUNT_CLEANUP_MAX_BATCHES = 50
+
+# 登录、注册限流配置（滑动窗口，计数保存在缓存中）
+AUTH_THROTTLE_ENABLED = True
+AUTH_THROTTLE_RATES = {
+    'login_ip': (20, 300),  # 每个IP 5分钟内最多20次登录失败
+    'login_account': (5, 900),  # 每个账号在同一IP 15分钟内最多5次登录失败
+    'register_ip': (5, 3600),  # 每个IP 1小时内最多5次注册请求
+}
+# 代理设置的客户端IP请求头，为空时使用REMOTE_ADDR
+AUTH_THROTTLE_CLIENT_IP_HEADER = 'HTTP_X_REAL_IP'
+
+# 管理后台统计缓存时间（秒），用户、订阅、邮件变化时会提前失效
+ADMIN_STATS_CACHE_TIMEOUT = 300
+# 管理后台列表超过该行数时使用数据库统计信息估算总数，不再执行COUNT(*)
+ADMIN_ESTIMATED_COUNT_THRESHOLD = 100000
+
+# 邮件日志正文存储配置
+EMAIL_BODY_COMPRESSION = True  # 使用zlib压缩存储邮件正文
+
+# 邮件模板预编译配置（内联CSS、压缩空白，由 build_email_templates 命令生成）
+EMAIL_TEMPLATE_PRECOMPILE = True
+EMAIL_TEMPLATE_BUILD_DIR = os.path.join(BASE_DIR, 'build', 'email_templates')
+
+# 邮件发送限速配置（QQ/企业邮箱SMTP有每分钟、每天的发送上限）
+EMAIL_SEND_RATE_LIMIT_PER_MINUTE = 20
+EMAIL_SEND_RATE_LIMIT_PER_DAY = 1000
+EMAIL_DELIVERY_WINDOW = (6, 22)  # 投递时间窗口（开始小时, 结束小时）
+EMAIL_SEND_MAX_WAIT = 60  # 等待时间槽超过该秒数时改为延后发送
+
+# 发件账号池（为空时只使用上面的EMAIL_HOST_USER账号）
+# 每个账号可配置: username, password, host, port, use_tls, from_email, per_minute, per_day
+# 例如: [{'username': 'a@qq.com', 'password': '授权码', 'per_minute': 20, 'per_day': 1000}]
+EMAIL_SENDER_ACCOUNTS = json.loads(os.getenv('EMAIL_SENDER_ACCOUNTS', '[]'))
+EMAIL_SENDER_DRAIN_SECONDS = 1800  # 账号被限流后的摘除时长（秒）
+
+# 投递记录停留在"发送中"超过该秒数后视为worker异常退出，可被重新认领
+EMAIL_DELIVERY_CLAIM_TIMEOUT = 600
+
+# 失败邮件重试配置（指数退避，超过次数后转入死信表）
+EMAIL_RETRY_MAX_ATTEMPTS = 5
+EMAIL_RETRY_BASE_DELAY = 60  # 第一次重试前等待的秒数
+EMAIL_RETRY_MAX_DELAY = 3600  # 重试等待时间上限（秒）
+EMAIL_RETRY_QUEUE = 'email_retry'
 
 # 安全配置
 SECURE_BROWSER_XSS_FILTER = True
@@ -262,6 +363,18 @@ SIMPLEUI_CONFIG = {
                 }
             ]
         },
+        {
+            'app': 'monitoring',
+            'name': '系统监控',
+            'icon': 'fas fa-heartbeat',
+            'models': [
+                {
+                    'name': '慢请求',
+                    'icon': 'fas fa-hourglass-half',
+                    'url': '/admin/monitoring/slowrequest/'
+                }
+            ]
+        },
         {
             'name': '定时任务',
             'icon': 'fas fa-clock',
@@ -0,0 +1,172 @@
+import heapq
+import time
+from array import array
+from contextlib import contextmanager, nullcontext
+
+# 耗时统计中的阶段（按一封邮件的处理顺序）
+STAGES = [
+    ('claim', '认领投递'),
+    ('wait', '等待发送名额'),
+    ('amap', '天气API'),
+    ('weather_db', '天气数据读写'),
+    ('render', '模板渲染'),
+    ('smtp', 'SMTP发送'),
+    ('log', '写入日志'),
+    ('record', '记录投递结果'),
+]
+
+STAGE_LABELS = dict(STAGES)
+
+# 最慢城市、最慢收件人各保留的条数
+SLOWEST_LIMIT = 10
+
+# 投递任务中保留的单次执行统计条数（第一次和最近的几次）
+MAX_TIMING_PASSES = 20
+
+# 单次执行的类型
+PASS_LABELS = {
+    'daily': '每日任务',
+    'manual': '手动发送',
+    'deferred': '延后发送',
+    'retry': '失败重试',
+}
+
+
+def percentile(sorted_values, fraction):
+    """已排序数据的百分位数（最近秩）"""
+    if not sorted_values:
+        return 0
+    index = min(len(sorted_values) - 1, max(0, int(round(fraction * len(sorted_values))) - 1))
+    return sorted_values[index]
+
+
+def stage(timer, name, key=None):
+    """timer为None时不计时，方便在可选计时的代码中使用"""
+    return timer.stage(name, key) if timer is not None else nullcontext()
+
+
+class StageTimer:
+    """
+    投递任务的分阶段计时器
+    记录每个阶段每次执行的耗时（用于计算p50/p95）、按城市累计天气获取和渲染的耗时，
+    以及每个收件人的总耗时（只保留最慢的若干个）。
+    """
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.durations = {}
+        self.city_totals = {}
+        self.slowest_recipients = []
+
+    @contextmanager
+    def stage(self, name, key=None):
+        """
+        记录一个阶段的耗时
+        :param name: 阶段名称，见STAGES
+        :param key: 城市名称，指定时计入该城市的累计耗时
+        """
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(name, time.perf_counter() - started, key)
+
+    def add(self, name, seconds, key=None):
+        self.durations.setdefault(name, array('d')).append(seconds)
+        if key is not None:
+            self.city_totals[key] = self.city_totals.get(key, 0) + seconds
+
+    @contextmanager
+    def recipient(self, email):
+        """记录处理一个收件人的总耗时"""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            entry = (time.perf_counter() - started, email)
+            if len(self.slowest_recipients) < SLOWEST_LIMIT:
+                heapq.heappush(self.slowest_recipients, entry)
+            else:
+                heapq.heappushpop(self.slowest_recipients, entry)
+
+    def summary(self):
+        """
+        汇总耗时统计
+        :return: 可以保存为JSON的字典
+        """
+        stages = {}
+        for name, values in self.durations.items():
+            values = sorted(values)
+            stages[name] = {
+                'count': len(values),
+                'total': round(sum(values), 3),
+                'p50': round(percentile(values, 0.5), 4),
+                'p95': round(percentile(values, 0.95), 4),
+                'max': round(values[-1], 4),
+            }
+
+        slowest_cities = heapq.nlargest(SLOWEST_LIMIT, self.city_totals.items(), key=lambda item: item[1])
+        return {
+            'wall': round(time.perf_counter() - self.started, 3),
+            'stages': stages,
+            'slowest_cities': [[city, round(seconds, 3)] for city, seconds in slowest_cities],
+            'slowest_recipients': [
+                [email, round(seconds, 3)]
+                for seconds, email in sorted(self.slowest_recipients, reverse=True)
+            ],
+        }
+
+
+def merge_timing(previous, summary, label):
+    """
+    把一次执行的耗时统计合并到投递任务已有的统计中
+    同一个投递任务会执行多次（中断后恢复、延后发送、失败重试），每次都要计入，不能覆盖。
+    次数、合计耗时相加，最大值取较大者，p50/p95按次数加权（近似值）；
+    每次执行的分阶段统计另外保存在passes中。
+    :param previous: 已有的统计（StageTimer.summary()或本函数的返回值），可以为空
+    :param summary: 本次执行的StageTimer.summary()
+    :param label: 本次执行的类型，如 daily / deferred / retry
+    :return: 合并后的统计
+    """
+    current = {'label': label, 'wall': summary['wall'], 'stages': summary['stages']}
+    if not previous:
+        return dict(summary, passes=[current])
+
+    passes = previous.get('passes') or [
+        {'label': '', 'wall': previous['wall'], 'stages': previous['stages']}
+    ]
+    passes = passes + [current]
+    if len(passes) > MAX_TIMING_PASSES:
+        passes = passes[:1] + passes[1 - MAX_TIMING_PASSES:]
+
+    stages = {}
+    for name in previous['stages'].keys() | summary['stages'].keys():
+        old, new = previous['stages'].get(name), summary['stages'].get(name)
+        if old is None or new is None:
+            stages[name] = old or new
+            continue
+        count = old['count'] + new['count']
+        stages[name] = {
+            'count': count,
+            'total': round(old['total'] + new['total'], 3),
+            'p50': round((old['p50'] * old['count'] + new['p50'] * new['count']) / count, 4),
+            'p95': round((old['p95'] * old['count'] + new['p95'] * new['count']) / count, 4),
+            'max': max(old['max'], new['max']),
+        }
+
+    city_totals = dict(previous['slowest_cities'])
+    for city, seconds in summary['slowest_cities']:
+        city_totals[city] = round(city_totals.get(city, 0) + seconds, 3)
+    slowest_cities = heapq.nlargest(SLOWEST_LIMIT, city_totals.items(), key=lambda item: item[1])
+    slowest_recipients = heapq.nlargest(
+        SLOWEST_LIMIT, previous['slowest_recipients'] + summary['slowest_recipients'],
+        key=lambda item: item[1],
+    )
+
+    return {
+        'wall': round(previous['wall'] + summary['wall'], 3),
+        'stages': stages,
+        'slowest_cities': [list(item) for item in slowest_cities],
+        'slowest_recipients': [list(item) for item in slowest_recipients],
+        'passes': passes,
+    }
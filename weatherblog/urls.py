@@ -21,6 +21,7 @@ from django.conf import settings
 from django.conf.urls.static import static
 from subscriptions.admin_views import admin_dashboard, user_statistics
 from subscriptions.admin import toggle_subscription
+from monitoring.views import metrics_view
 from .admin import CustomAuthenticationForm
 
 # 设置默认admin站点的登录表单
@@ -34,6 +35,7 @@ urlpatterns = [
     path("admin/user-statistics/", user_statistics, name="admin_user_statistics"),
     path("admin/toggle-subscription/<int:subscription_id>/", toggle_subscription, name="toggle_subscription"),
     path("admin/", admin.site.urls),
+    path("metrics", metrics_view, name="metrics"),
     path("", include("weather.urls")),
     path("accounts/", include("accounts.urls")),
     path("subscriptions/", include("subscriptions.urls")),